@@ -7,11 +7,7 @@ import re
 import json
 import datetime
 import time
-import base64
-from bs4 import BeautifulSoup
 import colorlog
-from io import BytesIO
-from PIL import Image
 import asyncio
 
 # 添加项目根目录到sys.path
@@ -22,14 +18,94 @@ sys.path.append(
 from app.config import *
 from app.api import *
 from app.switch import load_switch, save_switch
-from app.scripts.QFNUGetFreeClassrooms.src.utils.session_manager import (
-    get_session,
-    reset_session,
-)
-from app.scripts.QFNUGetFreeClassrooms.src.utils.captcha_ocr import get_ocr_res
 from app.scripts.QFNUGetFreeClassrooms.src.core.get_room_classtable import (
+    get_cached_result,
     get_room_classtable,
 )
+from app.scripts.QFNUGetFreeClassrooms.src.core import login as login_core
+from app.scripts.QFNUGetFreeClassrooms.src.core.login import (
+    check_session_valid,
+    ensure_login as ensure_login_with_data_dir,
+    generate_encoded_string,
+    get_cookie_file,
+    login_with_credentials,
+)
+from app.scripts.QFNUGetFreeClassrooms.src.core.term_calendar import (
+    SEMESTER_START_DATES,
+    get_current_period,
+    get_current_term,
+    get_current_week_and_day,
+)
+from app.scripts.QFNUGetFreeClassrooms.src.core.occupancy_index import (
+    OccupancyIndex,
+)
+from app.scripts.QFNUGetFreeClassrooms.src.core.free_rooms import (
+    compute_free_rooms,
+    compute_free_runs,
+    render_free_runs_message,
+    extract_occupied_rooms,
+    render_free_rooms_message,
+    format_age,
+    get_all_classrooms,
+    WEEKDAY_NAMES,
+)
+from app.scripts.QFNUGetFreeClassrooms.src.core.room_catalog import (
+    get_catalog,
+    get_default_classrooms,
+    format_catalog_status,
+)
+from app.scripts.QFNUGetFreeClassrooms.src.core.snapshot_store import (
+    get_snapshot_or_stale,
+    get_change_log,
+    add_change_listener,
+    configure_storage,
+    restore_snapshots,
+    refresh_snapshot,
+    format_storage_status,
+)
+from app.scripts.QFNUGetFreeClassrooms.src.core.http_api import start_http_api
+from app.scripts.QFNUGetFreeClassrooms.src.core.room_schedule import (
+    get_room_bookings,
+    render_room_schedule_message,
+)
+from app.scripts.QFNUGetFreeClassrooms.src.core.search_index import (
+    render_course_search_message,
+)
+from app.scripts.QFNUGetFreeClassrooms.src.utils.bounded_cache import (
+    BoundedCache,
+    format_cache_stats,
+)
+from app.scripts.QFNUGetFreeClassrooms.src.utils.upstream_client import (
+    upstream_client,
+)
+from app.scripts.QFNUGetFreeClassrooms.src.utils.captcha_ocr import format_ocr_stats
+from app.scripts.QFNUGetFreeClassrooms.src.utils.session_manager import (
+    lease_session,
+    session_manager,
+)
+from app.scripts.QFNUGetFreeClassrooms.src.core.prefetch_scheduler import (
+    PrefetchScheduler,
+)
+from app.scripts.QFNUGetFreeClassrooms.src.core.prefetch_pipeline import (
+    PrefetchPipeline,
+    LOOKAHEAD_WEEKS,
+)
+from app.scripts.QFNUGetFreeClassrooms.src.core.subscriptions import (
+    SubscriptionManager,
+    format_room_list,
+    format_subscription,
+)
+from app.scripts.QFNUGetFreeClassrooms.src.utils.outbox import OutboundQueue
+from app.scripts.QFNUGetFreeClassrooms.src.utils.trace_log import (
+    format_log_stats,
+    log_payload,
+    set_trace,
+)
+from app.scripts.QFNUGetFreeClassrooms.src.utils.deadline import (
+    STAGE_LOGIN,
+    Deadline,
+    format_deadline_stats,
+)
 from app.api import send_group_msg, send_private_msg, delete_msg
 
 
@@ -40,19 +116,44 @@ DATA_DIR = os.path.join(
     "QFNUGetFreeClassrooms",
 )
 
-
-# 开学日期配置
-SEMESTER_START_DATES = {
-    "2023-2024-1": "2023-09-04",  # 2023-2024学年第一学期开学日期
-    "2023-2024-2": "2024-02-26",  # 2023-2024学年第二学期开学日期
-    "2024-2025-1": "2024-09-02",  # 2024-2025学年第一学期开学日期
-    "2024-2025-2": "2025-02-17",  # 2024-2025学年第二学期开学日期
-}
+# 启用原始响应归档和占用索引持久化，并映射上次保存的索引；
+# 重启后的查询直接由恢复的快照响应并标明数据时效，会话校验和重新拉取由预取调度器在后台完成
+configure_storage(DATA_DIR)
+restore_snapshots()
 
 
 # 添加全局变量存储消息ID
 QUERY_MESSAGE_IDS = []
 
+# 查询结果发出后，延迟多少秒撤回"正在查询"的消息
+PLACEHOLDER_DELETE_DELAY = 0.5
+
+# 出站消息队列，按群排队并限速，发送和撤回都不阻塞处理协程
+outbox = OutboundQueue(send_group_msg, send_private_msg, delete_msg)
+
+
+# 发送群消息，经由出站队列
+async def send_group_msg(websocket, group_id, message):
+    outbox.send_group(websocket, group_id, message)
+
+
+# 发送私聊消息，经由出站队列
+async def send_private_msg(websocket, user_id, message):
+    outbox.send_private(websocket, user_id, message)
+
+
+# 撤回消息，经由出站队列
+async def delete_msg(websocket, message_id):
+    outbox.delete_later(websocket, message_id)
+
+
+# 撤回"正在查询"的消息
+def delete_query_placeholders(websocket):
+    """在查询结果发出后延迟撤回已发出的"正在查询"消息"""
+    for placeholder_id in QUERY_MESSAGE_IDS:
+        outbox.delete_later(websocket, placeholder_id, PLACEHOLDER_DELETE_DELAY)
+    QUERY_MESSAGE_IDS.clear()
+
 
 # 查看功能开关状态
 def load_function_status(group_id):
@@ -88,12 +189,6 @@ async def save_account_and_password(
         )
 
 
-def load_account_and_password():
-    """加载账号和密码"""
-    with open(os.path.join(DATA_DIR, "account.json"), "r") as f:
-        return json.load(f)
-
-
 # 处理开关状态
 async def toggle_function_status(websocket, group_id, message_id, authorized):
     if not authorized:
@@ -133,7 +228,9 @@ def parse_classroom_schedule(html_content, day_of_week=None, time_slot=None):
     返回:
         dict: 按天和时间段组织的教室课程安排字典，格式为 {day: {time_slot: {classroom: course_info}}}
     """
-    # 解析HTML
+    # 解析HTML，bs4 只在这里用到，延迟导入以缩短插件加载时间
+    from bs4 import BeautifulSoup
+
     soup = BeautifulSoup(html_content, "html.parser")
 
     # 获取所有教室行
@@ -281,337 +378,155 @@ def format_free_classrooms(free_classrooms):
     return "\n".join(result)
 
 
-# 处理验证码
-async def handle_captcha():
-    """获取并识别验证码"""
-    session = get_session()
-    rand_code_url = "http://zhjw.qfnu.edu.cn/jsxsd/verifycode.servlet"
-    response = session.get(rand_code_url)
+# 确保登录状态
+async def ensure_login():
+    """确保已登录状态，如果会话无效则重新登录"""
+    return await ensure_login_with_data_dir(DATA_DIR)
 
-    if response.status_code != 200:
-        logging.error(f"请求验证码失败，状态码: {response.status_code}")
-        return None
 
-    try:
-        image = Image.open(BytesIO(response.content))
-        return get_ocr_res(image)
-    except Exception as e:
-        logging.error(f"无法识别验证码: {e}")
-        return None
+# 以下函数已移到 src/core/login.py，保留原来的名称和参数，供直接从 main 导入的旧代码使用
 
 
-# 生成登录所需的encoded字符串
-def generate_encoded_string(user_account, user_password):
-    """生成登录所需的encoded字符串"""
-    # 对账号和密码分别进行base64编码
-    account_b64 = base64.b64encode(user_account.encode()).decode()
-    password_b64 = base64.b64encode(user_password.encode()).decode()
+# 加载账号密码
+def load_account_and_password():
+    """加载数据目录中的账号和密码"""
+    return login_core.load_account_and_password(DATA_DIR)
 
-    # 拼接编码后的字符串
-    encoded = f"{account_b64}%%%{password_b64}"
 
-    return encoded
+# 处理验证码
+async def handle_captcha():
+    """在当前会话上获取并识别验证码，返回识别结果"""
+    with lease_session() as session:
+        return (await login_core.handle_captcha(session))[1]
 
 
 # 执行登录操作
 async def login(random_code, encoded):
-    """执行登录操作"""
-    # 登录请求URL
-    login_url = "http://zhjw.qfnu.edu.cn/jsxsd/xk/LoginToXkLdap"
-    session = get_session()
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.116 Safari/537.36",
-        "Origin": "http://zhjw.qfnu.edu.cn",
-        "Referer": "http://zhjw.qfnu.edu.cn/",
-    }
-
-    data = {
-        "userAccount": "",
-        "userPassword": "",
-        "RANDOMCODE": random_code,
-        "encoded": encoded,
-    }
-
-    return session.post(login_url, headers=headers, data=data, timeout=10)
+    """在当前会话上执行登录操作"""
+    with lease_session() as session:
+        return await login_core.login(session, random_code, encoded)
 
 
 # 模拟登录过程
 async def simulate_login(user_account, user_password):
-    """模拟登录过程"""
-    session = get_session()
-    # 访问教务系统首页，获取必要的cookie
-    response = session.get("http://zhjw.qfnu.edu.cn/jsxsd/")
-    if response.status_code != 200:
-        logging.error("无法访问教务系统首页，请检查网络连接或教务系统的可用性。")
-        return False
-
-    for attempt in range(3):
-        random_code = await handle_captcha()
-        logging.info(f"验证码: {random_code}")
-        encoded = generate_encoded_string(user_account, user_password)
-        response = await login(random_code, encoded)
-        logging.info(f"登录响应: {response.status_code}")
-
-        if response.status_code == 200:
-            if "验证码错误" in response.text:
-                logging.warning(f"验证码识别错误，重试第 {attempt + 1} 次")
-                continue
-            if "密码错误" in response.text or "账号或密码错误" in response.text:
-                logging.error("用户名或密码错误")
-                return False
-
-            # 检查是否成功登录
-            main_page = session.get(
-                "http://zhjw.qfnu.edu.cn/jsxsd/framework/xsMain.jsp"
-            )
-            if main_page.status_code != 200 or "登录" in main_page.text:
-                logging.error("登录失败，无法访问主页")
-                return False
-
-            logging.info("登录成功!")
-            return True
-        else:
-            logging.error("登录失败")
-            return False
-
-    logging.error("验证码识别错误，请重试")
-    return False
-
-
-# 检查会话是否有效
-async def check_session_valid():
-    """检查当前会话是否有效"""
-    session = get_session()
-    try:
-        response = session.get(
-            "http://zhjw.qfnu.edu.cn/jsxsd/framework/xsMain.jsp", timeout=5
-        )
-        return response.status_code == 200 and "登录" not in response.text
-    except Exception as e:
-        logging.error(f"检查会话状态时出错: {str(e)}")
-        return False
+    """用账号密码登录，成功后替换当前会话并保存 Cookie"""
+    return await login_with_credentials(DATA_DIR, user_account, user_password)
 
 
 # 保存会话到文件
 def save_session_to_file():
     """将当前会话保存到文件"""
-    session = get_session()
-    session_file = os.path.join(DATA_DIR, "session.json")
-
-    try:
-        # 提取cookies
-        cookies_dict = {name: value for name, value in session.cookies.items()}
-
-        # 保存cookies到文件
-        with open(session_file, "w") as f:
-            json.dump(cookies_dict, f)
-
-        logging.info("会话已保存到文件")
-        return True
-    except Exception as e:
-        logging.error(f"保存会话失败: {str(e)}")
-        return False
+    with lease_session() as session:
+        return session_manager.save_cookies(session, get_cookie_file(DATA_DIR))
 
 
 # 从文件加载会话
 async def load_session_from_file():
-    """从文件加载会话"""
-    session_file = os.path.join(DATA_DIR, "session.json")
-
-    if not os.path.exists(session_file):
-        logging.info("会话文件不存在，需要重新登录")
-        return False
-
-    try:
-        # 读取cookies
-        with open(session_file, "r") as f:
-            cookies_dict = json.load(f)
-
-        # 将cookies加载到会话
-        session = get_session()
-        for name, value in cookies_dict.items():
-            session.cookies.set(name, value)
-
-        # 验证会话是否有效
-        if await check_session_valid():
-            logging.info("成功从文件加载有效会话")
-            return True
-        else:
-            logging.info("从文件加载的会话已过期，需要重新登录")
-            return False
-    except Exception as e:
-        logging.error(f"加载会话失败: {str(e)}")
+    """从文件加载会话，有效时替换当前会话"""
+    restored = session_manager.load_cookies(get_cookie_file(DATA_DIR))
+    if restored is None:
         return False
-
-
-# 确保登录状态
-async def ensure_login():
-    """确保已登录状态，如果会话无效则重新登录"""
-    # 尝试从文件加载会话
-    if await load_session_from_file() and await check_session_valid():
+    if await check_session_valid(restored):
+        session_manager.swap(restored)
         return True
+    restored.close()
+    return False
 
-    # 如果加载失败或会话无效，重置会话并重新登录
-    reset_session()
-
-    try:
-        # 加载账号密码
-        credentials = load_account_and_password()
-        user_account = credentials["account"]
-        user_password = credentials["password"]
-
-        # 尝试登录
-        if await simulate_login(user_account, user_password):
-            # 登录成功，保存会话
-            save_session_to_file()
-            return True
-        else:
-            logging.error("登录失败，请检查账号密码")
-            return False
-    except Exception as e:
-        logging.error(f"登录过程中出错: {str(e)}")
-        return False
 
+# 多周批量预取流水线，进度保存在数据目录中，重启后继续；某周课表变动时重新预取之后几周
+prefetch_pipeline = PrefetchPipeline(ensure_login)
+prefetch_pipeline.configure(DATA_DIR)
+add_change_listener(prefetch_pipeline.on_schedule_change)
 
-# 获取当前学期
-def get_current_term():
-    """获取当前学期"""
-    try:
-        now = datetime.now()
-        year = now.year
-        month = now.month
-
-        if month >= 9:
-            start_year = year
-            end_year = year + 1
-            term = 1
-        elif month <= 1:
-            start_year = year - 1
-            end_year = year
-            term = 1
-        else:
-            start_year = year - 1
-            end_year = year
-            term = 2
+# 课表预取调度器，在节次边界前预取快照，并把之后几周交给批量预取流水线
+prefetch_scheduler = PrefetchScheduler(
+    SEMESTER_START_DATES, get_current_term, ensure_login, pipeline=prefetch_pipeline
+)
 
-        current_term = f"{start_year}-{end_year}-{term}"
-        return current_term
-    except Exception as e:
-        logging.error(f"获取当前学期出错: {str(e)}")
-        return "2024-2025-2"  # 默认返回当前学期
+# 最近一次收到事件的连接，订阅推送经由它发送
+current_websocket = None
 
 
-# 获取当前周次和星期
-def get_current_week_and_day():
-    """获取当前周次和星期"""
-    try:
-        term = get_current_term()
-
-        # 获取学期开始日期
-        start_date = SEMESTER_START_DATES.get(term)
-        if not start_date:
-            logging.warning(f"未找到学期 {term} 的开始日期，使用默认值")
-            return 1, datetime.now().weekday() + 1
-
-        # 计算当前是第几周和星期几
-        today = datetime.now().date()
-        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
-
-        # 计算相差的天数
-        days_diff = (today - start_date_obj).days
-
-        # 如果是未来学期，并且当前日期早于开学日期，则模拟为第1周
-        if days_diff < 0:
-            current_week = 1
-            # 使用当前星期几
-            current_day = today.weekday() + 1  # weekday()返回0-6，对应周一到周日
-        else:
-            # 计算当前是第几周（从1开始）
-            current_week = days_diff // 7 + 1
+# 推送空教室订阅的结果变化
+def push_subscription_update(sub, gained, lost):
+    """订阅的空闲教室变化时在订阅所在的群中 @ 订阅者"""
+    if current_websocket is None:
+        return
+    _, week, day = sub["target"]
+    lines = [
+        f"[CQ:at,qq={sub['user_id']}]【空教室订阅】{format_subscription(sub)}",
+        f"第{week}周{WEEKDAY_NAMES[day]}",
+    ]
+    if gained:
+        lines.append(f"🟢新空出：{format_room_list(gained)}")
+    if lost:
+        lines.append(f"🔴已被占用：{format_room_list(lost)}")
+    lines.append(f"当前空闲 {len(sub['free'])} 间")
+    outbox.send_group(current_websocket, sub["group_id"], "\n".join(lines))
+
+
+# 空教室订阅，快照变动时只重新计算受影响的订阅，结果变化时推送
+subscriptions = SubscriptionManager(SEMESTER_START_DATES, push_subscription_update)
+subscriptions.configure(DATA_DIR)
+add_change_listener(subscriptions.on_schedule_change)
+
+# 空闲教室查询结果缓存，键中包含快照版本，快照更新后旧条目不再命中
+free_rooms_reply_cache = BoundedCache(
+    "空闲教室回复", max_bytes=2 * 1024 * 1024, default_ttl=600
+)
 
-            # 如果超过20周，则限制为20周
-            if current_week > 20:
-                current_week = 20
-            elif current_week < 1:
-                current_week = 1
+# 是否启动本地HTTP查询服务，网页端与机器人共用同一份快照；默认关闭，需要时手动开启
+HTTP_API_ENABLED = False
+http_api_server = None
+_background_refreshing = set()
 
-            # 计算当前是星期几（1-7，对应周一到周日）
-            current_day = today.weekday() + 1  # weekday()返回0-6，对应周一到周日
 
-        return current_week, current_day
-    except Exception as e:
-        logging.error(f"获取当前周次和星期出错: {str(e)}")
-        # 默认返回第1周，当前星期
-        return 1, datetime.now().weekday() + 1
-
-
-# 获取所有教室列表
-def get_all_classrooms(building_prefix=None):
-    """获取所有教室列表，如果指定了建筑前缀，则只返回该建筑的教室"""
-    # 尝试从当前目录的classrooms.json文件加载教室列表
-    classrooms_file = os.path.join(
-        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
-        "scripts",
-        "QFNUGetFreeClassrooms",
-        "classrooms.json",
-    )
+# 查询未命中快照时在后台拉取
+def refresh_snapshot_in_background(xnxqh, week):
+    """在后台拉取指定周的快照，同一周同时只拉取一次"""
+    if (xnxqh, week) in _background_refreshing:
+        return
+    _background_refreshing.add((xnxqh, week))
 
-    if os.path.exists(classrooms_file):
+    async def _refresh():
         try:
-            with open(classrooms_file, "r", encoding="utf-8") as f:
-                classrooms_data = json.load(f)
-                all_rooms = classrooms_data.get("classrooms", [])
-                logging.info(f"教室列表: {all_rooms}")
+            if await ensure_login():
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, refresh_snapshot, xnxqh, week)
         except Exception as e:
-            logging.error(f"读取教室配置文件出错: {str(e)}")
-            # 使用默认教室列表
-            all_rooms = get_default_classrooms()
-            logging.info(f"默认教室列表: {all_rooms}")
-    else:
-        # 使用默认教室列表
-        all_rooms = get_default_classrooms()
-        logging.info(f"默认教室列表: {all_rooms}")
-    if building_prefix:
-        return [room for room in all_rooms if room.startswith(building_prefix)]
-    return all_rooms
-
-
-# 默认教室列表
-def get_default_classrooms():
-    """返回默认的教室列表"""
-    return [
-        "格物楼B201",
-        "格物楼B202",
-        "格物楼B203",
-        "格物楼B204",
-        "格物楼B205",
-        "格物楼B206",
-        "格物楼B207",
-        "格物楼B208",
-        "格物楼A101",
-        "格物楼A102",
-        "格物楼A103",
-        "格物楼A104",
-        "致知楼101",
-        "致知楼102",
-        "致知楼103",
-        "致知楼104",
-    ]
+            logging.error(f"后台拉取快照失败: {str(e)}")
+        finally:
+            _background_refreshing.discard((xnxqh, week))
+
+    asyncio.get_running_loop().create_task(_refresh())
 
 
-# 提取所有被占用的教室
-def extract_occupied_rooms(result):
-    """从查询结果中提取所有被占用的教室"""
-    occupied_rooms = set()
+# 查找用于回复的快照
+def lookup_snapshot(xnxqh, week):
+    """
+    查找可用于回复的快照，快照已过期时先用它回复，同时在后台刷新
+
+    返回:
+        tuple: (快照, 过期快照的数据时长秒数)，同 get_snapshot_or_stale
+    """
+    snapshot, stale_age = get_snapshot_or_stale(xnxqh, week)
+    if stale_age is not None:
+        refresh_snapshot_in_background(xnxqh, week)
+    return snapshot, stale_age
 
-    if "data" in result and result["data"]:
-        for room_data in result["data"]:
-            room_name = room_data.get("name", "")
-            if room_name:
-                occupied_rooms.add(room_name)
 
-    return occupied_rooms
+# 启动HTTP查询服务
+async def start_http_api_once():
+    """在当前事件循环中启动HTTP查询服务，重复调用不会重复启动"""
+    global http_api_server
+    if not HTTP_API_ENABLED or http_api_server is not None:
+        return
+    # 先占位，避免并发事件重复启动
+    http_api_server = False
+    try:
+        http_api_server = await start_http_api(on_miss=refresh_snapshot_in_background)
+    except OSError as e:
+        logging.error(f"HTTP查询服务启动失败: {str(e)}")
 
 
 # 获取空闲教室
@@ -623,21 +538,21 @@ async def get_free_rooms(
     specific_day=None,
     jc1=None,
     jc2=None,
+    user_id=None,
+    placeholder=None,
+    deadline=None,
 ):
-    """获取空闲教室并发送到群"""
+    """
+    获取空闲教室并发送到群
 
-    if not await ensure_login():
-        await send_group_msg(
-            websocket,
-            group_id,
-            f"[CQ:reply,id={message_id}]❌❌❌登录教务系统失败，请联系管理员更新cookies",
-        )
-        await send_private_msg(
-            websocket,
-            owner_id[0],
-            f"[CQ:reply,id={message_id}]❌❌❌空闲教室查询失败，请及时检查cookies，发送【存储教务账号密码+账号+密码】更新cookies",
-        )
-        return
+    参数:
+        user_id (str, optional): 提问者，同一群中相同查询的回复合并时用于 @ 通知
+        placeholder (optional): 入队的"正在查询"消息，结果就绪时尚未发出则不再发送
+        deadline (Deadline, optional): 收到消息时创建的查询时限，登录和请求只使用
+            剩余时间，超时后退回缓存结果或先回复稍后再试
+    """
+    if deadline is None:
+        deadline = Deadline()
 
     # 获取当前学期
     xnxqh = get_current_term()
@@ -655,105 +570,441 @@ async def get_free_rooms(
     room_name = building_prefix if building_prefix else ""
 
     try:
-        # 查询有课的教室，传递节次参数
-        result = get_room_classtable(
-            xnxqh, room_name, current_week, query_day, jc1, jc2
+        snapshot, stale_age = lookup_snapshot(xnxqh, current_week)
+        if snapshot is not None:
+            # 命中预取或启动时恢复的快照，直接从索引中查询，无需登录和请求教务系统
+            result = {
+                "status": "success",
+                "snapshot": True,
+                "stale": stale_age is not None,
+                "age": stale_age,
+            }
+            reply_key = (
+                xnxqh,
+                current_week,
+                query_day,
+                room_name,
+                jc1,
+                jc2,
+                snapshot["version"],
+                get_catalog().version,
+            )
+            free_rooms = free_rooms_reply_cache.get(reply_key)
+            if free_rooms is None:
+                occupied_rooms = snapshot["index"].occupied_rooms(
+                    room_name, query_day, jc1, jc2
+                )
+                free_rooms = compute_free_rooms(room_name, occupied_rooms)
+                free_rooms_reply_cache.set(reply_key, free_rooms)
+        else:
+            # 登录由所有查询共用，超时后不取消，在后台继续完成
+            try:
+                logged_in = await asyncio.wait_for(
+                    asyncio.shield(ensure_login()), deadline.remaining()
+                )
+            except asyncio.TimeoutError:
+                deadline.exhaust(STAGE_LOGIN)
+                logged_in = None
+            if logged_in is None:
+                result = get_cached_result(
+                    xnxqh, room_name, current_week, query_day, jc1, jc2
+                )
+            elif not logged_in:
+                await send_group_msg(
+                    websocket,
+                    group_id,
+                    f"[CQ:reply,id={message_id}]❌❌❌登录教务系统失败，请联系管理员更新cookies",
+                )
+                await send_private_msg(
+                    websocket,
+                    owner_id[0],
+                    f"[CQ:reply,id={message_id}]❌❌❌空闲教室查询失败，请及时检查cookies，发送【存储教务账号密码+账号+密码】更新cookies",
+                )
+                return
+            else:
+                # 查询有课的教室，传递节次参数；请求和解析是阻塞操作，放到线程池中执行。
+                # 请求的超时受时限约束，这里再限制一次等待时间，超时后线程仍会
+                # 完成解析并缓存结果
+                try:
+                    result = await asyncio.wait_for(
+                        asyncio.get_running_loop().run_in_executor(
+                            None,
+                            get_room_classtable,
+                            xnxqh,
+                            room_name,
+                            current_week,
+                            query_day,
+                            jc1,
+                            jc2,
+                            deadline,
+                        ),
+                        deadline.remaining(),
+                    )
+                except asyncio.TimeoutError:
+                    # 用尽时限由抛出 DeadlineExceeded 的请求或解析阶段记录，这里不重复计数
+                    result = None
+                if result is None or result.get("deadline"):
+                    result = get_cached_result(
+                        xnxqh, room_name, current_week, query_day, jc1, jc2
+                    )
+            # 查询结果包含整份课表，平时只记录摘要
+            log_payload("查询结果", result)
+
+            if result is None:
+                # 超时且没有缓存结果，先快速回复，在后台拉取快照供下次查询使用
+                refresh_snapshot_in_background(xnxqh, current_week)
+                if placeholder is not None:
+                    outbox.cancel(placeholder)
+                await send_group_msg(
+                    websocket,
+                    group_id,
+                    f"[CQ:reply,id={message_id}]⏳教务系统响应较慢，已在后台继续查询，请过一会儿再发送一次",
+                )
+                return
+
+            # 处理结果
+            if "error" in result:
+                await send_group_msg(
+                    websocket,
+                    group_id,
+                    f"[CQ:reply,id={message_id}]❌❌❌获取空闲教室失败: {result.get('error')}",
+                )
+                return
+            occupied_rooms = extract_occupied_rooms(result)
+
+            # 解析结果，找出空闲教室
+            free_rooms = compute_free_rooms(room_name, occupied_rooms)
+
+        # 格式化消息
+        message = render_free_rooms_message(
+            xnxqh,
+            current_week,
+            query_day,
+            jc1,
+            jc2,
+            free_rooms,
+            stale_age=result.get("age", 0) if result.get("stale") else None,
+        )
+
+        # 结果已就绪时"正在查询"的消息还在排队，就不再发送
+        if placeholder is not None:
+            outbox.cancel(placeholder)
+
+        # 发送消息，同一群中相同查询的回复合并发送；发出后延迟撤回"正在查询"的消息
+        outbox.send_group(
+            websocket,
+            group_id,
+            message,
+            reply_to=message_id,
+            user_id=user_id,
+            merge_key=(
+                "free_rooms",
+                xnxqh,
+                current_week,
+                query_day,
+                room_name,
+                jc1,
+                jc2,
+                snapshot["version"] if snapshot is not None else None,
+                get_catalog().version,
+            ),
+            on_sent=lambda: delete_query_placeholders(websocket),
+        )
+
+    except Exception as e:
+        logging.error(f"查询空闲教室出错: {str(e)}")
+        await send_group_msg(
+            websocket,
+            group_id,
+            f"[CQ:reply,id={message_id}]❌❌❌查询空闲教室出错: {str(e)}",
         )
-        logging.info(f"查询结果: {result}")
-        # 处理结果
-        if "error" in result:
+
+
+# 获取连续空闲教室
+async def get_free_runs(
+    websocket,
+    group_id,
+    message_id,
+    building_prefix=None,
+    specific_day=None,
+    start=None,
+    deadline=None,
+):
+    """
+    查询从起始节次开始连续空闲最久的教室并发送到群
+
+    参数:
+        deadline (Deadline, optional): 收到消息时创建的查询时限，没有快照时登录和
+            请求只使用剩余时间，超时后退回缓存结果或先回复稍后再试
+    """
+    if deadline is None:
+        deadline = Deadline()
+
+    xnxqh = get_current_term()
+    current_week, current_day = get_current_week_and_day()
+    query_day = specific_day if specific_day is not None else current_day
+    room_name = building_prefix if building_prefix else ""
+
+    # 未指定起始节次时，今天从当前大节开始，其他日期从第1节开始
+    if start is None:
+        start = get_current_period() if query_day == current_day else 1
+        if start is None:
             await send_group_msg(
                 websocket,
                 group_id,
-                f"[CQ:reply,id={message_id}]❌❌❌获取空闲教室失败: {result.get('error')}",
+                f"[CQ:reply,id={message_id}]今天的课程已全部结束，可以查询明天或指定起始节次",
             )
             return
 
-        # 解析结果，找出空闲教室
-        all_rooms = get_all_classrooms(room_name)
-        # logging.info(f"所有教室: {all_rooms}")
-        occupied_rooms = extract_occupied_rooms(result)
-        # logging.info(f"被占用的教室: {occupied_rooms}")
-        free_rooms = [room for room in all_rooms if room not in occupied_rooms]
-        # logging.info(f"空闲教室: {free_rooms}")
-
-        # 格式化消息
-        weekday_names = {
-            1: "星期一",
-            2: "星期二",
-            3: "星期三",
-            4: "星期四",
-            5: "星期五",
-            6: "星期六",
-            7: "星期日",
-        }
-
-        message = f"【空闲教室查询结果】\n\n"
-        message += f"学期: {xnxqh}\n"
-        message += f"第{current_week}周 {weekday_names[query_day]}"
-
-        # 添加节次信息
-        if jc1 and jc2:
-            message += f" 第{int(jc1)}-{int(jc2)}节"
-        else:
-            message += " 全天"
-
-        message += "\n\n"
-
-        if free_rooms:
-            # 按教学楼分组
-            buildings = {}
-            for room in free_rooms:
-                # 提取教学楼名称
-                building = re.match(r"(.*?)[A-Z]?\d+", room)
-                if building:
-                    building_name = building.group(1)
-                    if building_name not in buildings:
-                        buildings[building_name] = []
-                    buildings[building_name].append(room)
-
-            # 格式化输出
-            for building, rooms in buildings.items():
-                message += f"{building}:\n"
-                message += ", ".join(rooms) + "\n\n"
+    try:
+        snapshot, stale_age = lookup_snapshot(xnxqh, current_week)
+        if snapshot is not None:
+            index = snapshot["index"]
         else:
-            message += "无空闲教室或查询格式错误，注意空格\n\n"
-            message += "可用建筑：格物楼、致知楼等，注意不要写简称，例如综合教学楼写综合楼，但可以搜综合，JA写A楼，支持前缀匹配，但不支持简称\n"
+            # 没有快照时拉取当天全天课表，在本地建立临时索引；与查空教室共用时限规则
+            try:
+                logged_in = await asyncio.wait_for(
+                    asyncio.shield(ensure_login()), deadline.remaining()
+                )
+            except asyncio.TimeoutError:
+                deadline.exhaust(STAGE_LOGIN)
+                logged_in = None
+            if logged_in is False:
+                await send_group_msg(
+                    websocket,
+                    group_id,
+                    f"[CQ:reply,id={message_id}]❌❌❌登录教务系统失败，请联系管理员更新cookies",
+                )
+                return
+            result = None
+            if logged_in:
+                try:
+                    result = await asyncio.wait_for(
+                        asyncio.get_running_loop().run_in_executor(
+                            None,
+                            get_room_classtable,
+                            xnxqh,
+                            room_name,
+                            current_week,
+                            query_day,
+                            None,
+                            None,
+                            deadline,
+                        ),
+                        deadline.remaining(),
+                    )
+                except asyncio.TimeoutError:
+                    result = None
+            if result is None or result.get("deadline"):
+                result = get_cached_result(
+                    xnxqh, room_name, current_week, query_day, None, None
+                )
+            if result is None:
+                refresh_snapshot_in_background(xnxqh, current_week)
+                await send_group_msg(
+                    websocket,
+                    group_id,
+                    f"[CQ:reply,id={message_id}]⏳教务系统响应较慢，已在后台继续查询，请过一会儿再发送一次",
+                )
+                return
+            if "error" in result:
+                await send_group_msg(
+                    websocket,
+                    group_id,
+                    f"[CQ:reply,id={message_id}]❌❌❌获取空闲教室失败: {result.get('error')}",
+                )
+                return
+            index = OccupancyIndex(result.get("data") or [])
+            if result.get("stale"):
+                stale_age = result.get("age", 0)
+
+        runs = index.free_runs(room_name, query_day, start)
+        free_runs = compute_free_runs(room_name, runs, start)
+        message = render_free_runs_message(
+            xnxqh, current_week, query_day, start, free_runs, stale_age=stale_age
+        )
+        await send_group_msg(
+            websocket,
+            group_id,
+            f"[CQ:reply,id={message_id}]{message}",
+        )
+    except Exception as e:
+        logging.error(f"查询连续空闲教室出错: {str(e)}")
+        await send_group_msg(
+            websocket,
+            group_id,
+            f"[CQ:reply,id={message_id}]❌❌❌查询连续空闲教室出错: {str(e)}",
+        )
 
-        message += f"\n查询时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
 
-        # 更新消息内容
-        if jc1 and jc2:
-            message += f"当前查询的是第{int(jc1)}-{int(jc2)}节的空闲教室\n"
-            message += "支持任意节次范围查询，例如1-4、3-8等\n"
-        else:
-            message += "查询的是全天无课的教室\n"
+# 解析课表查询的日期参数
+def parse_schedule_day(day_param):
+    """
+    将 今天/明天/后天/周一~周日/星期一~星期日/本周 转换为星期几
 
-        message += "支持节次的在线查询：https://freeclassrooms.w1ndys.top\n"
-        message += "\n微信公众号【W1ndys】\n点击链接加入群聊【Easy-QFNU｜曲师大选课指北群】：https://qm.qq.com/q/GECobaRGoO"
+    返回:
+        tuple: (是否有效, 星期几)，星期几为 None 表示整周
+    """
+    today = datetime.now().weekday() + 1
+    if not day_param or day_param == "今天":
+        return True, today
+    offsets = {"明天": 1, "后天": 2}
+    if day_param in offsets:
+        return True, (today - 1 + offsets[day_param]) % 7 + 1
+    if day_param in ("本周", "整周"):
+        return True, None
+    names = "一二三四五六日天"
+    for prefix in ("周", "星期"):
+        suffix = day_param[len(prefix) :]
+        # 只接受单个汉字，"周"、"周一二" 等不是有效的日期
+        if day_param.startswith(prefix) and len(suffix) == 1 and suffix in names:
+            return True, min(names.index(suffix) + 1, 7)
+    if day_param.isdigit() and 1 <= int(day_param) <= 7:
+        return True, int(day_param)
+    return False, None
+
+
+# 查询教室课表
+async def show_room_schedule(websocket, group_id, message_id, room_name, day):
+    """从快照中查询单个教室的课程安排并发送到群，不请求教务系统"""
+    xnxqh = get_current_term()
+    current_week, _ = get_current_week_and_day()
 
-        # 发送消息
+    snapshot, stale_age = lookup_snapshot(xnxqh, current_week)
+    if snapshot is None:
+        refresh_snapshot_in_background(xnxqh, current_week)
         await send_group_msg(
             websocket,
             group_id,
-            f"[CQ:reply,id={message_id}]{message}",
+            f"[CQ:reply,id={message_id}]本周课表正在加载，请稍后再试",
         )
+        return
 
-        # 延迟0.5秒后撤回"正在查询"的消息
-        await asyncio.sleep(0.5)
-        if QUERY_MESSAGE_IDS:
+    bookings = get_room_bookings(snapshot, room_name, day)
+    if bookings is None:
+        message = (
+            f"没有找到教室 {room_name}，请输入完整的教室名，例如 查教室课表 格物楼B203"
+        )
+    else:
+        message = render_room_schedule_message(
+            xnxqh, current_week, room_name, day, bookings, stale_age=stale_age
+        )
+    await send_group_msg(
+        websocket,
+        group_id,
+        f"[CQ:reply,id={message_id}]{message}",
+    )
 
-            for message_id in QUERY_MESSAGE_IDS:
-                await delete_msg(websocket, message_id)
-            QUERY_MESSAGE_IDS.clear()
 
-    except Exception as e:
-        logging.error(f"查询空闲教室出错: {str(e)}")
+# 查询课程上课地点
+async def search_courses(websocket, group_id, message_id, query):
+    """按课程名、教师名或班级在本周快照中查找上课地点和时间"""
+    xnxqh = get_current_term()
+    current_week, _ = get_current_week_and_day()
+
+    snapshot, stale_age = lookup_snapshot(xnxqh, current_week)
+    if snapshot is None or snapshot.get("search") is None:
+        refresh_snapshot_in_background(xnxqh, current_week)
         await send_group_msg(
             websocket,
             group_id,
-            f"[CQ:reply,id={message_id}]❌❌❌查询空闲教室出错: {str(e)}",
+            f"[CQ:reply,id={message_id}]本周课表正在加载，请稍后再试",
         )
+        return
+
+    results = snapshot["search"].search(query)
+    message = render_course_search_message(
+        xnxqh, current_week, query, results, stale_age=stale_age
+    )
+    await send_group_msg(
+        websocket,
+        group_id,
+        f"[CQ:reply,id={message_id}]{message}",
+    )
+
+
+# 订阅空教室
+async def subscribe_free_rooms(websocket, group_id, user_id, message_id, param):
+    """
+    处理 订阅空教室 [教学楼] [日期] [节次]，日期为今天/明天/后天或周一~周日，
+    节次如 "5-6"，不指定则为全天
+    """
+    params = param.split()
+    if not params or len(params) > 3:
+        await send_group_msg(
+            websocket,
+            group_id,
+            f"[CQ:reply,id={message_id}]【订阅空教室使用说明】\n\n"
+            "基本格式：订阅空教室 [教学楼] [日期] [节次]\n\n"
+            "示例：\n"
+            "- 订阅空教室 格物楼 明天 5-6 （每天关注明天格物楼第5-6节的空闲教室）\n"
+            "- 订阅空教室 致知楼 周三 （关注周三致知楼全天空闲的教室）\n\n"
+            "可用日期：今天、明天、后天、周一~周日，默认为明天\n"
+            "订阅后空闲教室有变化时会在群里通知你\n"
+            "发送【我的空教室订阅】查看，发送【取消空教室订阅 编号】取消",
+        )
+        return
+
+    building_prefix = params[0]
+    if building_prefix == "综合楼":
+        building_prefix = "综合教学楼"
+    day_rule = params[1] if len(params) > 1 else "明天"
+    jc1 = jc2 = None
+    if len(params) > 2:
+        match = re.fullmatch(r"(\d{1,2})-(\d{1,2})", params[2])
+        if not match:
+            await send_group_msg(
+                websocket,
+                group_id,
+                f"[CQ:reply,id={message_id}]❌节次格式不正确，示例：订阅空教室 格物楼 明天 5-6",
+            )
+            return
+        jc1, jc2 = sorted(min(max(int(n), 1), 13) for n in match.groups())
+
+    sub = subscriptions.subscribe(
+        group_id, user_id, building_prefix, day_rule, jc1, jc2
+    )
+    if "error" in sub:
+        await send_group_msg(
+            websocket, group_id, f"[CQ:reply,id={message_id}]❌{sub['error']}"
+        )
+        return
+
+    message = f"[CQ:reply,id={message_id}]✅已订阅 {format_subscription(sub)}\n"
+    if sub["free"] is None:
+        message += "课表数据还在准备中，就绪后会把空闲教室发给你"
+    else:
+        free = format_room_list(sub["free"]) if sub["free"] else "暂无"
+        message += f"当前空闲：{free}\n之后有变化时会通知你"
+    await send_group_msg(websocket, group_id, message)
+
+
+# 查看自己的空教室订阅
+async def list_subscriptions(websocket, group_id, user_id, message_id):
+    subs = subscriptions.list_for_user(user_id)
+    if not subs:
+        message = "你还没有空教室订阅，发送【订阅空教室】查看用法"
+    else:
+        message = "【我的空教室订阅】\n" + "\n".join(
+            format_subscription(sub) for sub in subs
+        )
+    await send_group_msg(websocket, group_id, f"[CQ:reply,id={message_id}]{message}")
+
+
+# 取消空教室订阅
+async def cancel_subscription(websocket, group_id, user_id, message_id, param):
+    """取消空教室订阅 [编号]，不指定编号则取消自己的全部订阅"""
+    param = param.lstrip("#")
+    if param and not param.isdigit():
+        await send_group_msg(
+            websocket,
+            group_id,
+            f"[CQ:reply,id={message_id}]❌编号格式不正确，示例：取消空教室订阅 3",
+        )
+        return
+    removed = subscriptions.unsubscribe(user_id, int(param) if param else None)
+    message = f"✅已取消 {removed} 条订阅" if removed else "❌没有找到对应的订阅"
+    await send_group_msg(websocket, group_id, f"[CQ:reply,id={message_id}]{message}")
 
 
 # 群消息处理函数
@@ -775,8 +1026,109 @@ async def handle_group_message(websocket, msg):
 
         # 检查功能是否开启
         if load_function_status(group_id):
+            # 处理课程查询命令
+            if raw_message.startswith("查课程"):
+                query = raw_message[3:].strip()
+                if not query:
+                    await send_group_msg(
+                        websocket,
+                        group_id,
+                        f"[CQ:reply,id={message_id}]【查课程使用说明】\n\n"
+                        "基本格式：查课程 [课程名/教师名/班级]\n\n"
+                        "示例：\n"
+                        "- 查课程 通信电子电路\n"
+                        "- 查课程 张明强\n"
+                        "- 查课程 23通信班\n\n"
+                        "支持输入名称的一部分，查询本周的上课地点和时间",
+                    )
+                    return
+                await search_courses(websocket, group_id, message_id, query)
+                return
+
+            # 处理教室课表查询命令
+            if raw_message.startswith("查教室课表"):
+                params = raw_message[5:].strip().split()
+                valid, day = parse_schedule_day(params[1] if len(params) > 1 else None)
+                if not params or not valid:
+                    await send_group_msg(
+                        websocket,
+                        group_id,
+                        f"[CQ:reply,id={message_id}]【查教室课表使用说明】\n\n"
+                        "基本格式：查教室课表 [教室] [日期]\n\n"
+                        "示例：\n"
+                        "- 查教室课表 格物楼B203 （今天的课程安排）\n"
+                        "- 查教室课表 格物楼B203 明天\n"
+                        "- 查教室课表 格物楼B203 周三\n"
+                        "- 查教室课表 格物楼B203 本周 （整周的课程安排）",
+                    )
+                    return
+                await show_room_schedule(
+                    websocket, group_id, message_id, params[0], day
+                )
+                return
+
+            # 处理空教室订阅命令
+            if raw_message.startswith("订阅空教室"):
+                await subscribe_free_rooms(
+                    websocket, group_id, user_id, message_id, raw_message[5:].strip()
+                )
+                return
+            if raw_message == "我的空教室订阅":
+                await list_subscriptions(websocket, group_id, user_id, message_id)
+                return
+            if raw_message.startswith("取消空教室订阅"):
+                await cancel_subscription(
+                    websocket, group_id, user_id, message_id, raw_message[7:].strip()
+                )
+                return
+
+            # 处理连续空闲教室查询命令
+            if raw_message.startswith("查连续空教室"):
+                # 从收到消息开始计算查询时限
+                deadline = Deadline()
+                params = raw_message[6:].strip().split()
+                if not params:
+                    await send_group_msg(
+                        websocket,
+                        group_id,
+                        f"[CQ:reply,id={message_id}]【查连续空教室使用说明】\n\n"
+                        "基本格式：查连续空教室 [教学楼] [日期] [起始节次]\n\n"
+                        "示例：\n"
+                        "- 查连续空教室 格物楼 （从当前节次起，格物楼连续空闲最久的教室）\n"
+                        "- 查连续空教室 格物楼 明天 3 （明天从第3节起连续空闲最久的教室）\n\n"
+                        "可用日期：今天、明天、后天\n"
+                        "结果按空闲到第几节分组，空闲时间长的排在前面",
+                    )
+                    return
+
+                building_prefix = params[0]
+                if building_prefix == "综合楼":
+                    building_prefix = "综合教学楼"
+                specific_day = None
+                start = None
+                if len(params) > 1:
+                    offset = {"今天": 0, "明天": 1, "后天": 2}.get(params[1])
+                    if offset:
+                        specific_day = (datetime.now().weekday() + offset) % 7 + 1
+                if len(params) > 2 and params[2].isdigit():
+                    start = min(max(int(params[2]), 1), 13)
+
+                await get_free_runs(
+                    websocket,
+                    group_id,
+                    message_id,
+                    building_prefix,
+                    specific_day,
+                    start,
+                    deadline=deadline,
+                )
+                return
+
             # 处理查询空闲教室命令
             if raw_message.startswith("查空教室"):
+                # 从收到消息开始计算查询时限
+                deadline = Deadline()
+
                 # 解析命令参数
                 params = raw_message[4:].strip().split()
 
@@ -855,7 +1207,7 @@ async def handle_group_message(websocket, msg):
                                 jc1 = None
                                 jc2 = None
 
-                await send_group_msg(
+                placeholder = outbox.send_group(
                     websocket,
                     group_id,
                     f"[CQ:reply,id={message_id}]正在查询空闲教室，请稍候...",
@@ -873,6 +1225,9 @@ async def handle_group_message(websocket, msg):
                     specific_day,
                     jc1,
                     jc2,
+                    user_id=user_id,
+                    placeholder=placeholder,
+                    deadline=deadline,
                 )
                 return
     except Exception as e:
@@ -885,6 +1240,164 @@ async def handle_group_message(websocket, msg):
         return
 
 
+# 查看课表预取状态
+async def show_prefetch_status(websocket, user_id, message_id, authorized):
+    """向主人发送预取计划和上次运行状态"""
+    if not authorized:
+        await send_private_msg(
+            websocket,
+            user_id,
+            f"[CQ:reply,id={message_id}]❌❌❌你没有权限对QFNUGetFreeClassrooms功能进行操作,请联系管理员。",
+        )
+        return
+    await send_private_msg(
+        websocket,
+        user_id,
+        f"[CQ:reply,id={message_id}]{prefetch_scheduler.format_status()}"
+        f"\n\n缓存统计：\n{format_cache_stats()}"
+        f"\n\n教务系统请求统计：\n{upstream_client.format_stats()}"
+        f"\n\n课表存储：\n{format_storage_status()}"
+        f"\n\n教室列表：\n{format_catalog_status()}"
+        f"\n\n验证码识别：\n{format_ocr_stats()}"
+        f"\n\n消息发送：\n{outbox.format_stats()}"
+        f"\n\n查询时限：\n{format_deadline_stats()}"
+        f"\n\n空教室订阅：\n{subscriptions.format_status()}"
+        f"\n\n日志：\n{format_log_stats()}",
+    )
+
+
+# 批量预取多周课表
+async def start_batch_prefetch(websocket, user_id, message_id, raw_message, authorized):
+    """
+    主人命令：空教室批量预取 [周次]，周次如 "3-8" 或 "3,5,7"，
+    省略时为当前周起 LOOKAHEAD_WEEKS 周；指定的周次即使已有快照也重新拉取
+    """
+    if not authorized:
+        await send_private_msg(
+            websocket,
+            user_id,
+            f"[CQ:reply,id={message_id}]❌❌❌你没有权限对QFNUGetFreeClassrooms功能进行操作,请联系管理员。",
+        )
+        return
+
+    xnxqh = get_current_term()
+    current_week, _ = get_current_week_and_day()
+    param = raw_message[len("空教室批量预取") :].strip()
+    try:
+        weeks = []
+        for part in param.replace("，", ",").split(",") if param else []:
+            if "-" in part:
+                start, end = part.split("-", 1)
+                weeks.extend(range(int(start), int(end) + 1))
+            elif part.strip():
+                weeks.append(int(part))
+    except ValueError:
+        await send_private_msg(
+            websocket,
+            user_id,
+            f"[CQ:reply,id={message_id}]❌周次格式不正确，示例：空教室批量预取 3-8",
+        )
+        return
+    if not weeks:
+        weeks = range(current_week, current_week + LOOKAHEAD_WEEKS + 1)
+
+    added = prefetch_pipeline.enqueue(xnxqh, weeks, reason="主人命令", force=True)
+    await send_private_msg(
+        websocket,
+        user_id,
+        f"[CQ:reply,id={message_id}]已加入 {added} 个预取任务，"
+        f"发送【空教室预取进度】查看进度\n\n{prefetch_pipeline.format_progress()}",
+    )
+
+
+# 查看批量预取进度
+async def show_batch_prefetch_progress(websocket, user_id, message_id, authorized):
+    """向主人发送批量预取的进度"""
+    if not authorized:
+        await send_private_msg(
+            websocket,
+            user_id,
+            f"[CQ:reply,id={message_id}]❌❌❌你没有权限对QFNUGetFreeClassrooms功能进行操作,请联系管理员。",
+        )
+        return
+    await send_private_msg(
+        websocket,
+        user_id,
+        f"[CQ:reply,id={message_id}]{prefetch_pipeline.format_progress()}",
+    )
+
+
+# 开关调试日志
+async def toggle_trace_log(websocket, user_id, message_id, raw_message, authorized):
+    """
+    主人命令：空教室调试日志 开 [分钟] / 空教室调试日志 关
+
+    调试模式下查询结果等大对象记录完整内容，到期后自动关闭
+    """
+    if not authorized:
+        await send_private_msg(
+            websocket,
+            user_id,
+            f"[CQ:reply,id={message_id}]❌❌❌你没有权限对QFNUGetFreeClassrooms功能进行操作,请联系管理员。",
+        )
+        return
+
+    params = raw_message[len("空教室调试日志") :].split()
+    if (
+        not params
+        or params[0] not in ("开", "关")
+        or (len(params) > 1 and not params[1].isdigit())
+    ):
+        await send_private_msg(
+            websocket,
+            user_id,
+            f"[CQ:reply,id={message_id}]用法：空教室调试日志 开 [分钟] / 空教室调试日志 关\n\n"
+            f"{format_log_stats()}",
+        )
+        return
+
+    if params[0] == "开":
+        minutes = int(params[1]) if len(params) > 1 else None
+        set_trace(True, minutes * 60 if minutes else None)
+    else:
+        set_trace(False)
+    await send_private_msg(
+        websocket,
+        user_id,
+        f"[CQ:reply,id={message_id}]✅{format_log_stats()}",
+    )
+
+
+# 查看教室占用变动日志
+async def show_change_log(websocket, user_id, message_id, authorized):
+    """向主人发送最近的教室占用变动"""
+    if not authorized:
+        await send_private_msg(
+            websocket,
+            user_id,
+            f"[CQ:reply,id={message_id}]❌❌❌你没有权限对QFNUGetFreeClassrooms功能进行操作,请联系管理员。",
+        )
+        return
+
+    lines = ["【教室占用变动日志】", ""]
+    for change in get_change_log(limit=30):
+        changed_at = datetime.fromtimestamp(change["time"]).strftime("%m-%d %H:%M")
+        line = f"{changed_at} 第{change['week']}周 星期{change['day']} {change['room']}"
+        if change["gained"]:
+            line += f" 新增第{','.join(map(str, change['gained']))}节"
+        if change["lost"]:
+            line += f" 取消第{','.join(map(str, change['lost']))}节"
+        lines.append(line)
+    if len(lines) == 2:
+        lines.append("暂无变动")
+
+    await send_private_msg(
+        websocket,
+        user_id,
+        f"[CQ:reply,id={message_id}]" + "\n".join(lines),
+    )
+
+
 # 私聊消息处理函数
 async def handle_private_message(websocket, msg):
     """处理私聊消息"""
@@ -900,6 +1413,22 @@ async def handle_private_message(websocket, msg):
             await save_account_and_password(
                 websocket, user_id, message_id, raw_message, authorized
             )
+        elif raw_message == "空教室预取状态":
+            await show_prefetch_status(websocket, user_id, message_id, authorized)
+        elif raw_message.startswith("空教室批量预取"):
+            await start_batch_prefetch(
+                websocket, user_id, message_id, raw_message, authorized
+            )
+        elif raw_message == "空教室预取进度":
+            await show_batch_prefetch_progress(
+                websocket, user_id, message_id, authorized
+            )
+        elif raw_message == "空教室变动日志":
+            await show_change_log(websocket, user_id, message_id, authorized)
+        elif raw_message.startswith("空教室调试日志"):
+            await toggle_trace_log(
+                websocket, user_id, message_id, raw_message, authorized
+            )
     except Exception as e:
         logging.error(f"处理QFNUGetFreeClassrooms私聊消息失败: {e}")
         await send_private_msg(
@@ -956,8 +1485,16 @@ async def handle_response(websocket, msg):
 # 统一事件处理入口
 async def handle_events(websocket, msg):
     """统一事件处理入口"""
+    global current_websocket
     post_type = msg.get("post_type", "response")  # 添加默认值
     try:
+        # 首个事件到达时启动课表预取调度器、继续未完成的批量预取、订阅检查，并启动HTTP查询服务
+        current_websocket = websocket
+        prefetch_scheduler.start()
+        prefetch_pipeline.start()
+        subscriptions.start()
+        await start_http_api_once()
+
         # 处理回调事件
         if msg.get("status") == "ok":
             await handle_response(websocket, msg)
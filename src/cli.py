@@ -0,0 +1,441 @@
+"""
+命令行入口，不依赖机器人框架即可登录、拉取、解析、查询和渲染空闲教室
+
+用法（在项目根目录下执行）:
+    python -m src.cli login
+    python -m src.cli fetch --week 3 -o week3.html
+    python -m src.cli parse week3.html --repeat 3
+    python -m src.cli free --building 格物楼 --day 明天 --jc 1-2 [--html week3.html]
+    python -m src.cli prewarm --weeks 3,4,5
+    python -m src.cli serve --port 8765 [--html week3.html --week 3]
+    python -m src.cli captcha-bench [--corpus DIR] [--backends ddddocr,ddddocr-tuned]
+    python -m src.cli replay-capture [week3.html --term 2024-2025-2 --week 3] [--label merged]
+    python -m src.cli replay-check [--update-baseline]
+
+加上 --timing 会在标准错误输出中打印各阶段耗时，加上 --trace 会在日志中
+记录查询结果、请求参数等完整内容。
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# 默认数据目录，与机器人使用的目录结构相同
+DEFAULT_DATA_DIR = os.path.join(os.getcwd(), "data", "QFNUGetFreeClassrooms")
+
+_timings = []
+
+
+@contextmanager
+def timed(stage):
+    """记录一个阶段的耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _timings.append((stage, time.perf_counter() - start))
+
+
+def print_timings():
+    """在标准错误输出中打印各阶段耗时"""
+    total = sum(elapsed for _, elapsed in _timings)
+    for stage, elapsed in _timings:
+        print(f"[耗时] {stage:<12}{elapsed * 1000:>10.1f} ms", file=sys.stderr)
+    print(f"[耗时] {'合计':<12}{total * 1000:>10.1f} ms", file=sys.stderr)
+
+
+def parse_day(value):
+    """将 今天/明天/后天 或 1-7 转换为星期几"""
+    if value is None or value == "今天":
+        return datetime.now().weekday() + 1
+    offsets = {"明天": 1, "后天": 2}
+    if value in offsets:
+        return (datetime.now() + timedelta(days=offsets[value])).weekday() + 1
+    day = int(value)
+    if not 1 <= day <= 7:
+        raise argparse.ArgumentTypeError("星期必须在 1-7 之间")
+    return day
+
+
+def parse_jc(value):
+    """将 "3-4" 形式的节次范围转换为 ("03", "04")"""
+    if not value:
+        return None, None
+    jc1, jc2 = (part.strip() for part in value.split("-", 1))
+    if int(jc1) > int(jc2):
+        jc1, jc2 = jc2, jc1
+    return jc1.zfill(2), jc2.zfill(2)
+
+
+def resolve_term_and_week(args):
+    from .core.term_calendar import get_current_term, get_current_week_and_day
+
+    term = args.term or get_current_term()
+    week = args.week or get_current_week_and_day()[0]
+    return term, week
+
+
+async def do_login(args):
+    """登录教务系统并保存会话"""
+    from .core.login import ensure_login, login_with_credentials
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    with timed("登录"):
+        if args.account and args.password:
+            ok = await login_with_credentials(
+                args.data_dir, args.account, args.password
+            )
+        else:
+            ok = await ensure_login(args.data_dir)
+    if not ok:
+        print("登录失败", file=sys.stderr)
+    return ok
+
+
+def cmd_login(args):
+    return 0 if asyncio.run(do_login(args)) else 1
+
+
+def cmd_fetch(args):
+    from .core.get_room_classtable import fetch_classtable_html
+
+    if not asyncio.run(do_login(args)):
+        return 1
+    term, week = resolve_term_and_week(args)
+    jc1, jc2 = parse_jc(args.jc)
+    with timed("拉取"):
+        fetched = fetch_classtable_html(
+            term, args.building or "", week, args.day, jc1, jc2
+        )
+    if "error" in fetched:
+        print(fetched["error"], file=sys.stderr)
+        return 1
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(fetched["html"])
+    print(f"已保存 {term} 第{week}周课表到 {args.output}")
+    return 0
+
+
+def cmd_parse(args):
+    from .core.row_parse import parse_classtable_html
+
+    with open(args.html, "r", encoding="utf-8") as f:
+        html = f.read()
+    rooms = None
+    for i in range(args.repeat):
+        with timed(f"解析#{i + 1}"):
+            rooms = parse_classtable_html(html)
+    if rooms is None:
+        print("未找到课表数据", file=sys.stderr)
+        return 1
+    print(f"解析到 {len(rooms)} 间有课教室")
+    return 0
+
+
+def cmd_free(args):
+    from .core.free_rooms import compute_free_rooms, render_free_rooms_message
+    from .core.occupancy_index import OccupancyIndex
+    from .core.row_parse import parse_classtable_html
+    from .core.snapshot_store import refresh_snapshot
+
+    term, week = resolve_term_and_week(args)
+    day = parse_day(args.day)
+    jc1, jc2 = parse_jc(args.jc)
+
+    if args.html:
+        with timed("读取"):
+            with open(args.html, "r", encoding="utf-8") as f:
+                html = f.read()
+        with timed("解析"):
+            rooms_data = parse_classtable_html(html)
+        if rooms_data is None:
+            print("未找到课表数据", file=sys.stderr)
+            return 1
+        with timed("建索引"):
+            index = OccupancyIndex(rooms_data)
+    else:
+        if not asyncio.run(do_login(args)):
+            return 1
+        with timed("拉取并解析"):
+            snapshot = refresh_snapshot(term, week)
+        if "error" in snapshot:
+            print(snapshot["error"], file=sys.stderr)
+            return 1
+        index = snapshot["index"]
+
+    with timed("查询"):
+        occupied_rooms = index.occupied_rooms(args.building or "", day, jc1, jc2)
+        free_rooms = compute_free_rooms(args.building or "", occupied_rooms)
+    with timed("渲染"):
+        message = render_free_rooms_message(term, week, day, jc1, jc2, free_rooms)
+    print(message)
+    return 0
+
+
+def cmd_prewarm(args):
+    from .core import prefetch_pipeline
+    from .core.prefetch_pipeline import JOB_DONE, PrefetchPipeline
+
+    term, current_week = resolve_term_and_week(args)
+    weeks = [int(w) for w in args.weeks.split(",")] if args.weeks else [current_week]
+    if args.concurrency:
+        prefetch_pipeline.FETCH_CONCURRENCY = args.concurrency
+
+    async def run():
+        # 与机器人共用进度文件，中断后再次执行会先完成上次剩下的任务
+        pipeline = PrefetchPipeline(lambda: do_login(args))
+        pipeline.configure(args.data_dir)
+        pipeline.enqueue(term, weeks, reason="命令行预热", force=True)
+        await pipeline.run_until_complete()
+        return pipeline
+
+    with timed("预热"):
+        pipeline = asyncio.run(run())
+    print(pipeline.format_progress())
+    counts = pipeline.counts()
+    return 0 if counts.get(JOB_DONE, 0) == sum(counts.values()) else 1
+
+
+def cmd_serve(args):
+    from .core.http_api import start_http_api
+    from .core.snapshot_store import apply_snapshot_html, refresh_snapshot
+
+    term, week = resolve_term_and_week(args)
+    if args.html:
+        with open(args.html, "r", encoding="utf-8") as f:
+            snapshot = apply_snapshot_html(term, week, f.read())
+    else:
+        if not asyncio.run(do_login(args)):
+            return 1
+        snapshot = refresh_snapshot(term, week)
+    if "error" in snapshot:
+        print(snapshot["error"], file=sys.stderr)
+        return 1
+
+    async def serve():
+        server = await start_http_api(args.host, args.port)
+        print(f"已加载 {term} 第{week}周快照，监听 http://{args.host}:{args.port}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def cmd_captcha_bench(args):
+    from .utils.captcha_ocr import BACKENDS, benchmark, format_benchmark, load_corpus
+
+    corpus_dir = args.corpus or os.path.join(
+        args.data_dir, "captcha_corpus", "labelled"
+    )
+    if not os.path.isdir(corpus_dir):
+        print(f"评测集目录不存在: {corpus_dir}", file=sys.stderr)
+        return 1
+    corpus = load_corpus(corpus_dir)
+    if not corpus:
+        print(f"评测集目录中没有图片: {corpus_dir}", file=sys.stderr)
+        return 1
+    names = args.backends.split(",") if args.backends else list(BACKENDS)
+    unknown = [name for name in names if name not in BACKENDS]
+    if unknown:
+        print(f"未知的识别后端: {', '.join(unknown)}", file=sys.stderr)
+        return 1
+    with timed("评测"):
+        results = benchmark(corpus, names)
+    print(format_benchmark(results, len(corpus)))
+    return 0
+
+
+def _replay_corpus_dir(args):
+    return args.corpus or os.path.join(args.data_dir, "replay_corpus")
+
+
+def cmd_replay_capture(args):
+    from .core.html_archive import iter_archive, load_latest_html
+    from .core.replay_corpus import FEATURE_NAMES, capture_case
+
+    corpus_dir = _replay_corpus_dir(args)
+    if args.html:
+        term, week = resolve_term_and_week(args)
+        with open(args.html, "r", encoding="utf-8") as f:
+            sources = [(term, week, f.read())]
+    else:
+        # 未指定文件时从归档中取每个学期、周次最新的整周全校响应
+        keys = []
+        for meta, _ in iter_archive():
+            key = (meta.get("xnxqh"), meta.get("week"))
+            if (
+                not meta.get("room_name")
+                and not meta.get("day")
+                and not meta.get("jc1")
+                and not meta.get("jc2")
+                and key not in keys
+            ):
+                keys.append(key)
+        sources = []
+        for term, week in keys:
+            latest = load_latest_html(term, week)
+            if latest is not None:
+                sources.append((term, week, latest[1]))
+        if not sources:
+            print("归档中没有整周全校课表响应，请用 --html 指定文件", file=sys.stderr)
+            return 1
+
+    failed = 0
+    for term, week, html in sources:
+        with timed(f"保存{term}第{week}周"):
+            case = capture_case(
+                corpus_dir, html, term, week, label=args.label, overwrite=args.force
+            )
+        if "error" in case:
+            print(f"{term} 第{week}周: {case['error']}", file=sys.stderr)
+            failed += 1
+            continue
+        features = "、".join(FEATURE_NAMES[f] for f in case["features"]) or "无"
+        print(
+            f"已保存用例 {case['name']}: {len(case['rooms'])} 间教室，"
+            f"{len(case['expected'])} 个查询，边界情况: {features}"
+        )
+    if failed < len(sources):
+        print(f"请抽查 {corpus_dir} 下 case.json 中的答案，确认无误后再作为标准答案")
+    return 1 if failed else 0
+
+
+def cmd_replay_check(args):
+    from .core.replay_corpus import check_corpus
+
+    with timed("回放"):
+        passed, report = check_corpus(
+            _replay_corpus_dir(args),
+            repeat=args.repeat,
+            tolerance=args.tolerance,
+            update_baseline=args.update_baseline,
+        )
+    print(report)
+    return 0 if passed else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m src.cli", description="曲阜师范大学空闲教室查询命令行工具"
+    )
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="数据目录")
+    parser.add_argument("--timing", action="store_true", help="打印各阶段耗时")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出详细日志")
+    parser.add_argument(
+        "--trace", action="store_true", help="输出详细日志，并记录大对象的完整内容"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_term_week(p):
+        p.add_argument("--term", help="学年学期，如 2024-2025-2，默认为当前学期")
+        p.add_argument("--week", type=int, help="周次，默认为当前周")
+
+    def add_login(p):
+        p.add_argument("--account", help="教务账号，默认读取数据目录下的 account.json")
+        p.add_argument("--password", help="教务密码")
+
+    p = subparsers.add_parser("login", help="登录教务系统并保存会话")
+    add_login(p)
+    p.set_defaults(func=cmd_login)
+
+    p = subparsers.add_parser("fetch", help="拉取课表HTML并保存到文件")
+    add_term_week(p)
+    add_login(p)
+    p.add_argument("--building", help="教室名称前缀")
+    p.add_argument("--day", type=int, help="星期几，1-7，默认整周")
+    p.add_argument("--jc", help="节次范围，如 3-4")
+    p.add_argument("-o", "--output", required=True, help="输出文件")
+    p.set_defaults(func=cmd_fetch)
+
+    p = subparsers.add_parser("parse", help="解析保存的课表HTML并计时")
+    p.add_argument("html", help="课表HTML文件")
+    p.add_argument("--repeat", type=int, default=1, help="重复次数")
+    p.set_defaults(func=cmd_parse)
+
+    p = subparsers.add_parser("free", help="查询并渲染空闲教室")
+    add_term_week(p)
+    add_login(p)
+    p.add_argument("--building", help="教学楼，如 格物楼")
+    p.add_argument("--day", help="今天/明天/后天 或 1-7，默认今天")
+    p.add_argument("--jc", help="节次范围，如 3-4，默认全天")
+    p.add_argument("--html", help="使用保存的整周全校课表HTML，不请求教务系统")
+    p.set_defaults(func=cmd_free)
+
+    p = subparsers.add_parser("prewarm", help="批量预热课表快照和索引文件")
+    add_term_week(p)
+    add_login(p)
+    p.add_argument("--weeks", help="逗号分隔的周次，默认为当前周")
+    p.add_argument("--concurrency", type=int, help="同时拉取的周数，默认 2")
+    p.set_defaults(func=cmd_prewarm)
+
+    p = subparsers.add_parser("serve", help="启动HTTP查询服务")
+    add_term_week(p)
+    add_login(p)
+    p.add_argument("--host", default="127.0.0.1", help="监听地址")
+    p.add_argument("--port", type=int, default=8765, help="监听端口")
+    p.add_argument("--html", help="从保存的整周全校课表HTML加载快照")
+    p.set_defaults(func=cmd_serve)
+
+    p = subparsers.add_parser("captcha-bench", help="比较验证码识别后端的准确率和速度")
+    p.add_argument(
+        "--corpus",
+        help="标注好的验证码图片目录，文件名为答案，默认为数据目录下的 captcha_corpus/labelled",
+    )
+    p.add_argument("--backends", help="逗号分隔的后端名称，默认为全部")
+    p.set_defaults(func=cmd_captcha_bench)
+
+    def add_corpus(p):
+        p.add_argument(
+            "--corpus", help="回放语料目录，默认为数据目录下的 replay_corpus"
+        )
+
+    p = subparsers.add_parser("replay-capture", help="把整周全校课表响应加入回放语料")
+    add_corpus(p)
+    add_term_week(p)
+    p.add_argument("html", nargs="?", help="课表HTML文件，默认从归档中导入")
+    p.add_argument("--label", help="用例名后缀，如 merged-cells")
+    p.add_argument("--force", action="store_true", help="覆盖同名用例")
+    p.set_defaults(func=cmd_replay_capture)
+
+    p = subparsers.add_parser("replay-check", help="回放语料，检查答案一致性和耗时回退")
+    add_corpus(p)
+    p.add_argument("--repeat", type=int, default=3, help="每个阶段重复次数")
+    p.add_argument("--tolerance", type=float, help="允许的耗时增幅，默认 0.3")
+    p.add_argument("--update-baseline", action="store_true", help="用本次耗时更新基线")
+    p.set_defaults(func=cmd_replay_check)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose or args.trace else logging.WARNING,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+    if args.trace:
+        from .utils.trace_log import set_trace
+
+        set_trace(True, 0)
+
+    from .core.snapshot_store import configure_storage
+
+    configure_storage(args.data_dir)
+    try:
+        return args.func(args)
+    finally:
+        if args.timing:
+            print_timings()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+import logging
+import re
+import threading
+
+# numpy 在第一次构建列式表示时才导入，未安装时列式统计不可用，其余功能不受影响
+np = None
+_numpy_missing = False
+
+from .room_catalog import get_catalog
+from .occupancy_index import get_building_name, split_period_code
+
+DAYS = 7
+PERIODS = 13
+WEEKS = 20
+
+_WEEK_RANGE_PATTERN = re.compile(r"(\d+)(?:-(\d+))?")
+
+_build_lock = threading.Lock()
+
+
+def parse_week_range(text, default_week=None):
+    """
+    解析周次文本，支持 "(1-18周)"、"(1-8,10-18周)"、"(2-16双周)"、"(3周)"
+
+    参数:
+        text (str): 周次文本
+        default_week (int, optional): 无法解析时使用的周次
+
+    返回:
+        set: 周次集合，限制在 1-WEEKS 之间
+    """
+    weeks = set()
+    if text:
+        parity = 0 if "双" in text else 1 if "单" in text else None
+        for match in _WEEK_RANGE_PATTERN.finditer(text):
+            start = int(match.group(1))
+            end = int(match.group(2) or start)
+            for week in range(start, end + 1):
+                if parity is None or week % 2 == parity:
+                    weeks.add(week)
+    if not weeks and default_week:
+        weeks.add(default_week)
+    return {week for week in weeks if 1 <= week <= WEEKS}
+
+
+class ColumnarTimetable:
+    """
+    快照的列式表示，用于批量统计
+
+    occupancy 为 rooms × 7 × 13 × 20 的 bool 数组，occupancy[r, d-1, p-1, w-1]
+    表示教室 r 在第 w 周星期 d 第 p 节有课。周次来自课程的周次文本，因此一次
+    整周拉取就能推出整个学期；只有快照所在周的数据是直接观测到的。
+    教室、教学楼、课程均用字典编码：names/buildings/courses 为字典，
+    room_building 为每间教室的教学楼编号，bookings 为每个占用节次的
+    (教室, 星期, 节次, 课程, 周次位掩码) 数组。
+
+    参数:
+        snapshot (dict): snapshot_store 中的快照
+        room_names (list, optional): 教室列表，默认使用全局教室列表
+    """
+
+    def __init__(self, snapshot, room_names=None):
+        if not _import_numpy():
+            raise RuntimeError("列式统计需要安装 numpy")
+        self.xnxqh = snapshot["xnxqh"]
+        self.week = snapshot["week"]
+        self.version = snapshot["version"]
+        if room_names is None:
+            catalog = get_catalog()
+            room_names = catalog.rooms
+            self.catalog_version = catalog.version
+        else:
+            self.catalog_version = None
+
+        # 教室列表中有但快照中没有的教室整学期无课，也计入统计
+        names = list(snapshot["index"].rooms)
+        known = set(names)
+        names += [room for room in room_names if room not in known]
+        self.names = names
+        self.positions = {name: i for i, name in enumerate(names)}
+
+        self.buildings = sorted({get_building_name(name) for name in names})
+        building_ids = {b: i for i, b in enumerate(self.buildings)}
+        self.room_building = np.array(
+            [building_ids[get_building_name(name)] for name in names], dtype=np.int16
+        )
+
+        self.courses = []
+        course_ids = {}
+        week_masks = {}
+        booking_rows = []
+
+        rooms = snapshot["rooms"]
+        for name, room_data in rooms.items():
+            r = self.positions[name]
+            for day_key, periods in room_data.get("schedule", {}).items():
+                d = int(day_key)
+                for period, classes in periods.items():
+                    numbers = [p for p in split_period_code(period) if p <= PERIODS]
+                    if not numbers:
+                        continue
+                    for class_data in classes:
+                        course = class_data.get("course_name") or ""
+                        c = course_ids.get(course)
+                        if c is None:
+                            c = course_ids[course] = len(self.courses)
+                            self.courses.append(course)
+                        # 周次文本种类很少，按文本缓存位掩码
+                        week_range = class_data.get("week_range")
+                        mask = week_masks.get(week_range)
+                        if mask is None:
+                            weeks = parse_week_range(week_range, self.week)
+                            mask = sum(1 << (w - 1) for w in weeks)
+                            week_masks[week_range] = mask
+                        for p in numbers:
+                            booking_rows.append((r, d, p, c, mask))
+
+        # bookings 每行为 (教室, 星期, 节次, 课程, 周次位掩码)
+        self.bookings = np.array(booking_rows, dtype=np.int64).reshape(-1, 5)
+        occupancy = np.zeros((len(names), DAYS, PERIODS, WEEKS), dtype=bool)
+        r, d, p, _, masks = self.bookings.T
+        for w in range(WEEKS):
+            active = (masks >> w) & 1 == 1
+            occupancy[r[active], d[active] - 1, p[active] - 1, w] = True
+
+        if not rooms:
+            # 从索引文件恢复的快照没有课程详情，只填充快照所在周
+            for name, by_day in snapshot["index"].rooms.items():
+                r = self.positions[name]
+                for day, occupied in by_day.items():
+                    for p in occupied:
+                        if p <= PERIODS:
+                            occupancy[r, day - 1, p - 1, self.week - 1] = True
+
+        self.occupancy = occupancy
+        logging.info(
+            f"列式课表构建完成: {len(names)} 间教室，{len(self.bookings)} 个占用节次"
+        )
+
+    def _room_mask(self, building=None):
+        if not building:
+            return np.ones(len(self.names), dtype=bool)
+        return np.array([name.startswith(building) for name in self.names])
+
+    @staticmethod
+    def _period_slice(jc1=None, jc2=None):
+        start = int(jc1) if jc1 else 1
+        end = int(jc2) if jc2 else PERIODS
+        return slice(start - 1, end)
+
+    def free_mask(self, day, jc1=None, jc2=None, weeks=None):
+        """
+        每间教室在指定星期、节次范围内，是否在所有指定周次都空闲
+
+        参数:
+            day (int): 星期几，1-7
+            jc1, jc2 (str, optional): 节次范围
+            weeks (list, optional): 周次列表，默认为快照所在周
+
+        返回:
+            ndarray: 长度为教室数的 bool 数组
+        """
+        week_idx = [w - 1 for w in (weeks or [self.week])]
+        block = self.occupancy[:, day - 1, self._period_slice(jc1, jc2)][..., week_idx]
+        return ~block.any(axis=(1, 2))
+
+    def free_rooms(self, building=None, day=1, jc1=None, jc2=None, weeks=None):
+        """返回在所有指定周次都空闲的教室名，用于跨周预约"""
+        mask = self.free_mask(day, jc1, jc2, weeks) & self._room_mask(building)
+        return [self.names[i] for i in np.flatnonzero(mask)]
+
+    def free_counts_by_building(self, day, jc1=None, jc2=None, weeks=None):
+        """
+        各教学楼的空闲教室数和教室总数
+
+        返回:
+            dict: {教学楼: (空闲数, 总数)}
+        """
+        free = self.free_mask(day, jc1, jc2, weeks)
+        n = len(self.buildings)
+        free_counts = np.bincount(self.room_building[free], minlength=n)
+        totals = np.bincount(self.room_building, minlength=n)
+        return {
+            building: (int(free_counts[i]), int(totals[i]))
+            for i, building in enumerate(self.buildings)
+        }
+
+    def utilisation(self, building=None, week=None):
+        """
+        教室利用率热力图
+
+        返回:
+            ndarray: 7 × 13 的数组，值为该时段有课教室所占比例
+        """
+        mask = self._room_mask(building)
+        if not mask.any():
+            return np.zeros((DAYS, PERIODS))
+        w = (week or self.week) - 1
+        return self.occupancy[mask, :, :, w].mean(axis=0)
+
+    def course_hours(self, top=10):
+        """本周占用节次最多的课程，返回 [(课程名, 节次数), ...]"""
+        if not len(self.bookings):
+            return []
+        counts = np.bincount(self.bookings[:, 3], minlength=len(self.courses))
+        order = np.argsort(counts)[::-1][:top]
+        return [(self.courses[i], int(counts[i])) for i in order if counts[i]]
+
+
+def _import_numpy():
+    """导入 numpy，返回是否可用"""
+    global np, _numpy_missing
+    if np is None and not _numpy_missing:
+        try:
+            import numpy
+        except ImportError:
+            _numpy_missing = True
+            return False
+        np = numpy
+    return np is not None
+
+
+def get_columnar(snapshot):
+    """
+    取得快照的列式表示，首次使用时构建并缓存在快照中，与快照一同淘汰；
+    教室列表更新后重新构建
+
+    返回:
+        ColumnarTimetable: 列式表示；未安装 numpy 时返回 None
+    """
+    if not _import_numpy():
+        return None
+    catalog_version = get_catalog().version
+    columnar = snapshot.get("columnar")
+    if columnar is None or columnar.catalog_version != catalog_version:
+        with _build_lock:
+            columnar = snapshot.get("columnar")
+            if columnar is None or columnar.catalog_version != catalog_version:
+                columnar = snapshot["columnar"] = ColumnarTimetable(snapshot)
+    return columnar
@@ -0,0 +1,179 @@
+from datetime import datetime
+
+from .occupancy_index import get_building_name
+from .room_catalog import get_catalog
+
+WEEKDAY_NAMES = {
+    1: "星期一",
+    2: "星期二",
+    3: "星期三",
+    4: "星期四",
+    5: "星期五",
+    6: "星期六",
+    7: "星期日",
+}
+
+
+# 获取所有教室列表
+def get_all_classrooms(building_prefix=None):
+    """获取所有教室列表，如果指定了建筑前缀，则只返回该建筑的教室"""
+    return get_catalog().with_prefix(building_prefix)
+
+
+# 提取所有被占用的教室
+def extract_occupied_rooms(result):
+    """从查询结果中提取所有被占用的教室"""
+    occupied_rooms = set()
+
+    if "data" in result and result["data"]:
+        for room_data in result["data"]:
+            room_name = room_data.get("name", "")
+            if room_name:
+                occupied_rooms.add(room_name)
+
+    return occupied_rooms
+
+
+# 格式化缓存时长
+def format_age(seconds):
+    """将秒数格式化为易读的时长"""
+    if seconds < 60:
+        return f"{seconds}秒"
+    if seconds < 3600:
+        return f"{seconds // 60}分钟"
+    if seconds < 86400:
+        return f"{seconds // 3600}小时"
+    return f"{seconds // 86400}天"
+
+
+# 计算空闲教室
+def compute_free_rooms(building_prefix, occupied_rooms):
+    """从教室列表中剔除被占用的教室，保持教室列表中的顺序"""
+    all_rooms = get_all_classrooms(building_prefix)
+    return [room for room in all_rooms if room not in occupied_rooms]
+
+
+# 计算连续空闲节数
+def compute_free_runs(building_prefix, runs, start):
+    """
+    结合教室列表计算每间教室从起始节次开始的连续空闲节数
+
+    参数:
+        building_prefix (str): 教学楼前缀
+        runs (dict): 索引 free_runs 的返回值，{教室名: 连续空闲节数}
+        start (int): 起始节次
+
+    返回:
+        list: [(教室名, 连续空闲节数), ...]，按空闲节数从长到短排序，
+            节数相同时保持教室列表中的顺序，起始节次被占用的教室不包含在内
+    """
+    # 索引中没有的教室当天没有课，一直空闲到最后一节
+    whole_day = 14 - int(start)
+    free_runs = []
+    for room in get_all_classrooms(building_prefix):
+        run = runs.get(room, whole_day)
+        if run > 0:
+            free_runs.append((room, run))
+    free_runs.sort(key=lambda item: -item[1])
+    return free_runs
+
+
+# 格式化连续空闲教室查询结果
+def render_free_runs_message(xnxqh, week, query_day, start, free_runs, stale_age=None):
+    """
+    将连续空闲教室格式化为回复消息，按"空闲到第几节"分组
+
+    参数:
+        xnxqh (str): 学年学期
+        week (int): 周次
+        query_day (int): 星期几，1-7
+        start (int): 起始节次
+        free_runs (list): compute_free_runs 的返回值
+        stale_age (int, optional): 数据为缓存时的缓存时长（秒）
+
+    返回:
+        str: 消息文本
+    """
+    message = f"【连续空闲教室查询结果】\n\n"
+    message += f"学期: {xnxqh}\n"
+    message += f"第{week}周 {WEEKDAY_NAMES[query_day]} 从第{start}节起\n\n"
+
+    if stale_age is not None:
+        message += f"⚠️以下为{format_age(stale_age)}前的缓存数据，可能不是最新课表\n\n"
+
+    if free_runs:
+        groups = {}
+        for room, run in free_runs:
+            groups.setdefault(run, []).append(room)
+        for run, rooms in groups.items():
+            message += f"空闲至第{start + run - 1}节（连续{run}节）:\n"
+            message += ", ".join(rooms) + "\n\n"
+    else:
+        message += f"第{start}节起没有空闲教室，或教学楼名称有误\n\n"
+
+    message += f"查询时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+    message += "支持节次的在线查询：https://freeclassrooms.w1ndys.top\n"
+    return message
+
+
+# 格式化空闲教室查询结果
+def render_free_rooms_message(
+    xnxqh, week, query_day, jc1, jc2, free_rooms, stale_age=None
+):
+    """
+    将空闲教室格式化为回复消息
+
+    参数:
+        xnxqh (str): 学年学期
+        week (int): 周次
+        query_day (int): 星期几，1-7
+        jc1 (str): 开始节次，可为空
+        jc2 (str): 结束节次，可为空
+        free_rooms (list): 空闲教室列表
+        stale_age (int, optional): 数据为缓存时的缓存时长（秒）
+
+    返回:
+        str: 消息文本
+    """
+    message = f"【空闲教室查询结果】\n\n"
+    message += f"学期: {xnxqh}\n"
+    message += f"第{week}周 {WEEKDAY_NAMES[query_day]}"
+
+    # 添加节次信息
+    if jc1 and jc2:
+        message += f" 第{int(jc1)}-{int(jc2)}节"
+    else:
+        message += " 全天"
+
+    message += "\n\n"
+
+    # 教务系统不可用时返回的是缓存数据，需要提示数据时效
+    if stale_age is not None:
+        message += f"⚠️以下为{format_age(stale_age)}前的缓存数据，可能不是最新课表\n\n"
+
+    if free_rooms:
+        # 按教学楼分组
+        buildings = {}
+        for room in free_rooms:
+            buildings.setdefault(get_building_name(room), []).append(room)
+
+        # 格式化输出
+        for building, rooms in buildings.items():
+            message += f"{building}:\n"
+            message += ", ".join(rooms) + "\n\n"
+    else:
+        message += "无空闲教室或查询格式错误，注意空格\n\n"
+        message += "可用建筑：格物楼、致知楼等，注意不要写简称，例如综合教学楼写综合楼，但可以搜综合，JA写A楼，支持前缀匹配，但不支持简称\n"
+
+    message += f"\n查询时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+
+    # 更新消息内容
+    if jc1 and jc2:
+        message += f"当前查询的是第{int(jc1)}-{int(jc2)}节的空闲教室\n"
+        message += "支持任意节次范围查询，例如1-4、3-8等\n"
+    else:
+        message += "查询的是全天无课的教室\n"
+
+    message += "支持节次的在线查询：https://freeclassrooms.w1ndys.top\n"
+    message += "\n微信公众号【W1ndys】\n点击链接加入群聊【Easy-QFNU｜曲师大选课指北群】：https://qm.qq.com/q/GECobaRGoO"
+    return message
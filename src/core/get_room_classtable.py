@@ -1,10 +1,150 @@
 import requests
-from bs4 import BeautifulSoup
-from app.scripts.QFNUGetFreeClassrooms.src.utils.session_manager import get_session
+from ..utils.session_manager import lease_session
+from ..utils.circuit_breaker import CircuitBreaker
+from ..utils.upstream_client import upstream_client
+from ..utils.bounded_cache import BoundedCache
+from ..utils.deadline import STAGE_PARSE, DeadlineExceeded
+from ..utils.trace_log import trace_enabled
+from .html_archive import archive_response
+from .term_calendar import update_detected_terms
 import logging
+import re
+import threading
+import time
 
+# 教务系统熔断器，统计失败率和慢请求率
+upstream_breaker = CircuitBreaker("zhjw.qfnu.edu.cn")
 
-def get_room_classtable(xnxqh, room_name, week, day=None, jc1=None, jc2=None):
+# 查询结果在该秒数内直接复用，不再请求教务系统
+FRESH_RESULT_SECONDS = 120
+
+# 最近一次成功的查询结果，键为查询参数，值为 (获取时间戳, 结果)；
+# 超过 FRESH_RESULT_SECONDS 后只在教务系统不可用时作为过期数据返回
+_last_results = BoundedCache(
+    "课表查询结果", max_bytes=16 * 1024 * 1024, default_ttl=86400
+)
+
+# 正在后台刷新的查询参数，避免重复刷新
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+# 用于在原始HTML中快速切分课表行
+_KBTABLE_PATTERN = re.compile(
+    r"<table[^>]*id=[\"']?kbtable[\"']?[^>]*>.*?</table>", re.S | re.I
+)
+_ROW_PATTERN = re.compile(r"<tr\b.*?</tr>", re.S | re.I)
+
+
+def get_room_classtable(
+    xnxqh, room_name, week, day=None, jc1=None, jc2=None, deadline=None
+):
+    """
+    获取指定教室的课表信息，教务系统不可用时返回最近一次的缓存结果
+
+    FRESH_RESULT_SECONDS 内的相同查询直接返回缓存结果。当熔断器处于熔断状态且存在缓存时，立即返回缓存结果（带有 stale、age 字段），
+    并在后台线程中刷新缓存。查询时限用尽时同样退回缓存结果。参数与返回值同 fetch_room_classtable。
+    """
+    key = (xnxqh, room_name, week, day, jc1, jc2)
+    cached = _last_results.get(key)
+    if cached and time.time() - cached[0] < FRESH_RESULT_SECONDS:
+        return cached[1]
+
+    if not upstream_breaker.allow_request():
+        if cached:
+            _refresh_in_background(key)
+            return _mark_stale(cached)
+        return {"error": "教务系统暂时不可用，请稍后再试"}
+
+    result = fetch_room_classtable(xnxqh, room_name, week, day, jc1, jc2, deadline)
+    if "error" not in result:
+        _last_results.set(key, (time.time(), result))
+        return result
+
+    # 请求失败时退回到缓存结果
+    if cached:
+        logging.warning(f"教务系统请求失败，使用缓存结果: {result.get('error')}")
+        return _mark_stale(cached)
+    return result
+
+
+def invalidate_cached_results(xnxqh, week, affected):
+    """
+    使受课表变动影响的缓存查询结果失效
+
+    参数:
+        xnxqh (str): 学年学期
+        week (int): 周次
+        affected (set): 受影响的 (教学楼, 星期) 集合
+    """
+
+    def is_affected(key):
+        key_xnxqh, key_room, key_week, key_day = key[:4]
+        if key_xnxqh != xnxqh or key_week != week:
+            return False
+        for building, day in affected:
+            same_building = (
+                not key_room
+                or building.startswith(key_room)
+                or key_room.startswith(building)
+            )
+            if same_building and (not key_day or int(key_day) == day):
+                return True
+        return False
+
+    _last_results.discard_where(is_affected)
+
+
+def get_cached_result(xnxqh, room_name, week, day=None, jc1=None, jc2=None):
+    """
+    返回相同查询最近一次的结果，不请求教务系统，用于查询超时后的降级回复
+
+    返回:
+        dict: 缓存结果，超过 FRESH_RESULT_SECONDS 的带有 stale、age 字段；没有时返回 None
+    """
+    cached = _last_results.get((xnxqh, room_name, week, day, jc1, jc2))
+    if cached is None:
+        return None
+    if time.time() - cached[0] < FRESH_RESULT_SECONDS:
+        return cached[1]
+    return _mark_stale(cached)
+
+
+def _mark_stale(cached):
+    """为缓存结果标记过期信息"""
+    fetched_at, result = cached
+    stale_result = dict(result)
+    stale_result["stale"] = True
+    stale_result["fetched_at"] = fetched_at
+    stale_result["age"] = int(time.time() - fetched_at)
+    return stale_result
+
+
+def _refresh_in_background(key):
+    """在后台线程中刷新指定查询的缓存"""
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def refresh():
+        try:
+            # 熔断期间只在半开状态下放行一个探测请求
+            if not upstream_breaker.allow_request():
+                return
+            result = fetch_room_classtable(*key)
+            if "error" not in result:
+                _last_results.set(key, (time.time(), result))
+                logging.info(f"后台刷新课表缓存成功: {key}")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def fetch_room_classtable(
+    xnxqh, room_name, week, day=None, jc1=None, jc2=None, deadline=None
+):
     """
     获取指定教室的课表信息
 
@@ -15,16 +155,72 @@ def get_room_classtable(xnxqh, room_name, week, day=None, jc1=None, jc2=None):
         day (int, optional): 星期几，1-7，如果不指定则返回整周课表
         jc1 (str, optional): 开始节次，默认为空
         jc2 (str, optional): 结束节次，默认为空
+        deadline (Deadline, optional): 查询时限，请求只使用剩余时间
 
     返回:
         dict: 课表信息，包含匹配前缀的所有教室数据
     """
+    fetched = fetch_classtable_html(xnxqh, room_name, week, day, jc1, jc2, deadline)
+    if "error" in fetched:
+        return fetched
+
+    # 延迟导入，row_parse 依赖本模块中的解析函数
+    from .row_parse import (
+        parse_classtable_html,
+    )
+
     try:
-        session = get_session()
+        # 解析返回的HTML，只对课表部分构建文档树
+        result = parse_classtable_html(fetched["html"], day, room_name, jc1, jc2)
+        if result is None:
+            logging.error("未找到课表数据")
+            return {"error": "未找到课表数据"}
+
+        # 解析超出时限时结果仍会缓存，供之后的相同查询使用
+        if deadline is not None and deadline.expired():
+            deadline.exhaust(STAGE_PARSE)
+
+        return {
+            "status": "success",
+            "room": room_name,
+            "week": week,
+            "day": day,
+            "jc1": jc1,
+            "jc2": jc2,
+            "data": result,
+        }
+
+    except Exception as e:
+        logging.error(f"处理教室课表数据时出错: {str(e)}")
+        return {"error": f"处理数据失败: {str(e)}"}
+
+
+def fetch_classtable_html(
+    xnxqh, room_name, week, day=None, jc1=None, jc2=None, deadline=None
+):
+    """
+    请求教务系统的教室课表页面，返回原始HTML
+
+    参数同 fetch_room_classtable
+
+    返回:
+        dict: 成功时为 {"status": "success", "html": ...}，失败时为 {"error": ...}
+    """
+    # 租用当前会话，请求期间重新登录不会关闭该会话
+    with lease_session() as session:
+        return _fetch_classtable_html(
+            session, xnxqh, room_name, week, day, jc1, jc2, deadline
+        )
+
 
+def _fetch_classtable_html(session, xnxqh, room_name, week, day, jc1, jc2, deadline):
+    start_time = time.monotonic()
+    try:
         # 先访问全校性教室课表查询页面
         classroom_page_url = "http://zhjw.qfnu.edu.cn/jsxsd/kbcx/kbxx_classroom"
-        classroom_response = session.get(classroom_page_url)
+        classroom_response = upstream_client.get(
+            session, "classroom_page", classroom_page_url, deadline=deadline
+        )
         logging.info(
             f"全校性教室课表查询页面响应状态码: {classroom_response.status_code}"
         )
@@ -32,19 +228,27 @@ def get_room_classtable(xnxqh, room_name, week, day=None, jc1=None, jc2=None):
         # 如果访问课表查询页面失败，记录错误
         if classroom_response.status_code != 200:
             logging.error(f"访问课表查询页面失败: {classroom_response.status_code}")
+            upstream_breaker.record_failure(time.monotonic() - start_time)
             return {"error": "访问课表查询页面失败"}
 
         # 预加载框架，这是查询前的必要步骤
         kbjcmsid = "94786EE0ABE2D3B2E0531E64A8C09931"  # 课表基础模式ID
         init_url = f"http://zhjw.qfnu.edu.cn/jsxsd/kbxx/initJc?xnxq={xnxqh}&kbjcmsid={kbjcmsid}"
-        init_response = session.get(init_url)
+        init_response = upstream_client.get(
+            session, "init_jc", init_url, deadline=deadline
+        )
         logging.info(f"预加载框架响应状态码: {init_response.status_code}")
 
         # 如果预加载失败，记录错误
         if init_response.status_code != 200:
             logging.error(f"预加载框架失败: {init_response.status_code}")
+            upstream_breaker.record_failure(time.monotonic() - start_time)
             return {"error": "预加载框架失败"}
 
+        # 从响应的学年学期下拉框识别学期列表，initJc 中没有时再看查询页面
+        if not update_detected_terms(init_response.text):
+            update_detected_terms(classroom_response.text)
+
         # 查询课表
         url = "http://zhjw.qfnu.edu.cn/jsxsd/kbcx/kbxx_classroom_ifr"
 
@@ -65,44 +269,52 @@ def get_room_classtable(xnxqh, room_name, week, day=None, jc1=None, jc2=None):
             "jc2": jc2 if jc2 else "",  # 确保传递节次参数
         }
 
-        # 记录请求参数，便于调试
-        # logging.info(f"课表查询请求参数: {data}")
+        # 调试模式下记录请求参数
+        if trace_enabled():
+            logging.info(f"课表查询请求参数: {data}")
 
-        # 发送POST请求
-        response = session.post(url, data=data)
+        # 发送POST请求，该接口只查询不修改数据，可以安全重试
+        response = upstream_client.post(
+            session, "classtable", url, data=data, retry=True, deadline=deadline
+        )
         response.raise_for_status()
+        upstream_breaker.record_success(time.monotonic() - start_time)
 
         # 添加响应文本日志，便于调试
         logging.info(f"课表查询响应状态码: {response.status_code}")
 
-        # 解析返回的HTML
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        # 提取课表信息 - 修改为适应新的HTML结构
-        table = soup.find("table", id="kbtable")
-        if not table:
-            logging.error("未找到课表数据")
-            return {"error": "未找到课表数据"}
+        # 归档原始响应，用于回放、审计和冷启动恢复
+        archive_response(
+            {
+                "xnxqh": xnxqh,
+                "room_name": room_name,
+                "week": week,
+                "day": day,
+                "jc1": jc1,
+                "jc2": jc2,
+            },
+            response.text,
+        )
 
-        # 解析表格数据
-        result = parse_classtable_new(table, day, room_name, jc1, jc2)
+        return {"status": "success", "html": response.text}
 
-        return {
-            "status": "success",
-            "room": room_name,
-            "week": week,
-            "day": day,
-            "jc1": jc1,
-            "jc2": jc2,
-            "data": result,
-        }
+    except DeadlineExceeded as e:
+        # 查询时限用尽不代表教务系统出错，不计入熔断统计
+        upstream_breaker.record_aborted()
+        logging.warning(f"获取教室课表超时: {str(e)}")
+        return {"error": str(e), "deadline": True}
 
     except requests.RequestException as e:
+        upstream_breaker.record_failure(time.monotonic() - start_time)
         logging.error(f"获取教室课表失败: {str(e)}")
         return {"error": f"请求失败: {str(e)}"}
+
     except Exception as e:
-        logging.error(f"处理教室课表数据时出错: {str(e)}")
-        return {"error": f"处理数据失败: {str(e)}"}
+        # 会话、响应处理等本地错误不说明教务系统异常，不计入熔断统计，
+        # 但要释放半开状态下的探测名额，否则熔断器无法恢复
+        upstream_breaker.record_aborted()
+        logging.error(f"获取教室课表出错: {str(e)}")
+        return {"error": f"获取教室课表出错: {str(e)}"}
 
 
 def parse_classtable_new(table, specific_day=None, room_name=None, jc1=None, jc2=None):
@@ -126,141 +338,22 @@ def parse_classtable_new(table, specific_day=None, room_name=None, jc1=None, jc2
     )
 
     try:
-        # 获取表头信息 - 节次
-        if not table.find("thead"):
-            logging.error("表格结构异常，未找到thead")
+        header = parse_table_header(table)
+        if header is None:
             return rooms_data
-
-        header_rows = table.find("thead").find_all("tr")
-        if len(header_rows) < 2:
-            logging.error("表格头部结构异常，行数不足")
-            return rooms_data
-
-        # 获取星期信息（第一行）
-        week_headers = []
-        for th in header_rows[0].find_all(["th", "td"])[1:]:  # 跳过第一个单元格
-            if "colspan" in th.attrs:
-                week_name = th.text.strip()
-                colspan = int(th.attrs.get("colspan", 1))
-                for _ in range(colspan):
-                    week_headers.append(week_name)
-            else:
-                week_headers.append(th.text.strip())
-
-        # 获取节次信息（第二行）
-        period_cells = header_rows[1].find_all("td")
-        if len(period_cells) < 2:  # 至少需要有"教室\节次"和一个节次
-            logging.error("节次信息异常")
-            return rooms_data
-
-        periods = []
-        for td in period_cells[1:]:  # 跳过第一个单元格
-            periods.append(td.text.strip())
-
-        # logging.info(f"解析到的节次: {periods}")
-
-        # 计算每天有多少个节次列
-        periods_per_day = len(periods) // 7  # 假设一周7天
-        if periods_per_day * 7 != len(periods):
-            logging.warning(f"节次列数({len(periods)})不是7的整数倍，可能导致解析错误")
+        periods, periods_per_day = header
 
         # 解析每个教室行
         room_rows = table.find_all("tr")[2:]  # 跳过表头两行
         logging.info(f"找到 {len(room_rows)} 行教室数据")
 
         for row in room_rows:
-            cells = row.find_all("td")
-            if not cells or len(cells) <= 1:
-                continue
-
-            # 获取教室名
-            current_room_name = cells[0].text.strip()
-            # logging.info(f"处理教室: {current_room_name}")
-
-            # 检查是否匹配前缀
-            if room_name and not current_room_name.startswith(room_name):
-                # logging.info(f"教室 {current_room_name} 不匹配前缀 {room_name}，跳过")
-                continue
-
-            room_schedule = {}
-            has_classes = False  # 标记该教室是否有课
-
-            # 遍历每一列（跳过第一列教室名）
-            for i, cell in enumerate(cells[1:], 1):
-                # 计算当前单元格对应的星期和节次
-                day_index = (i - 1) // periods_per_day + 1  # 从1开始，对应周一到周日
-                period_index = (i - 1) % periods_per_day
-
-                # 如果指定了特定的星期，且不是当前处理的星期，则跳过
-                if specific_day and int(specific_day) != day_index:
-                    continue
-
-                # 获取当前节次
-                if period_index < len(periods):
-                    period = periods[period_index]
-
-                    # 检查节次是否在指定范围内
-                    # 注：这里只对标准格式的节次进行过滤，如"0102"表示第1-2节
-                    if (jc1 or jc2) and len(period) == 4 and period.isdigit():
-                        current_start = int(period[:2])
-                        current_end = int(period[2:])
-
-                        if jc1 and current_end < int(jc1):
-                            continue  # 当前节次结束早于指定的开始节次
-                        if jc2 and current_start > int(jc2):
-                            continue  # 当前节次开始晚于指定的结束节次
-
-                # 检查单元格是否有课程内容
-                course_divs = cell.find_all("div", class_="kbcontent1")
-
-                if course_divs:
-                    for course_div in course_divs:
-                        course_text = course_div.text.strip()
-                        if course_text and course_text != "&nbsp;":
-                            # 解析课程信息
-                            class_data = parse_class_info_new(course_text)
-                            if class_data:
-                                # 保存原始文本
-                                class_data["original_text"] = course_text
-                                # 保存节次信息
-                                class_data["period"] = period
-
-                                # 添加课程信息到课表
-                                day_key = str(day_index)
-                                if day_key not in room_schedule:
-                                    room_schedule[day_key] = {}
-
-                                if period not in room_schedule[day_key]:
-                                    room_schedule[day_key][period] = []
-
-                                room_schedule[day_key][period].append(class_data)
-
-                                # 同时为单节次创建映射（例如"0102"表示第1-2节，分别创建"第1节"和"第2节"的映射）
-                                if len(period) == 4 and period.isdigit():
-                                    start_period = int(period[:2])
-                                    end_period = int(period[2:])
-                                    for p in range(start_period, end_period + 1):
-                                        single_period = f"第{p}节"
-                                        if single_period not in room_schedule[day_key]:
-                                            room_schedule[day_key][single_period] = []
-                                        room_schedule[day_key][single_period].append(
-                                            class_data
-                                        )
-
-                                has_classes = True
-                                # logging.info(
-                                #     f"教室 {current_room_name} 在星期{day_index}的{period}有课: {course_text[:20]}..."
-                                # )
-
+            room_data = parse_room_row(
+                row, periods, periods_per_day, specific_day, room_name, jc1, jc2
+            )
             # 只有当教室有课时，才添加到结果中
-            if has_classes:
-                rooms_data.append(
-                    {"name": current_room_name, "schedule": room_schedule}
-                )
-                # logging.info(f"教室 {current_room_name} 有课，添加到结果")
-            else:
-                # logging.info(f"教室 {current_room_name} 没有课，不添加到结果")
-                pass
+            if room_data and room_data["schedule"]:
+                rooms_data.append(room_data)
 
     except Exception as e:
         logging.error(f"解析课表时出错: {str(e)}")
@@ -271,6 +364,171 @@ def parse_classtable_new(table, specific_day=None, room_name=None, jc1=None, jc2
     return rooms_data
 
 
+def parse_table_header(table):
+    """
+    解析课表表头，获取节次信息
+
+    参数:
+        table: BeautifulSoup表格对象
+
+    返回:
+        tuple: (节次列表, 每天节次列数)，表头结构异常时返回 None
+    """
+    # 获取表头信息 - 节次
+    if not table.find("thead"):
+        logging.error("表格结构异常，未找到thead")
+        return None
+
+    header_rows = table.find("thead").find_all("tr")
+    if len(header_rows) < 2:
+        logging.error("表格头部结构异常，行数不足")
+        return None
+
+    # 获取节次信息（第二行）
+    period_cells = header_rows[1].find_all("td")
+    if len(period_cells) < 2:  # 至少需要有"教室\节次"和一个节次
+        logging.error("节次信息异常")
+        return None
+
+    periods = []
+    for td in period_cells[1:]:  # 跳过第一个单元格
+        periods.append(td.text.strip())
+
+    # 计算每天有多少个节次列
+    periods_per_day = len(periods) // 7  # 假设一周7天
+    if periods_per_day * 7 != len(periods):
+        logging.warning(f"节次列数({len(periods)})不是7的整数倍，可能导致解析错误")
+
+    return periods, periods_per_day
+
+
+def parse_room_row(
+    row,
+    periods,
+    periods_per_day,
+    specific_day=None,
+    room_name=None,
+    jc1=None,
+    jc2=None,
+):
+    """
+    解析课表中的一个教室行
+
+    参数:
+        row: BeautifulSoup行对象
+        periods: parse_table_header 返回的节次列表
+        periods_per_day: parse_table_header 返回的每天节次列数
+        其余参数同 parse_classtable_new
+
+    返回:
+        dict: {"name": 教室名, "schedule": 课表}，没有课时 schedule 为空；
+              非教室行或不匹配前缀时返回 None
+    """
+    cells = row.find_all("td")
+    if not cells or len(cells) <= 1:
+        return None
+
+    # 获取教室名
+    current_room_name = cells[0].text.strip()
+
+    # 检查是否匹配前缀
+    if room_name and not current_room_name.startswith(room_name):
+        return None
+
+    room_schedule = {}
+
+    # 遍历每一列（跳过第一列教室名），合并单元格按 colspan 占据多列，
+    # 其中的课程记入被合并的每个节次，后面的单元格也不会错位
+    columns = []
+    for cell in cells[1:]:
+        try:
+            span = max(int(cell.get("colspan", 1)), 1)
+        except ValueError:
+            span = 1
+        columns.extend([cell] * span)
+
+    for i, cell in enumerate(columns, 1):
+        # 计算当前单元格对应的星期和节次
+        day_index = (i - 1) // periods_per_day + 1  # 从1开始，对应周一到周日
+        period_index = (i - 1) % periods_per_day
+
+        # 如果指定了特定的星期，且不是当前处理的星期，则跳过
+        if specific_day and int(specific_day) != day_index:
+            continue
+
+        # 获取当前节次
+        if period_index < len(periods):
+            period = periods[period_index]
+
+            # 检查节次是否在指定范围内
+            # 注：这里只对标准格式的节次进行过滤，如"0102"表示第1-2节
+            if (jc1 or jc2) and len(period) == 4 and period.isdigit():
+                current_start = int(period[:2])
+                current_end = int(period[2:])
+
+                if jc1 and current_end < int(jc1):
+                    continue  # 当前节次结束早于指定的开始节次
+                if jc2 and current_start > int(jc2):
+                    continue  # 当前节次开始晚于指定的结束节次
+
+        # 检查单元格是否有课程内容
+        course_divs = cell.find_all("div", class_="kbcontent1")
+
+        for course_div in course_divs:
+            course_text = course_div.text.strip()
+            if not course_text or course_text == "&nbsp;":
+                continue
+
+            # 解析课程信息
+            class_data = parse_class_info_new(course_text)
+            if not class_data:
+                continue
+
+            # 保存原始文本
+            class_data["original_text"] = course_text
+            # 保存节次信息
+            class_data["period"] = period
+
+            # 添加课程信息到课表
+            day_schedule = room_schedule.setdefault(str(day_index), {})
+            day_schedule.setdefault(period, []).append(class_data)
+
+            # 同时为单节次创建映射（例如"0102"表示第1-2节，分别创建"第1节"和"第2节"的映射）
+            if len(period) == 4 and period.isdigit():
+                start_period = int(period[:2])
+                end_period = int(period[2:])
+                for p in range(start_period, end_period + 1):
+                    day_schedule.setdefault(f"第{p}节", []).append(class_data)
+
+    return {"name": current_room_name, "schedule": room_schedule}
+
+
+def split_table_rows(html):
+    """
+    在不构建完整文档树的情况下，将课表HTML拆分为表头和教室行
+
+    参数:
+        html (str): kbxx_classroom_ifr 返回的HTML
+
+    返回:
+        tuple: (表头HTML, [教室行HTML, ...])，未找到课表时返回 None
+    """
+    match = _KBTABLE_PATTERN.search(html)
+    if not match:
+        return None
+    rows = _ROW_PATTERN.findall(match.group(0))
+    if len(rows) < 2:
+        return None
+    return "<table><thead>" + "".join(rows[:2]) + "</thead></table>", rows[2:]
+
+
+def parse_header_html(header_html):
+    """解析 split_table_rows 返回的表头HTML，返回值同 parse_table_header"""
+    from bs4 import BeautifulSoup
+
+    return parse_table_header(BeautifulSoup(header_html, "html.parser"))
+
+
 def parse_class_info_new(info_text):
     """
     解析课程信息文本 - 新算法
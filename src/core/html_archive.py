@@ -0,0 +1,162 @@
+import gzip
+import json
+import logging
+import os
+import struct
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:  # 未安装 zstandard 时使用 gzip 压缩
+    zstandard = None
+
+# 记录头：魔数、元数据长度、压缩后正文长度
+_RECORD_HEADER = struct.Struct("<4sII")
+_RECORD_MAGIC = b"QFCA"
+
+# 归档目录，未配置时不归档
+_archive_dir = None
+_archive_lock = threading.Lock()
+
+
+def configure_archive(data_dir):
+    """设置归档目录，归档文件按学年学期存放在 DATA_DIR/archive/<学年学期> 下"""
+    global _archive_dir
+    _archive_dir = os.path.join(data_dir, "archive")
+    os.makedirs(_archive_dir, exist_ok=True)
+
+
+def _compress(data):
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "gzip", gzip.compress(data, compresslevel=6)
+
+
+def _decompress(codec, data):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("归档使用 zstd 压缩，但未安装 zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def archive_response(params, html):
+    """
+    将一次 kbxx_classroom_ifr 的原始响应追加写入归档
+
+    参数:
+        params (dict): 请求参数，如学年学期、周次、教室前缀等
+        html (str): 原始HTML
+    """
+    if _archive_dir is None:
+        return
+    try:
+        codec, payload = _compress(html.encode("utf-8"))
+        meta = json.dumps(
+            {"time": time.time(), "codec": codec, **params}, ensure_ascii=False
+        ).encode("utf-8")
+        record = _RECORD_HEADER.pack(_RECORD_MAGIC, len(meta), len(payload))
+        term_dir = os.path.join(_archive_dir, params.get("xnxqh") or "unknown")
+        path = os.path.join(term_dir, f"kbxx_classroom_ifr-{time.strftime('%Y%m')}.qfa")
+        os.makedirs(term_dir, exist_ok=True)
+        with _archive_lock, open(path, "ab") as f:
+            f.write(record + meta + payload)
+    except Exception as e:
+        logging.error(f"归档课表响应失败: {str(e)}")
+
+
+def _archive_files(xnxqh=None):
+    """
+    列出归档文件，按文件名中的年月排序
+
+    参数:
+        xnxqh (str, optional): 只列出该学期的归档；未分区的旧归档文件总会列出
+    """
+    if _archive_dir is None or not os.path.isdir(_archive_dir):
+        return []
+    dirs = [_archive_dir]
+    if xnxqh:
+        dirs.append(os.path.join(_archive_dir, xnxqh))
+    else:
+        dirs += [
+            os.path.join(_archive_dir, name)
+            for name in os.listdir(_archive_dir)
+            if os.path.isdir(os.path.join(_archive_dir, name))
+        ]
+    paths = []
+    for directory in dirs:
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if name.endswith(".qfa"):
+                paths.append(os.path.join(directory, name))
+    return sorted(paths, key=lambda path: (os.path.basename(path), path))
+
+
+def _iter_records(xnxqh=None):
+    """遍历归档记录的元数据及正文位置，返回 (元数据, 文件路径, 正文偏移, 正文长度)"""
+    for path in _archive_files(xnxqh):
+        name = os.path.basename(path)
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(_RECORD_HEADER.size)
+                if len(header) < _RECORD_HEADER.size:
+                    break
+                magic, meta_len, payload_len = _RECORD_HEADER.unpack(header)
+                if magic != _RECORD_MAGIC:
+                    logging.error(f"归档文件 {name} 已损坏，停止读取")
+                    break
+                if f.tell() + meta_len + payload_len > size:
+                    # 写入过程中被中断的最后一条记录
+                    logging.warning(f"归档文件 {name} 末尾记录不完整，已忽略")
+                    break
+                meta = json.loads(f.read(meta_len).decode("utf-8"))
+                yield meta, path, f.tell(), payload_len
+                f.seek(payload_len, os.SEEK_CUR)
+
+
+def _read_payload(meta, path, offset, length):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return _decompress(meta["codec"], f.read(length)).decode("utf-8")
+
+
+def iter_archive(with_html=False):
+    """
+    按写入顺序遍历归档记录
+
+    参数:
+        with_html (bool): 是否解压原始HTML，为 False 时只返回元数据
+
+    返回:
+        generator: (元数据, HTML或None)
+    """
+    for meta, path, offset, length in _iter_records():
+        html = _read_payload(meta, path, offset, length) if with_html else None
+        yield meta, html
+
+
+def load_latest_html(xnxqh, week, room_name=""):
+    """
+    返回归档中指定学期、周次、教室前缀的最新一次整周响应
+
+    返回:
+        tuple: (元数据, HTML)，不存在时返回 None
+    """
+    latest = None
+    for record in _iter_records(xnxqh):
+        meta = record[0]
+        if (
+            meta.get("xnxqh") == xnxqh
+            and meta.get("week") == week
+            and meta.get("room_name", "") == room_name
+            and not meta.get("day")
+            and not meta.get("jc1")
+            and not meta.get("jc2")
+        ):
+            latest = record
+    if latest is None:
+        return None
+    return latest[0], _read_payload(*latest)
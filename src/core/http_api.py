@@ -0,0 +1,445 @@
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from .columnar import get_columnar, parse_week_range
+from .free_rooms import compute_free_rooms, compute_free_runs
+from .room_catalog import get_catalog
+from .room_schedule import get_room_bookings
+from .search_index import FIELD_CLASS, FIELD_COURSE
+from .snapshot_store import SNAPSHOT_MAX_AGE, get_snapshot_or_stale
+from .term_calendar import (
+    get_current_period,
+    get_current_term,
+    get_current_week_and_day,
+    is_valid_term,
+)
+from ..utils.trace_log import should_sample
+
+# 默认监听地址，只对本机开放，由反向代理对外提供服务
+HTTP_API_HOST = "127.0.0.1"
+HTTP_API_PORT = 8765
+
+# 客户端缓存的最长时间（秒），不会超过快照剩余的有效时间
+MAX_CLIENT_CACHE_SECONDS = 300
+
+# 超过该毫秒数的请求总是记录日志，其余请求抽样记录
+SLOW_REQUEST_MS = 100
+
+# 请求头最大长度，超过后直接断开
+MAX_HEADER_BYTES = 16 * 1024
+
+_STATUS_TEXT = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    503: "Service Unavailable",
+}
+
+# 各接口中省略时按当前时间取默认值的参数，省略这些参数的响应会随时间变化，
+# 客户端每次都需要用 ETag 重新验证
+_CLOCK_PARAMS = {
+    "/api/free": ("term", "week", "day"),
+    "/api/stats": ("term", "week", "day"),
+    # 查询今天且省略 start 时从当前大节开始，结果随节次变化
+    "/api/free-runs": ("term", "week", "day", "start"),
+    "/api/room": ("term", "week"),
+    "/api/search": ("term", "week"),
+}
+
+# 需要列式课表的接口，首次构建耗时较长，在线程池中处理，不阻塞事件循环
+_COLUMNAR_ROUTES = {"/api/stats"}
+
+# 快照缺失时的回调，参数为 (学年学期, 周次)，用于触发后台拉取；
+# 处理函数可能在线程池中运行，回调总是交回事件循环执行
+_miss_handler = None
+
+
+class ApiError(Exception):
+    """请求参数错误或数据不可用，status 为返回的HTTP状态码"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _get_param(params, name, default=None):
+    values = params.get(name)
+    return values[0] if values else default
+
+
+def _parse_int(params, name, default=None, low=None, high=None):
+    value = _get_param(params, name)
+    if value is None or value == "":
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ApiError(400, f"参数 {name} 必须是整数")
+    if (low is not None and number < low) or (high is not None and number > high):
+        raise ApiError(400, f"参数 {name} 超出范围")
+    return number
+
+
+def _parse_jc(params):
+    """解析节次范围参数 jc=3-4，也支持 jc1=3&jc2=4"""
+    jc = _get_param(params, "jc")
+    if jc:
+        parts = jc.split("-", 1)
+        if len(parts) != 2 or not parts[0].isdigit() or not parts[1].isdigit():
+            raise ApiError(400, "参数 jc 格式应为 开始-结束，如 3-4")
+        jc1, jc2 = parts
+    else:
+        jc1 = _get_param(params, "jc1")
+        jc2 = _get_param(params, "jc2")
+        if not jc1 and not jc2:
+            return None, None
+        jc1, jc2 = jc1 or jc2, jc2 or jc1
+    if int(jc1) > int(jc2):
+        jc1, jc2 = jc2, jc1
+    return jc1.zfill(2), jc2.zfill(2)
+
+
+def _resolve_snapshot(params):
+    """根据 term、week 参数定位快照，默认当前学期和当前周"""
+    term = _get_param(params, "term") or get_current_term()
+    if not is_valid_term(term):
+        raise ApiError(400, "参数 term 的格式应为 2024-2025-2")
+    week = _parse_int(params, "week", low=1, high=20)
+    if week is None:
+        week = get_current_week_and_day()[0]
+    snapshot, stale_age = get_snapshot_or_stale(term, week)
+    if snapshot is None or stale_age is not None:
+        # 快照缺失或已过期时在后台拉取，过期的快照先用于响应，age 字段标明数据时效
+        if _miss_handler is not None:
+            _miss_handler(term, week)
+    if snapshot is None:
+        raise ApiError(503, f"{term} 第{week}周的课表快照尚未就绪")
+    return snapshot
+
+
+def _snapshot_fields(snapshot):
+    return {
+        "term": snapshot["xnxqh"],
+        "week": snapshot["week"],
+        "version": snapshot["version"],
+        "fetched_at": int(snapshot["fetched_at"]),
+        "age": int(time.time() - snapshot["fetched_at"]),
+    }
+
+
+def handle_free_rooms(params):
+    """
+    GET /api/free?building=格物楼&day=3&jc=3-4&week=5&term=2024-2025-2
+
+    返回指定教学楼、星期、节次范围内的空闲教室；指定 weeks=5-8 时返回
+    在这些周都空闲的教室，周次按课程的周次文本推算
+    """
+    snapshot = _resolve_snapshot(params)
+    building = _get_param(params, "building", "")
+    day = _parse_int(
+        params, "day", default=get_current_week_and_day()[1], low=1, high=7
+    )
+    jc1, jc2 = _parse_jc(params)
+    weeks = _parse_weeks(params)
+
+    if weeks:
+        columnar = _require_columnar(snapshot)
+        free = set(columnar.free_rooms(building, day, jc1, jc2, weeks))
+        free_rooms = compute_free_rooms(
+            building, {room for room in columnar.names if room not in free}
+        )
+    else:
+        occupied_rooms = snapshot["index"].occupied_rooms(building, day, jc1, jc2)
+        free_rooms = compute_free_rooms(building, occupied_rooms)
+    return snapshot, {
+        **_snapshot_fields(snapshot),
+        "building": building,
+        "day": day,
+        "jc1": jc1,
+        "jc2": jc2,
+        "weeks": weeks,
+        "free_rooms": free_rooms,
+    }
+
+
+def _parse_weeks(params):
+    """解析周次范围参数 weeks=5-8 或 weeks=1-8,10-16"""
+    value = _get_param(params, "weeks")
+    if not value:
+        return None
+    weeks = sorted(parse_week_range(value))
+    if not weeks:
+        raise ApiError(400, "参数 weeks 格式应为 5-8 或 1-8,10-16")
+    return weeks
+
+
+def _require_columnar(snapshot):
+    columnar = get_columnar(snapshot)
+    if columnar is None:
+        raise ApiError(503, "服务器未安装 numpy，不支持跨周统计")
+    return columnar
+
+
+def handle_stats(params):
+    """
+    GET /api/stats?day=3&jc=3-4&week=5&building=格物楼
+
+    返回各教学楼的空闲教室数、指定教学楼的 7×13 利用率热力图和课时最多的课程
+    """
+    snapshot = _resolve_snapshot(params)
+    building = _get_param(params, "building", "")
+    day = _parse_int(
+        params, "day", default=get_current_week_and_day()[1], low=1, high=7
+    )
+    jc1, jc2 = _parse_jc(params)
+    columnar = _require_columnar(snapshot)
+
+    counts = columnar.free_counts_by_building(day, jc1, jc2, _parse_weeks(params))
+    return snapshot, {
+        **_snapshot_fields(snapshot),
+        "day": day,
+        "jc1": jc1,
+        "jc2": jc2,
+        "free_by_building": {
+            name: {"free": free, "total": total}
+            for name, (free, total) in counts.items()
+        },
+        "building": building,
+        "utilisation": columnar.utilisation(building).round(3).tolist(),
+        "top_courses": columnar.course_hours(),
+    }
+
+
+def handle_free_runs(params):
+    """
+    GET /api/free-runs?building=格物楼&day=3&start=3&week=5
+
+    返回每间教室从起始节次开始的连续空闲节数，按节数从长到短排序；
+    查询今天且未指定 start 时从当前大节开始
+    """
+    snapshot = _resolve_snapshot(params)
+    building = _get_param(params, "building", "")
+    today = get_current_week_and_day()[1]
+    day = _parse_int(params, "day", default=today, low=1, high=7)
+    start = _parse_int(params, "start", low=1, high=13)
+    if start is None:
+        start = get_current_period() if day == today else 1
+        if start is None:
+            raise ApiError(400, "今天的课程已全部结束，请指定 day 或 start")
+
+    runs = snapshot["index"].free_runs(building, day, start)
+    free_runs = compute_free_runs(building, runs, start)
+    return snapshot, {
+        **_snapshot_fields(snapshot),
+        "building": building,
+        "day": day,
+        "start": start,
+        "rooms": [
+            {"name": room, "free_periods": run, "free_until": start + run - 1}
+            for room, run in free_runs
+        ],
+    }
+
+
+def handle_room_schedule(params):
+    """
+    GET /api/room?name=格物楼B203&day=3&week=5
+
+    返回单个教室一天或整周的课程安排
+    """
+    snapshot = _resolve_snapshot(params)
+    name = _get_param(params, "name")
+    if not name:
+        raise ApiError(400, "缺少参数 name")
+    day = _parse_int(params, "day", low=1, high=7)
+
+    bookings = get_room_bookings(snapshot, name, day)
+    if bookings is None:
+        raise ApiError(404, f"没有找到教室 {name}")
+    return snapshot, {
+        **_snapshot_fields(snapshot),
+        "name": name,
+        "day": day,
+        "bookings": bookings,
+    }
+
+
+def handle_search(params):
+    """
+    GET /api/search?q=通信电子电路&field=course&week=5
+
+    按课程名、教师名或班级查找本周的上课地点和时间，field 可为 course、class
+    """
+    snapshot = _resolve_snapshot(params)
+    query = _get_param(params, "q", "").strip()
+    if not query:
+        raise ApiError(400, "缺少参数 q")
+    field = _get_param(params, "field") or None
+    if field not in (None, FIELD_COURSE, FIELD_CLASS):
+        raise ApiError(400, "参数 field 只能是 course 或 class")
+    limit = _parse_int(params, "limit", default=200, low=1, high=1000)
+
+    if snapshot.get("search") is None:
+        # 从索引文件恢复的快照没有课程详情，拉取一次完整课表
+        if _miss_handler is not None:
+            _miss_handler(snapshot["xnxqh"], snapshot["week"])
+        raise ApiError(503, "课程详情尚未加载，请稍后再试")
+    results = snapshot["search"].search(query, field, limit)
+    return snapshot, {
+        **_snapshot_fields(snapshot),
+        "q": query,
+        "field": field,
+        "results": results,
+    }
+
+
+ROUTES = {
+    "/api/free": handle_free_rooms,
+    "/api/free-runs": handle_free_runs,
+    "/api/room": handle_room_schedule,
+    "/api/search": handle_search,
+    "/api/stats": handle_stats,
+}
+
+
+def _etag(snapshot, path, payload):
+    """
+    ETag 由快照版本、教室列表版本和响应内容（不含数据时长 age）决定；
+    响应内容已包含补全默认值后的参数，当前星期等变化后 ETag 随之变化
+    """
+    content = {key: value for key, value in payload.items() if key != "age"}
+    text = json.dumps(content, ensure_ascii=False, sort_keys=True)
+    digest = hashlib.sha1(f"{path}?{text}".encode("utf-8")).hexdigest()[:12]
+    return (
+        f'"{snapshot["xnxqh"]}-{snapshot["week"]}-v{snapshot["version"]}'
+        f'-c{get_catalog().version}-{digest}"'
+    )
+
+
+def _cache_control(snapshot, path, params):
+    if any(not _get_param(params, name) for name in _CLOCK_PARAMS.get(path, ())):
+        return "no-cache"
+    remaining = SNAPSHOT_MAX_AGE - (time.time() - snapshot["fetched_at"])
+    max_age = int(max(0, min(MAX_CLIENT_CACHE_SECONDS, remaining)))
+    return f"public, max-age={max_age}"
+
+
+def _uses_columnar(target):
+    """判断请求是否需要列式课表：统计接口，以及带 weeks 参数的空闲教室查询"""
+    url = urlsplit(target)
+    if url.path in _COLUMNAR_ROUTES:
+        return True
+    return url.path == "/api/free" and bool(_get_param(parse_qs(url.query), "weeks"))
+
+
+def dispatch(method, target, headers):
+    """
+    处理一个请求
+
+    返回:
+        tuple: (状态码, 额外响应头, 响应体字节)
+    """
+    if method not in ("GET", "HEAD"):
+        return 405, {"Allow": "GET, HEAD"}, b""
+
+    url = urlsplit(target)
+    handler = ROUTES.get(url.path)
+    if handler is None:
+        body = {"error": "未知接口", "routes": sorted(ROUTES)}
+        return 404, {}, json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+    params = parse_qs(url.query)
+    try:
+        snapshot, payload = handler(params)
+    except ApiError as e:
+        extra = {"Retry-After": "30"} if e.status == 503 else {}
+        body = json.dumps({"error": e.message}, ensure_ascii=False).encode("utf-8")
+        return e.status, extra, body
+
+    etag = _etag(snapshot, url.path, payload)
+    extra = {"ETag": etag, "Cache-Control": _cache_control(snapshot, url.path, params)}
+    if_none_match = headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return 304, extra, b""
+    return 200, extra, json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+async def _handle_connection(reader, writer):
+    try:
+        raw = await reader.readuntil(b"\r\n\r\n")
+        if len(raw) > MAX_HEADER_BYTES:
+            return
+        lines = raw.decode("latin-1").split("\r\n")
+        method, target, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+
+        start = time.perf_counter()
+        if _uses_columnar(target):
+            loop = asyncio.get_running_loop()
+            status, extra, body = await loop.run_in_executor(
+                None, dispatch, method, target, headers
+            )
+        else:
+            status, extra, body = dispatch(method, target, headers)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if status >= 400 or elapsed_ms >= SLOW_REQUEST_MS or should_sample("HTTP"):
+            logging.info(f"HTTP {method} {target} {status} {elapsed_ms:.2f}ms")
+
+        response_headers = {
+            "Content-Type": "application/json; charset=utf-8",
+            "Access-Control-Allow-Origin": "*",
+            "Connection": "close",
+            **extra,
+        }
+        if status != 304:
+            response_headers["Content-Length"] = str(len(body))
+        head = f"HTTP/1.1 {status} {_STATUS_TEXT.get(status, '')}\r\n"
+        head += "".join(f"{k}: {v}\r\n" for k, v in response_headers.items())
+        writer.write((head + "\r\n").encode("latin-1"))
+        if method != "HEAD" and status != 304:
+            writer.write(body)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+        pass
+    except Exception as e:
+        logging.error(f"处理HTTP请求出错: {str(e)}")
+    finally:
+        writer.close()
+
+
+async def start_http_api(host=HTTP_API_HOST, port=HTTP_API_PORT, on_miss=None):
+    """
+    启动HTTP查询服务
+
+    参数:
+        host (str): 监听地址
+        port (int): 监听端口
+        on_miss (callable, optional): 快照缺失时调用 on_miss(学年学期, 周次)，
+            与机器人共用同一条拉取管道，客户端按 Retry-After 重试即可
+
+    返回:
+        asyncio.Server: 服务对象
+    """
+    global _miss_handler
+    if on_miss is not None:
+        loop = asyncio.get_running_loop()
+        _miss_handler = functools.partial(loop.call_soon_threadsafe, on_miss)
+    else:
+        _miss_handler = None
+    server = await asyncio.start_server(
+        _handle_connection, host, port, limit=MAX_HEADER_BYTES
+    )
+    logging.info(f"空闲教室HTTP查询服务已启动: http://{host}:{port}")
+    return server
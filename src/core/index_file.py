@@ -0,0 +1,199 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+
+# 文件头：魔数、格式版本、保留字段、元数据长度、教室名长度、教室数量
+_FILE_HEADER = struct.Struct("<4sHHIII")
+_FILE_MAGIC = b"QFOI"
+_FILE_VERSION = 1
+
+# 每间教室占用 7 个 uint16，第 p 位表示第 p 节被占用
+_DAYS = 7
+_MASK_SIZE = 2
+
+
+def _period_mask(jc1=None, jc2=None):
+    start = int(jc1) if jc1 else 1
+    end = int(jc2) if jc2 else 13
+    mask = 0
+    for p in range(start, end + 1):
+        mask |= 1 << p
+    return mask
+
+
+def save_index(path, snapshot):
+    """
+    将快照的占用索引写入二进制文件，写入临时文件后原子替换
+
+    参数:
+        path (str): 索引文件路径
+        snapshot (dict): snapshot_store 中的快照
+    """
+    rooms = snapshot["index"].rooms
+    names = list(rooms)
+    masks = []
+    for name in names:
+        by_day = rooms[name]
+        for day in range(1, _DAYS + 1):
+            mask = 0
+            for p in by_day.get(day, ()):
+                mask |= 1 << p
+            masks.append(mask)
+
+    meta = json.dumps(
+        {
+            "xnxqh": snapshot["xnxqh"],
+            "week": snapshot["week"],
+            "version": snapshot["version"],
+            "fetched_at": snapshot["fetched_at"],
+        },
+        ensure_ascii=False,
+    ).encode("utf-8")
+    names_blob = "\n".join(names).encode("utf-8")
+    # 占用数据按 uint16 对齐
+    padding = b"\0" * ((_FILE_HEADER.size + len(meta) + len(names_blob)) % 2)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(
+            _FILE_HEADER.pack(
+                _FILE_MAGIC,
+                _FILE_VERSION,
+                0,
+                len(meta),
+                len(names_blob),
+                len(names),
+            )
+        )
+        f.write(meta)
+        f.write(names_blob)
+        f.write(padding)
+        f.write(struct.pack(f"<{len(masks)}H", *masks))
+    os.replace(tmp_path, path)
+
+
+class MappedOccupancyIndex:
+    """
+    基于内存映射文件的只读占用索引，查询接口与 OccupancyIndex 相同
+
+    启动时只需映射文件并解码教室名，占用数据按需从映射内存中读取，
+    无需重新解析HTML或登录教务系统。
+    """
+
+    def __init__(self, names, masks, mm):
+        self.names = names
+        self._masks = masks
+        self._mm = mm  # 保持映射存活
+        self._positions = None
+
+    @property
+    def rooms(self):
+        """展开为 {教室名: {星期: 节次集合}}，用于在重新拉取后增量更新"""
+        rooms = {}
+        for i, name in enumerate(self.names):
+            by_day = {}
+            for day in range(1, _DAYS + 1):
+                mask = self._masks[i * _DAYS + day - 1]
+                if mask:
+                    by_day[day] = {p for p in range(1, 14) if mask & (1 << p)}
+            rooms[name] = by_day
+        return rooms
+
+    def room_occupancy(self, room_name):
+        """返回单个教室的 {星期: 节次集合}，只读取该教室的 7 个掩码"""
+        if self._positions is None:
+            self._positions = {name: i for i, name in enumerate(self.names)}
+        i = self._positions.get(room_name)
+        if i is None:
+            return None
+        by_day = {}
+        for day in range(1, _DAYS + 1):
+            mask = self._masks[i * _DAYS + day - 1]
+            if mask:
+                by_day[day] = {p for p in range(1, 14) if mask & (1 << p)}
+        return by_day
+
+    def occupied_rooms(self, room_name=None, day=None, jc1=None, jc2=None):
+        """查询指定条件下被占用的教室，参数同 OccupancyIndex.occupied_rooms"""
+        wanted = _period_mask(jc1, jc2)
+        days = [int(day)] if day else range(1, _DAYS + 1)
+        occupied_rooms = set()
+        for i, name in enumerate(self.names):
+            if room_name and not name.startswith(room_name):
+                continue
+            base = i * _DAYS - 1
+            for d in days:
+                if self._masks[base + d] & wanted:
+                    occupied_rooms.add(name)
+                    break
+        return occupied_rooms
+
+    def free_runs(self, room_name=None, day=1, start=1):
+        """计算每间教室从起始节次开始的连续空闲节数，参数同 OccupancyIndex.free_runs"""
+        day = int(day)
+        start = int(start)
+        runs = {}
+        for i, name in enumerate(self.names):
+            if room_name and not name.startswith(room_name):
+                continue
+            # 将起始节次之前的位移出，最低位的 1 即为下一个被占用的节次
+            mask = self._masks[i * _DAYS + day - 1] >> start
+            if mask:
+                runs[name] = (mask & -mask).bit_length() - 1
+            else:
+                runs[name] = 14 - start
+        return runs
+
+
+def load_index(path):
+    """
+    以内存映射方式加载索引文件
+
+    返回:
+        tuple: (元数据, MappedOccupancyIndex)，文件无效时返回 None
+    """
+    try:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as e:
+        logging.error(f"映射索引文件失败: {path}: {str(e)}")
+        return None
+
+    # 文件被截断或内容损坏时各处都可能出错，统一视为无效文件，不影响其他索引的加载
+    try:
+        if len(mm) < _FILE_HEADER.size:
+            raise ValueError("文件头不完整")
+        magic, version, _, meta_len, names_len, count = _FILE_HEADER.unpack_from(mm, 0)
+        if magic != _FILE_MAGIC or version != _FILE_VERSION:
+            raise ValueError("格式不匹配")
+
+        offset = _FILE_HEADER.size
+        names_end = offset + meta_len + names_len
+        end = names_end + names_end % 2 + count * _DAYS * _MASK_SIZE
+        if len(mm) < end:
+            raise ValueError(f"文件长度 {len(mm)} 小于应有的 {end}")
+
+        meta = json.loads(mm[offset : offset + meta_len].decode("utf-8"))
+        missing = [
+            key for key in ("xnxqh", "week", "version", "fetched_at") if key not in meta
+        ]
+        if missing:
+            raise ValueError(f"元数据缺少 {', '.join(missing)}")
+        names_blob = mm[offset + meta_len : names_end].decode("utf-8")
+        names = names_blob.split("\n") if count else []
+        if len(names) != count:
+            raise ValueError(f"教室数 {len(names)} 与文件头中的 {count} 不一致")
+
+        offset = names_end + names_end % 2
+        if sys.byteorder == "little":
+            masks = memoryview(mm)[offset:end].cast("H")
+        else:
+            masks = struct.unpack(f"<{count * _DAYS}H", mm[offset:end])
+    except Exception as e:
+        logging.error(f"索引文件无效: {path}: {str(e)}")
+        mm.close()
+        return None
+    return meta, MappedOccupancyIndex(names, masks, mm)
@@ -0,0 +1,209 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+
+from ..utils.captcha_ocr import configure_corpus, get_ocr_res, record_captcha_result
+from ..utils.session_manager import new_session, session_manager
+from ..utils.upstream_client import backoff_delay, upstream_client
+
+
+# 加载账号密码
+def load_account_and_password(data_dir):
+    """加载账号和密码"""
+    with open(os.path.join(data_dir, "account.json"), "r") as f:
+        return json.load(f)
+
+
+# 处理验证码
+async def handle_captcha(session):
+    """
+    获取并识别验证码
+
+    返回:
+        tuple: (验证码图片字节, 识别结果)，获取或识别失败时识别结果为 None
+    """
+    rand_code_url = "http://zhjw.qfnu.edu.cn/jsxsd/verifycode.servlet"
+    response = await asyncio.to_thread(
+        upstream_client.get, session, "captcha", rand_code_url
+    )
+
+    if response.status_code != 200:
+        logging.error(f"请求验证码失败，状态码: {response.status_code}")
+        return None, None
+
+    try:
+        # 识别是CPU密集操作，放到线程中执行，不阻塞事件循环
+        return response.content, await asyncio.to_thread(get_ocr_res, response.content)
+    except Exception as e:
+        logging.error(f"无法识别验证码: {e}")
+        return response.content, None
+
+
+# 生成登录所需的encoded字符串
+def generate_encoded_string(user_account, user_password):
+    """生成登录所需的encoded字符串"""
+    # 对账号和密码分别进行base64编码
+    account_b64 = base64.b64encode(user_account.encode()).decode()
+    password_b64 = base64.b64encode(user_password.encode()).decode()
+
+    # 拼接编码后的字符串
+    encoded = f"{account_b64}%%%{password_b64}"
+
+    return encoded
+
+
+# 执行登录操作
+async def login(session, random_code, encoded):
+    """执行登录操作"""
+    # 登录请求URL
+    login_url = "http://zhjw.qfnu.edu.cn/jsxsd/xk/LoginToXkLdap"
+    headers = {
+        "Content-Type": "application/x-www-form-urlencoded",
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.116 Safari/537.36",
+        "Origin": "http://zhjw.qfnu.edu.cn",
+        "Referer": "http://zhjw.qfnu.edu.cn/",
+    }
+
+    data = {
+        "userAccount": "",
+        "userPassword": "",
+        "RANDOMCODE": random_code,
+        "encoded": encoded,
+    }
+
+    return await asyncio.to_thread(
+        upstream_client.post, session, "login", login_url, headers=headers, data=data
+    )
+
+
+# 模拟登录过程
+async def simulate_login(session, user_account, user_password):
+    """在给定会话上模拟登录过程，调用方在成功后再替换全局会话"""
+    # 访问教务系统首页，获取必要的cookie
+    response = await asyncio.to_thread(
+        upstream_client.get, session, "home", "http://zhjw.qfnu.edu.cn/jsxsd/"
+    )
+    if response.status_code != 200:
+        logging.error("无法访问教务系统首页，请检查网络连接或教务系统的可用性。")
+        return False
+
+    for attempt in range(3):
+        # 验证码识别错误后稍等再重试，避免连续请求
+        if attempt:
+            await asyncio.sleep(backoff_delay(attempt))
+        captcha_image, random_code = await handle_captcha(session)
+        logging.info(f"验证码: {random_code}")
+        encoded = generate_encoded_string(user_account, user_password)
+        response = await login(session, random_code, encoded)
+        logging.info(f"登录响应: {response.status_code}")
+
+        if response.status_code == 200:
+            if "验证码错误" in response.text:
+                record_captcha_result(captcha_image, random_code, False)
+                logging.warning(f"验证码识别错误，重试第 {attempt + 1} 次")
+                continue
+            record_captcha_result(captcha_image, random_code, True)
+            if "密码错误" in response.text or "账号或密码错误" in response.text:
+                logging.error("用户名或密码错误")
+                return False
+
+            # 检查是否成功登录
+            main_page = await asyncio.to_thread(
+                upstream_client.get,
+                session,
+                "main_page",
+                "http://zhjw.qfnu.edu.cn/jsxsd/framework/xsMain.jsp",
+            )
+            if main_page.status_code != 200 or "登录" in main_page.text:
+                logging.error("登录失败，无法访问主页")
+                return False
+
+            logging.info("登录成功!")
+            return True
+        else:
+            logging.error("登录失败")
+            return False
+
+    logging.error("验证码识别错误，请重试")
+    return False
+
+
+# 检查会话是否有效
+async def check_session_valid(session=None):
+    """检查会话是否有效，不指定时检查当前会话"""
+    try:
+        if session is None:
+            with session_manager.lease() as leased:
+                return await asyncio.to_thread(_is_logged_in, leased)
+        return await asyncio.to_thread(_is_logged_in, session)
+    except Exception as e:
+        logging.error(f"检查会话状态时出错: {str(e)}")
+        return False
+
+
+def _is_logged_in(session):
+    response = upstream_client.get(
+        session, "session_check", "http://zhjw.qfnu.edu.cn/jsxsd/framework/xsMain.jsp"
+    )
+    return response.status_code == 200 and "登录" not in response.text
+
+
+# 会话文件路径
+def get_cookie_file(data_dir):
+    """返回保存 Cookie 的文件路径"""
+    return os.path.join(data_dir, "session.json")
+
+
+# 用账号密码登录
+async def login_with_credentials(data_dir, user_account, user_password):
+    """在新会话上登录，成功后原子替换当前会话并保存 Cookie"""
+    configure_corpus(os.path.join(data_dir, "captcha_corpus"))
+    session = new_session()
+    if await simulate_login(session, user_account, user_password):
+        session_manager.swap(session, cookie_file=get_cookie_file(data_dir))
+        return True
+    session.close()
+    return False
+
+
+# 确保登录状态
+async def ensure_login(data_dir):
+    """
+    确保已登录状态，如果会话无效则重新登录
+
+    同一时间只有一个协程在检查和登录，其余协程等待后直接复用登录结果；
+    登录在新会话上进行，正在进行的查询继续使用旧会话直到结束。
+    """
+    seen_generation = session_manager.generation
+    async with session_manager.login_lock():
+        generation = session_manager.generation
+        # 等锁期间其他协程已换上新登录的会话，直接复用，不再重复检查
+        if generation != seen_generation:
+            return True
+        if generation and await check_session_valid():
+            return True
+
+        # 尝试从文件加载会话
+        restored = session_manager.load_cookies(get_cookie_file(data_dir))
+        if restored is not None:
+            if await check_session_valid(restored):
+                logging.info("成功从文件加载有效会话")
+                session_manager.swap(restored)
+                return True
+            logging.info("从文件加载的会话已过期，需要重新登录")
+            restored.close()
+
+        try:
+            # 加载账号密码
+            credentials = load_account_and_password(data_dir)
+            if await login_with_credentials(
+                data_dir, credentials["account"], credentials["password"]
+            ):
+                return True
+            logging.error("登录失败，请检查账号密码")
+            return False
+        except Exception as e:
+            logging.error(f"登录过程中出错: {str(e)}")
+            return False
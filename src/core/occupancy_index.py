@@ -0,0 +1,147 @@
+import logging
+import re
+
+
+def split_period_code(period):
+    """
+    将节次编码拆分为单节次列表
+
+    参数:
+        period (str): 节次编码，如 "0102"、"091011"
+
+    返回:
+        list: 单节次列表，如 [9, 10, 11]；非标准格式返回空列表
+    """
+    if not period or not period.isdigit() or len(period) % 2 != 0:
+        return []
+    return [int(period[i : i + 2]) for i in range(0, len(period), 2)]
+
+
+def get_building_name(room):
+    """从教室名中提取教学楼名称，如 "格物楼B203" -> "格物楼" """
+    match = re.match(r"(.*?)[A-Z]?\d+", room)
+    return match.group(1) if match else room
+
+
+def get_room_occupancy(room_data):
+    """
+    计算单个教室的占用情况
+
+    参数:
+        room_data (dict): parse_room_row 返回的教室数据
+
+    返回:
+        dict: {星期: 被占用的单节次集合}
+    """
+    by_day = {}
+    for day_key, periods in room_data.get("schedule", {}).items():
+        occupied = set()
+        for period in periods:
+            occupied.update(split_period_code(period))
+        if occupied:
+            by_day[int(day_key)] = occupied
+    return by_day
+
+
+def free_run_length(occupied, start):
+    """
+    计算从起始节次开始连续空闲的节数
+
+    参数:
+        occupied (set): 当天被占用的单节次集合
+        start (int): 起始节次，1-13
+
+    返回:
+        int: 连续空闲节数，起始节次被占用时为 0
+    """
+    run = 0
+    for p in range(start, 14):
+        if p in occupied:
+            break
+        run += 1
+    return run
+
+
+class OccupancyIndex:
+    """
+    教室占用索引，由 parse_classtable_new 返回的整周全校课表构建
+
+    索引结构为 {教室名: {星期: 被占用的单节次集合}}，查询时无需再请求教务系统。
+    """
+
+    def __init__(self, rooms_data):
+        self.rooms = {}
+        for room_data in rooms_data:
+            self.rooms[room_data["name"]] = get_room_occupancy(room_data)
+        logging.info(f"教室占用索引构建完成，共 {len(self.rooms)} 间教室")
+
+    def with_rooms(self, changed_rooms):
+        """
+        基于当前索引生成只替换部分教室的新索引，未变动的教室不重新计算
+
+        参数:
+            changed_rooms (dict): {教室名: 教室数据}，教室数据为 None 表示该教室已移除
+
+        返回:
+            OccupancyIndex: 新索引，当前索引保持不变
+        """
+        index = OccupancyIndex.__new__(OccupancyIndex)
+        index.rooms = dict(self.rooms)
+        for name, room_data in changed_rooms.items():
+            if room_data is None:
+                index.rooms.pop(name, None)
+            else:
+                index.rooms[name] = get_room_occupancy(room_data)
+        return index
+
+    def room_occupancy(self, room_name):
+        """返回单个教室的 {星期: 被占用的单节次集合}，教室不在索引中时返回 None"""
+        return self.rooms.get(room_name)
+
+    def occupied_rooms(self, room_name=None, day=None, jc1=None, jc2=None):
+        """
+        查询指定条件下被占用的教室
+
+        参数:
+            room_name (str, optional): 教室名称前缀
+            day (int, optional): 星期几，1-7，不指定则为整周
+            jc1 (str, optional): 开始节次
+            jc2 (str, optional): 结束节次
+
+        返回:
+            set: 被占用的教室名集合
+        """
+        start = int(jc1) if jc1 else 1
+        end = int(jc2) if jc2 else 13
+        wanted = set(range(start, end + 1))
+
+        occupied_rooms = set()
+        for name, by_day in self.rooms.items():
+            if room_name and not name.startswith(room_name):
+                continue
+            days = [int(day)] if day else by_day.keys()
+            for d in days:
+                if by_day.get(d, set()) & wanted:
+                    occupied_rooms.add(name)
+                    break
+        return occupied_rooms
+
+    def free_runs(self, room_name=None, day=1, start=1):
+        """
+        一次遍历计算每间教室从起始节次开始的连续空闲节数
+
+        参数:
+            room_name (str, optional): 教室名称前缀
+            day (int): 星期几，1-7
+            start (int): 起始节次，1-13
+
+        返回:
+            dict: {教室名: 连续空闲节数}，只包含索引中有课的教室
+        """
+        day = int(day)
+        runs = {}
+        for name, by_day in self.rooms.items():
+            if room_name and not name.startswith(room_name):
+                continue
+            runs[name] = free_run_length(by_day.get(day, set()), int(start))
+        return runs
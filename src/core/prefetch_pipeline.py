@@ -0,0 +1,373 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from .get_room_classtable import fetch_classtable_html, upstream_breaker
+from .html_archive import load_latest_html
+from .snapshot_store import apply_snapshot_html, get_snapshot
+
+# 同时进行的拉取数，教务系统较慢，并发过高容易触发熔断
+FETCH_CONCURRENCY = 2
+
+# 相邻两次拉取开始的最小间隔（秒）
+FETCH_INTERVAL = 3.0
+
+# 已拉取、等待解析的响应最多积压的份数，解析跟不上时拉取暂停
+PARSE_QUEUE_SIZE = 2
+
+# 自动预取从当前周起往后的周数
+LOOKAHEAD_WEEKS = 4
+
+# 快照在该秒数内拉取过的周次不再预取
+FRESH_SECONDS = 12 * 3600
+
+# 每个任务最多尝试的次数，失败后等待 RETRY_DELAY 秒再重试
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 60
+
+# 学期最后一周
+LAST_WEEK = 20
+
+# 任务状态
+JOB_PENDING = "pending"  # 等待拉取
+JOB_FETCHING = "fetching"  # 拉取中
+JOB_FETCHED = "fetched"  # 已拉取并归档，等待解析
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+_STATE_NAMES = {
+    JOB_PENDING: "排队",
+    JOB_FETCHING: "拉取中",
+    JOB_FETCHED: "待解析",
+    JOB_DONE: "完成",
+    JOB_FAILED: "失败",
+}
+
+
+class PrefetchPipeline:
+    """
+    多周课表批量预取流水线
+
+    任务为 (学年学期, 周次)，拉取阶段按 FETCH_CONCURRENCY 并发、FETCH_INTERVAL
+    限速请求全校整周课表，解析阶段逐个把响应载入快照并写入索引文件，两阶段之间
+    用长度为 PARSE_QUEUE_SIZE 的队列衔接。任务状态每次变化都写入文件，重启后
+    继续未完成的任务；已拉取未解析的任务直接使用归档中的响应，不再重新拉取。
+
+    参数:
+        ensure_login (callable): 确保已登录的协程函数，返回是否登录成功
+    """
+
+    def __init__(self, ensure_login):
+        self.ensure_login = ensure_login
+        self._jobs = {}  # "学年学期:周次" -> 任务，按入队顺序排列
+        self._in_flight = set()  # 本次运行中已被取走的任务
+        self._state_file = None
+        self._task = None
+        self._loop = None
+        self._rate_lock = None
+        self._last_fetch = 0.0
+        self.batch_started_at = None
+        self.last_error = None
+
+    def configure(self, data_dir):
+        """设置进度文件位置并恢复上次未完成的任务"""
+        self._state_file = os.path.join(data_dir, "prefetch_jobs.json")
+        if not os.path.exists(self._state_file):
+            return
+        try:
+            with open(self._state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except Exception as e:
+            logging.error(f"读取预取进度失败: {str(e)}")
+            return
+        self._jobs = state.get("jobs", {})
+        self.batch_started_at = state.get("batch_started_at")
+        for job in self._jobs.values():
+            # 拉取中断的任务重新拉取
+            if job["state"] == JOB_FETCHING:
+                job["state"] = JOB_PENDING
+        unfinished = len(self._unfinished())
+        if unfinished:
+            logging.info(f"恢复 {unfinished} 个未完成的预取任务")
+
+    def _save(self):
+        if self._state_file is None:
+            return
+        try:
+            tmp_path = f"{self._state_file}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"batch_started_at": self.batch_started_at, "jobs": self._jobs},
+                    f,
+                    ensure_ascii=False,
+                )
+            os.replace(tmp_path, self._state_file)
+        except Exception as e:
+            logging.error(f"保存预取进度失败: {str(e)}")
+
+    def _unfinished(self):
+        return [
+            job
+            for job in self._jobs.values()
+            if job["state"] not in (JOB_DONE, JOB_FAILED)
+        ]
+
+    def enqueue(self, xnxqh, weeks, reason="", newer_than=None, force=False):
+        """
+        添加预取任务并启动流水线
+
+        参数:
+            xnxqh (str): 学年学期
+            weeks (iterable): 周次
+            reason (str): 入队原因，显示在进度中
+            newer_than (float, optional): 快照拉取时间早于该时间戳时才预取，
+                默认只预取 FRESH_SECONDS 内没有拉取过的周次
+            force (bool): 忽略已有快照，全部重新拉取
+
+        返回:
+            int: 新增的任务数
+        """
+        new_weeks = []
+        for week in weeks:
+            week = int(week)
+            if not 1 <= week <= LAST_WEEK:
+                continue
+            job = self._jobs.get(f"{xnxqh}:{week}")
+            if job is not None and job["state"] not in (JOB_DONE, JOB_FAILED):
+                continue
+            if not force and self._is_fresh(xnxqh, week, newer_than):
+                continue
+            new_weeks.append(week)
+
+        if new_weeks and not self._unfinished():
+            # 上一批已全部结束，开始新的一批
+            self._jobs = {}
+            self.batch_started_at = time.time()
+
+        for week in new_weeks:
+            key = f"{xnxqh}:{week}"
+            self._jobs.pop(key, None)
+            self._jobs[key] = {
+                "xnxqh": xnxqh,
+                "week": week,
+                "state": JOB_PENDING,
+                "reason": reason,
+                "attempts": 0,
+                "not_before": 0,
+                "error": None,
+                "updated_at": time.time(),
+            }
+
+        if new_weeks:
+            logging.info(f"新增 {len(new_weeks)} 个预取任务: {xnxqh} {reason}")
+            self._save()
+        # 登录失败等原因中止后留下的任务也在这里重新开始
+        self.start()
+        return len(new_weeks)
+
+    @staticmethod
+    def _is_fresh(xnxqh, week, newer_than=None):
+        snapshot = get_snapshot(xnxqh, week, max_age=FRESH_SECONDS)
+        if snapshot is None:
+            return False
+        return newer_than is None or snapshot["fetched_at"] >= newer_than
+
+    def enqueue_lookahead(self, xnxqh, current_week):
+        """预取从当前周起 LOOKAHEAD_WEEKS 周内尚未就绪的课表"""
+        weeks = range(current_week, current_week + LOOKAHEAD_WEEKS + 1)
+        return self.enqueue(xnxqh, weeks, reason="提前预取")
+
+    def on_schedule_change(self, snapshot, changes):
+        """
+        快照变动监听器：某周课表变动后，之后几周的课表通常也随之变化，重新预取
+
+        由 snapshot_store 在解析线程中调用，转到事件循环中入队
+        """
+        if self._loop is None or self._loop.is_closed():
+            return
+        week = snapshot["week"]
+        self._loop.call_soon_threadsafe(
+            lambda: self.enqueue(
+                snapshot["xnxqh"],
+                range(week + 1, week + LOOKAHEAD_WEEKS + 1),
+                reason=f"第{week}周课表变动",
+                newer_than=snapshot["fetched_at"],
+            )
+        )
+
+    def start(self):
+        """在当前事件循环中启动流水线，已在运行时不重复启动"""
+        self._loop = asyncio.get_running_loop()
+        if self._unfinished() and (self._task is None or self._task.done()):
+            self._task = self._loop.create_task(self._run())
+
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def run_until_complete(self):
+        """启动流水线并等待所有任务结束，供命令行使用"""
+        self.start()
+        if self._task is not None:
+            await self._task
+
+    async def _run(self):
+        try:
+            if not await self.ensure_login():
+                self.last_error = "登录教务系统失败"
+                logging.error("批量预取: 登录教务系统失败")
+                return
+            self.last_error = None
+            self._rate_lock = asyncio.Lock()
+            # 拉取线程退出后，其他任务可能因解析失败重新排队，直到全部结束
+            while self._unfinished():
+                parse_queue = asyncio.Queue(PARSE_QUEUE_SIZE)
+                parser = asyncio.create_task(self._parse_worker(parse_queue))
+                fetchers = [
+                    asyncio.create_task(self._fetch_worker(parse_queue))
+                    for _ in range(FETCH_CONCURRENCY)
+                ]
+                await asyncio.gather(*fetchers)
+                await parse_queue.put(None)
+                await parser
+            done = sum(1 for job in self._jobs.values() if job["state"] == JOB_DONE)
+            logging.info(f"批量预取结束: 完成 {done}/{len(self._jobs)}")
+        except Exception as e:
+            self.last_error = str(e)
+            logging.error(f"批量预取出错: {str(e)}")
+
+    def _next_job(self):
+        """
+        取下一个可执行的任务，已拉取待解析的优先
+
+        返回:
+            tuple: (任务, 需等待的秒数)；没有剩余任务时为 (None, None)
+        """
+        now = time.time()
+        waiting = None
+        for state in (JOB_FETCHED, JOB_PENDING):
+            for key, job in self._jobs.items():
+                if job["state"] != state or key in self._in_flight:
+                    continue
+                delay = job["not_before"] - now
+                if delay <= 0:
+                    self._in_flight.add(key)
+                    return job, 0
+                waiting = delay if waiting is None else min(waiting, delay)
+        return None, waiting
+
+    def _set_state(self, job, state, error=None):
+        job["state"] = state
+        job["error"] = error
+        job["updated_at"] = time.time()
+        if state in (JOB_PENDING, JOB_DONE, JOB_FAILED):
+            self._in_flight.discard(f"{job['xnxqh']}:{job['week']}")
+        self._save()
+
+    def _fail(self, job, error):
+        job["attempts"] += 1
+        logging.warning(
+            f"预取 {job['xnxqh']} 第{job['week']}周失败（第{job['attempts']}次）: {error}"
+        )
+        if job["attempts"] >= MAX_ATTEMPTS:
+            self._set_state(job, JOB_FAILED, error)
+        else:
+            job["not_before"] = time.time() + RETRY_DELAY
+            self._set_state(job, JOB_PENDING, error)
+
+    async def _fetch_worker(self, parse_queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            job, wait = self._next_job()
+            if job is None:
+                if wait is None:
+                    return
+                await asyncio.sleep(wait)
+                continue
+
+            if job["state"] == JOB_FETCHED:
+                # 重启前已拉取并归档，直接从归档读取
+                latest = await loop.run_in_executor(
+                    None, load_latest_html, job["xnxqh"], job["week"]
+                )
+                if latest is not None:
+                    await parse_queue.put((job, latest[1]))
+                    continue
+
+            self._set_state(job, JOB_FETCHING)
+            async with self._rate_lock:
+                delay = self._last_fetch + FETCH_INTERVAL - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self._last_fetch = time.monotonic()
+
+            if not upstream_breaker.allow_request():
+                self._fail(job, "教务系统暂时不可用")
+                continue
+            fetched = await loop.run_in_executor(
+                None, fetch_classtable_html, job["xnxqh"], "", job["week"]
+            )
+            if "error" in fetched:
+                self._fail(job, fetched["error"])
+                continue
+            self._set_state(job, JOB_FETCHED)
+            await parse_queue.put((job, fetched["html"]))
+
+    async def _parse_worker(self, parse_queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await parse_queue.get()
+            if item is None:
+                return
+            job, html = item
+            try:
+                snapshot = await loop.run_in_executor(
+                    None, apply_snapshot_html, job["xnxqh"], job["week"], html
+                )
+            except Exception as e:
+                snapshot = {"error": str(e)}
+            if "error" in snapshot:
+                self._fail(job, snapshot["error"])
+            else:
+                job["version"] = snapshot["version"]
+                self._set_state(job, JOB_DONE)
+
+    def counts(self):
+        """本批各状态的任务数"""
+        counts = {}
+        for job in self._jobs.values():
+            counts[job["state"]] = counts.get(job["state"], 0) + 1
+        return counts
+
+    def format_progress(self):
+        """格式化本批预取任务的进度，供主人命令查看"""
+        lines = ["【空教室批量预取进度】", ""]
+        if not self._jobs:
+            lines.append("暂无预取任务")
+            return "\n".join(lines)
+
+        counts = self.counts()
+        started = datetime.fromtimestamp(self.batch_started_at or time.time())
+        lines.append(f"状态：{'运行中' if self.running() else '已停止'}")
+        lines.append(f"本批开始：{started.strftime('%m-%d %H:%M:%S')}")
+        summary = [f"完成 {counts.get(JOB_DONE, 0)}/{len(self._jobs)}"]
+        summary.extend(
+            f"{_STATE_NAMES[state]} {counts[state]}"
+            for state in (JOB_FETCHING, JOB_FETCHED, JOB_PENDING, JOB_FAILED)
+            if counts.get(state)
+        )
+        lines.append("，".join(summary))
+        if self.last_error:
+            lines.append(f"错误：{self.last_error}")
+        lines.append("")
+        for job in self._jobs.values():
+            line = (
+                f"{job['xnxqh']} 第{job['week']}周 {_STATE_NAMES[job['state']]}"
+                f"（{job['reason']}）"
+            )
+            if job["state"] != JOB_DONE and job["error"]:
+                line += f" {job['error']}"
+            lines.append(line)
+        return "\n".join(lines)
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from .snapshot_store import refresh_snapshot
+from .term_calendar import PERIOD_SCHEDULE, get_week_and_day
+
+# 在每个节次边界前提前多少分钟预取
+PREFETCH_LEAD_MINUTES = 10
+
+# 晚间预取明天课表的时间，晚上"明天"类查询较多
+EVENING_PREFETCH_TIME = "20:00"
+
+
+class PrefetchScheduler:
+    """
+    按作息时间在节次边界前预取课表快照
+
+    在每个节次上课、下课前 PREFETCH_LEAD_MINUTES 分钟，以及每晚
+    EVENING_PREFETCH_TIME，预取今天、明天所在周和下一周的全校课表并重建索引，
+    使高峰期的查询直接命中快照。
+
+    参数:
+        semester_start_dates (dict): 学期开学日期配置
+        get_term (callable): 返回当前学年学期的函数
+        ensure_login (callable): 确保已登录的协程函数，返回是否登录成功
+        pipeline (PrefetchPipeline, optional): 每次运行后把之后几周尚未就绪的
+            课表交给批量预取流水线
+    """
+
+    def __init__(self, semester_start_dates, get_term, ensure_login, pipeline=None):
+        self.semester_start_dates = semester_start_dates
+        self.get_term = get_term
+        self.ensure_login = ensure_login
+        self.pipeline = pipeline
+        self.last_run = None
+        self._task = None
+
+    def start(self):
+        """在当前事件循环中启动调度任务，重复调用不会重复启动"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run_forever())
+            logging.info("课表预取调度器已启动")
+
+    def next_runs(self, now=None, count=5):
+        """
+        计算接下来的预取计划
+
+        返回:
+            list: [(运行时间, 原因), ...]，按时间排序
+        """
+        now = now or datetime.now()
+        lead = timedelta(minutes=PREFETCH_LEAD_MINUTES)
+        runs = []
+        for offset in range(2):
+            date = (now + timedelta(days=offset)).date()
+            for code, start, end in PERIOD_SCHEDULE:
+                for label, clock in (("上课", start), ("下课", end)):
+                    at = datetime.combine(
+                        date, datetime.strptime(clock, "%H:%M").time()
+                    )
+                    runs.append((at - lead, f"{code}{label}前"))
+            evening = datetime.strptime(EVENING_PREFETCH_TIME, "%H:%M").time()
+            runs.append((datetime.combine(date, evening), "晚间预取明天"))
+        runs = sorted(run for run in runs if run[0] > now)
+        return runs[:count]
+
+    def prefetch_targets(self, now=None):
+        """返回需要预取的 (学年学期, 周次) 列表：今天、明天所在周和下一周"""
+        now = now or datetime.now()
+        term = self.get_term()
+        today_week, _ = get_week_and_day(now.date(), term, self.semester_start_dates)
+        tomorrow_week, _ = get_week_and_day(
+            (now + timedelta(days=1)).date(), term, self.semester_start_dates
+        )
+        targets = []
+        for week in (today_week, tomorrow_week, min(today_week + 1, 20)):
+            if (term, week) not in targets:
+                targets.append((term, week))
+        return targets
+
+    async def run_once(self):
+        """立即执行一次预取，并记录运行状态"""
+        started_at = time.time()
+        targets = self.prefetch_targets()
+        status = {"started_at": started_at, "targets": targets, "errors": []}
+
+        if not await self.ensure_login():
+            status["errors"].append("登录教务系统失败")
+        else:
+            loop = asyncio.get_running_loop()
+            for xnxqh, week in targets:
+                # 拉取和解析是阻塞操作，放到线程池中执行
+                snapshot = await loop.run_in_executor(
+                    None, refresh_snapshot, xnxqh, week
+                )
+                if "error" in snapshot:
+                    status["errors"].append(f"{xnxqh} 第{week}周: {snapshot['error']}")
+            if self.pipeline is not None:
+                xnxqh, today_week = targets[0]
+                self.pipeline.enqueue_lookahead(xnxqh, today_week)
+
+        status["duration"] = time.time() - started_at
+        self.last_run = status
+        logging.info(
+            f"课表预取完成，耗时 {status['duration']:.1f}s，失败 {len(status['errors'])} 项"
+        )
+        return status
+
+    async def _run_forever(self):
+        await self._safe_run_once()
+        while True:
+            runs = self.next_runs(count=1)
+            delay = (runs[0][0] - datetime.now()).total_seconds()
+            await asyncio.sleep(max(delay, 1))
+            await self._safe_run_once()
+
+    async def _safe_run_once(self):
+        try:
+            await self.run_once()
+        except Exception as e:
+            logging.error(f"课表预取出错: {str(e)}")
+            self.last_run = {
+                "started_at": time.time(),
+                "targets": [],
+                "errors": [str(e)],
+                "duration": 0,
+            }
+
+    def format_status(self):
+        """格式化预取计划和上次运行状态，供主人命令查看"""
+        lines = ["【空教室预取状态】", ""]
+        lines.append("接下来的预取计划：")
+        for at, reason in self.next_runs():
+            lines.append(f"  {at.strftime('%m-%d %H:%M')} {reason}")
+        lines.append("")
+
+        if self.last_run is None:
+            lines.append("上次运行：尚未运行")
+        else:
+            run = self.last_run
+            started = datetime.fromtimestamp(run["started_at"])
+            targets = "、".join(f"{t} 第{w}周" for t, w in run["targets"])
+            lines.append(f"上次运行：{started.strftime('%Y-%m-%d %H:%M:%S')}")
+            lines.append(f"预取目标：{targets or '无'}")
+            lines.append(f"耗时：{run['duration']:.1f}秒")
+            if run["errors"]:
+                lines.append("错误：")
+                lines.extend(f"  {error}" for error in run["errors"])
+            else:
+                lines.append("状态：成功")
+        return "\n".join(lines)
@@ -0,0 +1,474 @@
+"""
+课表回放语料：保存真实的教务系统整周响应及其空闲教室答案，用于回归检查
+
+每个用例是语料目录下的一个子目录，包含 response.html.gz（原始响应，手工编写的
+用例为未压缩的 response.html）和 case.json（学期、周次、教室列表、边界情况标记和
+各查询的空闲教室答案）。检查时用各个解析器和索引实现重新计算答案，与保存的答案
+逐一比较，并记录解析和查询耗时，与 baseline.json 中的基线比较。
+
+项目根目录的 replay_corpus 中是随代码提交的手工用例，答案逐格手工推算，
+不依赖被检查的解析器；采集的真实响应保存在数据目录中，两者都会被检查。
+"""
+
+import gzip
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+from .get_room_classtable import (
+    parse_classtable_new,
+    parse_header_html,
+    split_table_rows,
+)
+from .index_file import load_index, save_index
+from .occupancy_index import OccupancyIndex, get_building_name
+from .row_parse import parse_classtable_html, parse_rows
+
+# 随代码提交的手工用例目录，位于项目根目录
+BUNDLED_CORPUS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "replay_corpus",
+)
+
+# 每个用例检查的节次范围，None 表示全天
+QUERY_RANGES = [
+    (None, None),
+    ("01", "02"),
+    ("03", "04"),
+    ("05", "06"),
+    ("07", "08"),
+    ("09", "11"),
+    ("12", "13"),
+    ("01", "04"),
+    ("05", "08"),
+]
+
+# 耗时超过基线的该比例时视为性能回退
+TIMING_TOLERANCE = 0.3
+
+# 耗时低于该秒数的阶段不判断回退，避免计时误差造成误报
+TIMING_MIN_SECONDS = 0.005
+
+# 边界情况标记
+FEATURE_NAMES = {
+    "merged_cells": "合并单元格",
+    "three_period": "三节连排(如091011)",
+    "multi_course": "单元格内多门课程",
+    "empty_rooms": "整周无课的教室",
+}
+
+_MERGED_CELL_PATTERN = re.compile(r"<td[^>]*\b(?:col|row)span\s*=", re.I)
+_CELL_PATTERN = re.compile(r"<td\b.*?</td>", re.S | re.I)
+
+
+def detect_features(html, rooms_data):
+    """
+    识别响应中包含的边界情况
+
+    参数:
+        html (str): 原始响应
+        rooms_data (list): 不过滤时解析出的全部教室，包括无课教室
+
+    返回:
+        list: FEATURE_NAMES 中的键
+    """
+    features = []
+    split = split_table_rows(html)
+    row_htmls = split[1] if split else []
+    if any(_MERGED_CELL_PATTERN.search(row) for row in row_htmls):
+        features.append("merged_cells")
+    if any(
+        len(period) == 6
+        for room in rooms_data
+        for periods in room["schedule"].values()
+        for period in periods
+        if period.isdigit()
+    ):
+        features.append("three_period")
+    if any(
+        cell.count("kbcontent1") > 1
+        for row in row_htmls
+        for cell in _CELL_PATTERN.findall(row)
+    ):
+        features.append("multi_course")
+    if any(not room["schedule"] for room in rooms_data):
+        features.append("empty_rooms")
+    return features
+
+
+def _parse_all_rooms(html):
+    """解析响应中的全部教室行，包括无课教室，返回 None 表示不是课表响应"""
+    split = split_table_rows(html)
+    if split is None:
+        return None
+    header_html, row_htmls = split
+    header = parse_header_html(header_html)
+    if header is None:
+        return None
+    periods, periods_per_day = header
+    return [room for room in parse_rows(row_htmls, periods, periods_per_day) if room]
+
+
+def _queries(rooms):
+    """生成用例的查询列表：(教学楼, 星期, jc1, jc2)"""
+    buildings = sorted({get_building_name(name) for name in rooms})
+    return [
+        (building, day, jc1, jc2)
+        for building in buildings
+        for day in range(1, 8)
+        for jc1, jc2 in QUERY_RANGES
+    ]
+
+
+def _query_key(building, day, jc1, jc2):
+    return f"{building}|{day}|{jc1 or ''}-{jc2 or ''}"
+
+
+def _free(rooms, building, occupied):
+    return [
+        name for name in rooms if name.startswith(building) and name not in occupied
+    ]
+
+
+def _answers(rooms, occupied_rooms):
+    """用 occupied_rooms(教学楼, 星期, jc1, jc2) 计算每个查询的空闲教室"""
+    return {
+        _query_key(*query): _free(rooms, query[0], occupied_rooms(*query))
+        for query in _queries(rooms)
+    }
+
+
+def _reference_index(html):
+    from bs4 import BeautifulSoup
+
+    table = BeautifulSoup(html, "html.parser").find("table", id="kbtable")
+    return OccupancyIndex(parse_classtable_new(table))
+
+
+def capture_case(corpus_dir, html, xnxqh, week, label=None, overwrite=False):
+    """
+    把一份整周全校课表响应加入语料，答案由 parse_classtable_new 和 OccupancyIndex 计算
+
+    保存后应人工抽查 case.json 中的答案，确认无误后它就是之后所有实现的标准答案。
+
+    参数:
+        corpus_dir (str): 语料目录
+        html (str): 原始响应
+        xnxqh (str): 学年学期
+        week (int): 周次
+        label (str, optional): 用例名后缀，用于区分同一周的多份响应
+        overwrite (bool): 同名用例已存在时是否覆盖
+
+    返回:
+        dict: 成功时返回用例信息，失败时返回 {"error": ...}
+    """
+    rooms_data = _parse_all_rooms(html)
+    if not rooms_data:
+        return {"error": "响应中没有课表数据"}
+    rooms = [room["name"] for room in rooms_data]
+
+    name = f"{xnxqh}-w{int(week):02d}" + (f"-{label}" if label else "")
+    case_dir = os.path.join(corpus_dir, name)
+    if os.path.exists(case_dir) and not overwrite:
+        return {"error": f"用例 {name} 已存在"}
+
+    index = _reference_index(html)
+    case = {
+        "name": name,
+        "xnxqh": xnxqh,
+        "week": int(week),
+        "captured_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "features": detect_features(html, rooms_data),
+        "rooms": rooms,
+        "expected": _answers(rooms, index.occupied_rooms),
+    }
+    os.makedirs(case_dir, exist_ok=True)
+    with gzip.open(
+        os.path.join(case_dir, "response.html.gz"), "wt", encoding="utf-8"
+    ) as f:
+        f.write(html)
+    with open(os.path.join(case_dir, "case.json"), "w", encoding="utf-8") as f:
+        json.dump(case, f, ensure_ascii=False, indent=1)
+    logging.info(
+        f"已保存回放用例 {name}: {len(rooms)} 间教室，{len(case['expected'])} 个查询"
+    )
+    return case
+
+
+def load_cases(corpus_dir):
+    """
+    读取语料中的全部用例
+
+    返回:
+        list: [(用例, 原始响应), ...]，按用例名排序
+    """
+    cases = []
+    if not os.path.isdir(corpus_dir):
+        return cases
+    for name in sorted(os.listdir(corpus_dir)):
+        case_dir = os.path.join(corpus_dir, name)
+        case_file = os.path.join(case_dir, "case.json")
+        if not os.path.isfile(case_file):
+            continue
+        plain_file = os.path.join(case_dir, "response.html")
+        try:
+            with open(case_file, "r", encoding="utf-8") as f:
+                case = json.load(f)
+            if os.path.isfile(plain_file):
+                with open(plain_file, "r", encoding="utf-8") as f:
+                    cases.append((case, f.read()))
+                continue
+            with gzip.open(
+                os.path.join(case_dir, "response.html.gz"), "rt", encoding="utf-8"
+            ) as f:
+                cases.append((case, f.read()))
+        except Exception as e:
+            logging.error(f"读取回放用例 {name} 失败: {str(e)}")
+    return cases
+
+
+def _best_of(func, repeat):
+    """重复执行并返回 (最后一次的结果, 最短耗时)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def _compare(expected, actual):
+    """返回答案不一致的查询：[(查询, 缺少的教室, 多出的教室), ...]"""
+    mismatches = []
+    for key, free in expected.items():
+        got = actual.get(key)
+        if got is None:
+            mismatches.append((key, free, []))
+            continue
+        missing = sorted(set(free) - set(got))
+        extra = sorted(set(got) - set(free))
+        if missing or extra:
+            mismatches.append((key, missing, extra))
+    return mismatches
+
+
+def run_case(case, html, repeat=3):
+    """
+    用各个实现重新计算一个用例的答案并计时
+
+    比较的实现：
+        bs4: parse_classtable_new 解析整个文档 + OccupancyIndex
+        rows: parse_classtable_html 切分教室行后解析 + OccupancyIndex（快照使用的路径）
+        index_file: OccupancyIndex 写入索引文件后以内存映射方式查询
+        columnar: 列式表示，需要 numpy
+        bs4_by_day: 按星期过滤解析，只比较全天查询（实时查询使用的路径）
+
+    返回:
+        dict: {"mismatches": {实现: [...]}, "timings": {阶段: 秒}, "skipped": [实现]}
+    """
+    from bs4 import BeautifulSoup
+
+    rooms = case["rooms"]
+    expected = case["expected"]
+    queries = _queries(rooms)
+    timings = {}
+    mismatches = {}
+    skipped = []
+
+    def parse_bs4():
+        table = BeautifulSoup(html, "html.parser").find("table", id="kbtable")
+        return table, parse_classtable_new(table)
+
+    (table, rooms_bs4), timings["parse_bs4"] = _best_of(parse_bs4, repeat)
+    rooms_by_row, timings["parse_rows"] = _best_of(
+        lambda: parse_classtable_html(html), repeat
+    )
+
+    index, timings["build_index"] = _best_of(
+        lambda: OccupancyIndex(rooms_by_row), repeat
+    )
+    answers, timings["query_index"] = _best_of(
+        lambda: _answers(rooms, index.occupied_rooms), repeat
+    )
+    mismatches["rows"] = _compare(expected, answers)
+
+    # 索引文件和列式表示基于包括无课教室在内的全部教室，与用例的教室列表一致
+    all_rooms = _parse_all_rooms(html) or []
+    full_index = OccupancyIndex(all_rooms)
+    mismatches["bs4"] = _compare(
+        expected, _answers(rooms, OccupancyIndex(rooms_bs4).occupied_rooms)
+    )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "replay.idx")
+        snapshot = {
+            "xnxqh": case["xnxqh"],
+            "week": case["week"],
+            "version": 1,
+            "fetched_at": time.time(),
+            "index": full_index,
+            "rooms": {room["name"]: room for room in all_rooms},
+        }
+        save_index(path, snapshot)
+        loaded = load_index(path)
+        if loaded is None:
+            mismatches["index_file"] = [("加载索引文件失败", [], [])]
+        else:
+            mapped = loaded[1]
+            answers, timings["query_index_file"] = _best_of(
+                lambda: _answers(rooms, mapped.occupied_rooms), repeat
+            )
+            mismatches["index_file"] = _compare(expected, answers)
+            # 释放内存映射，临时目录才能删除
+            del mapped, loaded
+
+    from .columnar import ColumnarTimetable, _import_numpy
+
+    if _import_numpy():
+        columnar, timings["build_columnar"] = _best_of(
+            lambda: ColumnarTimetable(snapshot, room_names=rooms), repeat
+        )
+
+        def columnar_answers():
+            known = set(rooms)
+            return {
+                _query_key(*query): [
+                    name for name in columnar.free_rooms(*query) if name in known
+                ]
+                for query in queries
+            }
+
+        answers, timings["query_columnar"] = _best_of(columnar_answers, repeat)
+        mismatches["columnar"] = _compare(expected, answers)
+    else:
+        skipped.append("columnar")
+
+    # 实时查询按星期过滤解析，节次过滤依赖教务系统，这里只比较全天查询
+    full_day = {}
+    start = time.perf_counter()
+    for day in range(1, 8):
+        occupied = {
+            room["name"] for room in parse_classtable_new(table, specific_day=day)
+        }
+        for building, query_day, jc1, jc2 in queries:
+            if query_day == day and jc1 is None:
+                full_day[_query_key(building, day, None, None)] = _free(
+                    rooms, building, occupied
+                )
+    timings["parse_by_day"] = time.perf_counter() - start
+    # 手工用例只给出部分查询的答案，只比较有答案的查询
+    mismatches["bs4_by_day"] = _compare(
+        {key: expected[key] for key in full_day if key in expected}, full_day
+    )
+
+    return {"mismatches": mismatches, "timings": timings, "skipped": skipped}
+
+
+def load_baseline(corpus_dir):
+    path = os.path.join(corpus_dir, "baseline.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(corpus_dir, baseline):
+    path = os.path.join(corpus_dir, "baseline.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def find_regressions(timings, baseline, tolerance=None):
+    """
+    找出比基线慢超过 tolerance 的阶段
+
+    返回:
+        list: [(阶段, 基线秒数, 本次秒数), ...]
+    """
+    tolerance = TIMING_TOLERANCE if tolerance is None else tolerance
+    regressions = []
+    for stage, elapsed in timings.items():
+        base = baseline.get(stage)
+        if base is None or max(base, elapsed) < TIMING_MIN_SECONDS:
+            continue
+        if elapsed > base * (1 + tolerance):
+            regressions.append((stage, base, elapsed))
+    return regressions
+
+
+def check_corpus(corpus_dir, repeat=3, tolerance=None, update_baseline=False):
+    """
+    回放随代码提交的手工用例和语料目录中的全部用例
+
+    参数:
+        corpus_dir (str): 采集用例的语料目录，耗时基线也保存在这里
+        repeat (int): 每个阶段重复次数，取最短耗时
+        tolerance (float, optional): 允许的耗时增幅，默认为 TIMING_TOLERANCE
+        update_baseline (bool): 是否用本次耗时覆盖基线
+
+    返回:
+        tuple: (是否全部通过, 报告文本)
+    """
+    cases = load_cases(BUNDLED_CORPUS_DIR)
+    if os.path.abspath(corpus_dir) != BUNDLED_CORPUS_DIR:
+        cases += load_cases(corpus_dir)
+    if not cases:
+        return False, f"语料目录中没有用例: {corpus_dir}"
+
+    baseline = load_baseline(corpus_dir)
+    passed = True
+    covered = set()
+    lines = []
+    for case, html in cases:
+        covered.update(case.get("features", []))
+        result = run_case(case, html, repeat)
+        features = "、".join(FEATURE_NAMES.get(f, f) for f in case.get("features", []))
+        lines.append(
+            f"[{case['name']}] {len(case['rooms'])} 间教室，{len(case['expected'])} 个查询"
+            + (f"，包含: {features}" if features else "")
+        )
+
+        for backend, mismatches in result["mismatches"].items():
+            if not mismatches:
+                continue
+            passed = False
+            lines.append(f"  ✗ {backend}: {len(mismatches)} 个查询答案不一致")
+            for key, missing, extra in mismatches[:5]:
+                lines.append(f"    {key} 缺少{missing[:5]} 多出{extra[:5]}")
+        for backend in result["skipped"]:
+            lines.append(f"  - {backend}: 已跳过")
+
+        timings = result["timings"]
+        regressions = find_regressions(
+            timings, baseline.get(case["name"], {}), tolerance
+        )
+        for stage, base, elapsed in regressions:
+            passed = False
+            lines.append(
+                f"  ✗ {stage} 变慢: {base * 1000:.1f}ms -> {elapsed * 1000:.1f}ms"
+            )
+        lines.append(
+            "  耗时: "
+            + " ".join(
+                f"{stage} {elapsed * 1000:.1f}ms" for stage, elapsed in timings.items()
+            )
+        )
+        if update_baseline:
+            baseline[case["name"]] = timings
+
+    if update_baseline:
+        save_baseline(corpus_dir, baseline)
+        lines.append("已更新耗时基线")
+
+    missing = [FEATURE_NAMES[f] for f in FEATURE_NAMES if f not in covered]
+    if missing:
+        lines.append(f"语料尚未覆盖: {'、'.join(missing)}")
+    lines.append("全部通过" if passed else "存在不一致或性能回退")
+    return passed, "\n".join(lines)
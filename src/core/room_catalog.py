@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+# 手工维护的教室列表，位于项目根目录，作为首次拉取前的初始列表
+CLASSROOMS_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "classrooms.json",
+)
+
+# 教室数少于该值的课表视为不完整，不用于更新教室列表
+MIN_CATALOG_ROOMS = 50
+
+# 从课表推导的列表之间，一次移除的教室超过该比例时视为异常响应，不更新
+MAX_REMOVED_RATIO = 0.2
+
+# 教室列表变动记录最多保留的条数
+CATALOG_HISTORY_SIZE = 20
+
+# 教室列表来源
+SOURCE_FETCH = "fetch"  # 由整周全校课表推导
+SOURCE_FILE = "file"  # classrooms.json
+SOURCE_DEFAULT = "default"  # 内置的默认列表
+
+
+class RoomCatalog:
+    """
+    一个版本的教室列表，创建后不再修改，更新时整体替换
+
+    参数:
+        rooms (list): 教室名，按展示顺序排列
+        version (int): 版本号
+        source (str): 来源，SOURCE_FETCH、SOURCE_FILE 或 SOURCE_DEFAULT
+        updated_at (float): 生成时间戳
+    """
+
+    def __init__(self, rooms, version=1, source=SOURCE_FILE, updated_at=None):
+        self.rooms = tuple(dict.fromkeys(rooms))
+        self.version = version
+        self.source = source
+        self.updated_at = updated_at or time.time()
+        self._names = frozenset(self.rooms)
+        self._by_prefix = {}
+
+    def __contains__(self, room_name):
+        return room_name in self._names
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def with_prefix(self, building_prefix=None):
+        """返回以指定前缀开头的教室，结果按前缀缓存"""
+        if not building_prefix:
+            return list(self.rooms)
+        rooms = self._by_prefix.get(building_prefix)
+        if rooms is None:
+            rooms = [room for room in self.rooms if room.startswith(building_prefix)]
+            self._by_prefix[building_prefix] = rooms
+        return list(rooms)
+
+
+# 当前使用的教室列表，替换引用即完成切换，读取方不需要加锁
+_catalog = None
+_update_lock = threading.Lock()
+
+# 推导出的教室列表的保存路径，未配置时不持久化
+_catalog_file = None
+
+# 教室列表变动记录
+_history = deque(maxlen=CATALOG_HISTORY_SIZE)
+
+
+def get_default_classrooms():
+    """返回默认的教室列表"""
+    return [
+        "格物楼B201",
+        "格物楼B202",
+        "格物楼B203",
+        "格物楼B204",
+        "格物楼B205",
+        "格物楼B206",
+        "格物楼B207",
+        "格物楼B208",
+        "格物楼A101",
+        "格物楼A102",
+        "格物楼A103",
+        "格物楼A104",
+        "致知楼101",
+        "致知楼102",
+        "致知楼103",
+        "致知楼104",
+    ]
+
+
+def _load_initial_catalog():
+    """依次尝试推导出的列表、classrooms.json 和默认列表"""
+    for path, source in ((_catalog_file, SOURCE_FETCH), (CLASSROOMS_FILE, SOURCE_FILE)):
+        if not path or not os.path.exists(path):
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            rooms = data.get("classrooms", [])
+            if rooms:
+                logging.info(f"已从 {os.path.basename(path)} 加载 {len(rooms)} 间教室")
+                return RoomCatalog(
+                    rooms,
+                    version=data.get("version", 1),
+                    source=data.get("source", source),
+                    updated_at=data.get("updated_at"),
+                )
+        except Exception as e:
+            logging.error(f"读取教室列表 {path} 出错: {str(e)}")
+    logging.warning("未找到教室列表文件，使用默认教室列表")
+    return RoomCatalog(get_default_classrooms(), source=SOURCE_DEFAULT)
+
+
+def get_catalog():
+    """返回当前的教室列表"""
+    global _catalog
+    if _catalog is None:
+        with _update_lock:
+            if _catalog is None:
+                _catalog = _load_initial_catalog()
+    return _catalog
+
+
+def configure_catalog(data_dir):
+    """设置推导出的教室列表的保存位置，并在下次使用时重新加载"""
+    global _catalog_file, _catalog
+    _catalog_file = os.path.join(data_dir, "catalog.json")
+    _catalog = None
+
+
+def _save_catalog(catalog):
+    if _catalog_file is None:
+        return
+    try:
+        tmp_path = f"{_catalog_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": catalog.version,
+                    "source": catalog.source,
+                    "updated_at": catalog.updated_at,
+                    "classrooms": list(catalog.rooms),
+                },
+                f,
+                ensure_ascii=False,
+                indent=1,
+            )
+        os.replace(tmp_path, _catalog_file)
+    except Exception as e:
+        logging.error(f"保存教室列表失败: {str(e)}")
+
+
+def update_catalog_from_fetch(room_names):
+    """
+    用整周全校课表的教室列推导教室列表，有变动时生成新版本并整体替换
+
+    课表中没有课的教室也会列出，因此教室列就是完整的教室列表。
+    教室数明显不足的响应视为不完整，不用于更新。
+
+    参数:
+        room_names (list): 课表中的教室名，按表格顺序
+
+    返回:
+        dict: 有变动时返回 {"version", "added", "removed"}，否则返回 None
+    """
+    global _catalog
+    if len(room_names) < MIN_CATALOG_ROOMS:
+        logging.warning(f"课表只有 {len(room_names)} 间教室，不更新教室列表")
+        return None
+
+    with _update_lock:
+        previous = _catalog if _catalog is not None else _load_initial_catalog()
+        names = set(room_names)
+        added = [room for room in room_names if room not in previous]
+        removed = [room for room in previous.rooms if room not in names]
+        if not added and not removed and previous.source == SOURCE_FETCH:
+            return None
+
+        # 手工列表中的过期教室可能很多，只对推导出的列表检查移除比例
+        if (
+            previous.source == SOURCE_FETCH
+            and len(removed) > len(previous) * MAX_REMOVED_RATIO
+        ):
+            logging.warning(
+                f"课表中缺少 {len(removed)} 间已知教室，疑似响应不完整，不更新教室列表"
+            )
+            return None
+
+        catalog = RoomCatalog(
+            room_names, version=previous.version + 1, source=SOURCE_FETCH
+        )
+        _catalog = catalog
+        _save_catalog(catalog)
+
+    change = {
+        "time": catalog.updated_at,
+        "version": catalog.version,
+        "added": added,
+        "removed": removed,
+    }
+    _history.append(change)
+    logging.info(
+        f"教室列表已更新到第 {catalog.version} 版，共 {len(catalog)} 间："
+        f"新增 {len(added)} 间{added[:10]}，移除 {len(removed)} 间{removed[:10]}"
+    )
+    return change
+
+
+def format_catalog_status():
+    """格式化当前教室列表和最近的变动"""
+    catalog = get_catalog()
+    source_names = {
+        SOURCE_FETCH: "由课表推导",
+        SOURCE_FILE: "classrooms.json",
+        SOURCE_DEFAULT: "默认列表",
+    }
+    lines = [
+        f"第 {catalog.version} 版，{len(catalog)} 间教室，"
+        f"来源: {source_names.get(catalog.source, catalog.source)}"
+    ]
+    for change in list(_history)[-3:][::-1]:
+        changed_at = time.strftime("%m-%d %H:%M", time.localtime(change["time"]))
+        lines.append(
+            f"{changed_at} 第 {change['version']} 版: "
+            f"新增 {len(change['added'])} 间，移除 {len(change['removed'])} 间"
+        )
+    return "\n".join(lines)
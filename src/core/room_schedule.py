@@ -0,0 +1,107 @@
+from datetime import datetime
+
+from .free_rooms import WEEKDAY_NAMES, format_age, get_all_classrooms
+from .occupancy_index import split_period_code
+
+
+def format_period(period):
+    """将节次编码格式化为 "第1-2节" """
+    numbers = split_period_code(period)
+    if not numbers:
+        return period
+    if len(numbers) == 1:
+        return f"第{numbers[0]}节"
+    return f"第{numbers[0]}-{numbers[-1]}节"
+
+
+def get_room_bookings(snapshot, room_name, day=None):
+    """
+    从快照中取出单个教室的课程安排，不请求教务系统
+
+    参数:
+        snapshot (dict): snapshot_store 中的快照
+        room_name (str): 完整教室名，如 "格物楼B203"
+        day (int, optional): 星期几，1-7，不指定则返回整周
+
+    返回:
+        list: 按星期、节次排序的课程安排；教室不存在于快照中时返回 None。
+            有课程详情时每项为 {"day", "period", "course_name", "week_range",
+            "class_info", "lines"}；快照从索引文件恢复、没有课程详情时每项为
+            {"day", "periods"}。教室列表中有但快照中没有的教室视为没有课程安排
+    """
+    room_data = snapshot["rooms"].get(room_name)
+    bookings = []
+    if room_data is not None:
+        for day_key, periods in sorted(room_data["schedule"].items()):
+            if day and int(day_key) != int(day):
+                continue
+            for period, classes in sorted(periods.items()):
+                # 跳过"第N节"形式的单节次映射，避免重复
+                if not period.isdigit():
+                    continue
+                for class_data in classes:
+                    bookings.append(
+                        {
+                            "day": int(day_key),
+                            "period": period,
+                            "course_name": class_data.get("course_name"),
+                            "week_range": class_data.get("week_range"),
+                            "class_info": class_data.get("class_info", []),
+                            "lines": class_data.get("all_lines", []),
+                        }
+                    )
+        return bookings
+
+    occupancy = snapshot["index"].room_occupancy(room_name)
+    if occupancy is None:
+        return [] if room_name in get_all_classrooms(room_name) else None
+    # 从索引文件恢复的快照只有占用节次，没有课程详情
+    for d, occupied in sorted(occupancy.items()):
+        if day and d != int(day):
+            continue
+        bookings.append({"day": d, "periods": sorted(occupied)})
+    return bookings
+
+
+def render_room_schedule_message(xnxqh, week, room_name, day, bookings, stale_age=None):
+    """
+    将教室课程安排格式化为回复消息
+
+    参数:
+        xnxqh (str): 学年学期
+        week (int): 周次
+        room_name (str): 教室名
+        day (int): 星期几，为空表示整周
+        bookings (list): get_room_bookings 的返回值
+        stale_age (int, optional): 快照已过期时的数据时长（秒）
+
+    返回:
+        str: 消息文本
+    """
+    message = f"【教室课表】{room_name}\n\n"
+    message += f"学期: {xnxqh}\n"
+    message += f"第{week}周 {WEEKDAY_NAMES[day] if day else '整周'}\n\n"
+    if stale_age is not None:
+        message += f"⚠️以下为{format_age(stale_age)}前的缓存数据，可能不是最新课表\n\n"
+
+    if not bookings:
+        message += "没有课程安排，全天空闲\n" if day else "本周没有课程安排\n"
+    else:
+        current_day = None
+        for booking in bookings:
+            if not day and booking["day"] != current_day:
+                current_day = booking["day"]
+                message += f"{WEEKDAY_NAMES[current_day]}:\n"
+            if "periods" in booking:
+                periods = "、".join(str(p) for p in booking["periods"])
+                message += f"第{periods}节有课（课程详情待下次刷新）\n"
+                continue
+            line = f"{format_period(booking['period'])} {booking['course_name'] or ''}"
+            if booking["week_range"]:
+                line += f" {booking['week_range']}"
+            if booking["class_info"]:
+                line += f" {'、'.join(booking['class_info'])}"
+            message += line + "\n"
+
+    message += f"\n查询时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+    return message
@@ -0,0 +1,64 @@
+from .get_room_classtable import (
+    parse_header_html,
+    parse_room_row,
+    split_table_rows,
+)
+
+
+def _parse_row_htmls(row_htmls, periods, periods_per_day, filters):
+    """解析一组教室行，返回与行一一对应的教室数据"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup("<table>" + "".join(row_htmls) + "</table>", "html.parser")
+    return [
+        parse_room_row(row, periods, periods_per_day, **filters)
+        for row in soup.find_all("tr")
+    ]
+
+
+def parse_rows(row_htmls, periods, periods_per_day, **filters):
+    """
+    解析 split_table_rows 返回的教室行
+
+    参数:
+        row_htmls (list): 教室行HTML列表
+        periods, periods_per_day: parse_table_header 返回的节次信息
+        filters: 传给 parse_room_row 的过滤条件
+
+    返回:
+        list: 与输入行一一对应的教室数据，不匹配或非教室行为 None
+    """
+    if not row_htmls:
+        return []
+    return _parse_row_htmls(row_htmls, periods, periods_per_day, filters)
+
+
+def parse_classtable_html(html, specific_day=None, room_name=None, jc1=None, jc2=None):
+    """
+    解析 kbxx_classroom_ifr 返回的HTML，结果与 parse_classtable_new 相同
+
+    先切分出表头和教室行，只对课表部分构建文档树，不解析页面的其余部分。
+
+    返回:
+        list: 有课教室的课表数据；未找到课表时返回 None
+    """
+    split = split_table_rows(html)
+    if split is None:
+        return None
+    header_html, row_htmls = split
+
+    header = parse_header_html(header_html)
+    if header is None:
+        return []
+    periods, periods_per_day = header
+
+    rooms = parse_rows(
+        row_htmls,
+        periods,
+        periods_per_day,
+        specific_day=specific_day,
+        room_name=room_name,
+        jc1=jc1,
+        jc2=jc2,
+    )
+    return [room for room in rooms if room and room["schedule"]]
@@ -0,0 +1,152 @@
+import logging
+from bisect import bisect_left
+from datetime import datetime
+
+from .free_rooms import WEEKDAY_NAMES, format_age
+from .room_schedule import format_period
+
+# 字段名称
+FIELD_COURSE = "course"  # 课程名和教师，教务系统中两者连在一起
+FIELD_CLASS = "class"  # 上课班级
+
+
+def _room_postings(room_name, room_data):
+    """
+    提取一个教室的所有课程安排及其可检索文本
+
+    返回:
+        list: [(课程安排, [(字段, 文本), ...]), ...]
+    """
+    postings = []
+    for day_key, periods in room_data.get("schedule", {}).items():
+        for period, classes in periods.items():
+            # 跳过"第N节"形式的单节次映射，避免重复
+            if not period.isdigit():
+                continue
+            for class_data in classes:
+                lines = class_data.get("all_lines") or []
+                course_line = lines[0] if lines else class_data.get("course_name")
+                if not course_line:
+                    continue
+                posting = {
+                    "room": room_name,
+                    "day": int(day_key),
+                    "period": period,
+                    "course_name": class_data.get("course_name") or course_line,
+                    "week_range": class_data.get("week_range"),
+                    "class_info": class_data.get("class_info", []),
+                }
+                terms = [(FIELD_COURSE, course_line)]
+                terms += [(FIELD_CLASS, line) for line in posting["class_info"]]
+                postings.append((posting, terms))
+    return postings
+
+
+class SearchIndex:
+    """
+    课程、教师、班级到 (教室, 星期, 节次, 周次) 的倒排索引
+
+    中文课程名和教师名之间没有分隔符，无法可靠分词，因此对每段文本的所有
+    后缀建立有序表：查询词是某个后缀的前缀，即查询词出现在文本中。用二分
+    查找定位，既支持 "通信电子" 这样的前缀匹配，也能用教师名查到课程。
+    """
+
+    def __init__(self, rooms):
+        self._postings = []
+        # 同一门课在多个教室、多天重复出现，只为不同的文本建立后缀
+        text_ids = {}
+        self._text_postings = []
+        for room_name, room_data in rooms.items():
+            for posting, terms in _room_postings(room_name, room_data):
+                posting_id = len(self._postings)
+                self._postings.append(posting)
+                for field, text in terms:
+                    key = (field, text.strip())
+                    text_id = text_ids.get(key)
+                    if text_id is None:
+                        text_id = text_ids[key] = len(self._text_postings)
+                        self._text_postings.append([])
+                    self._text_postings[text_id].append(posting_id)
+
+        keys = []
+        for (field, text), text_id in text_ids.items():
+            for i in range(len(text)):
+                keys.append((text[i:], field, text_id))
+        keys.sort()
+        self._keys = keys
+        logging.info(
+            f"课程倒排索引构建完成，共 {len(self._postings)} 条安排，"
+            f"{len(text_ids)} 段文本，{len(keys)} 个后缀"
+        )
+
+    def __len__(self):
+        return len(self._postings)
+
+    def search(self, query, field=None, limit=200):
+        """
+        查找包含查询词的课程安排
+
+        参数:
+            query (str): 课程名、教师名或班级的一部分
+            field (str, optional): 只在指定字段中查找，FIELD_COURSE 或 FIELD_CLASS
+            limit (int): 最多返回的条数
+
+        返回:
+            list: 课程安排列表，按星期、节次、教室排序
+        """
+        query = query.strip()
+        if not query:
+            return []
+        found = set()
+        i = bisect_left(self._keys, (query,))
+        while i < len(self._keys):
+            suffix, key_field, text_id = self._keys[i]
+            if not suffix.startswith(query):
+                break
+            if field is None or key_field == field:
+                found.update(self._text_postings[text_id])
+            i += 1
+
+        results = [self._postings[posting_id] for posting_id in found]
+        results.sort(key=lambda p: (p["day"], p["period"], p["room"]))
+        return results[:limit]
+
+
+def render_course_search_message(xnxqh, week, query, results, limit=30, stale_age=None):
+    """
+    将课程检索结果格式化为回复消息，按课程分组
+
+    参数:
+        xnxqh (str): 学年学期
+        week (int): 周次
+        query (str): 查询词
+        results (list): SearchIndex.search 的返回值
+        limit (int): 最多列出的安排条数
+        stale_age (int, optional): 快照已过期时的数据时长（秒）
+
+    返回:
+        str: 消息文本
+    """
+    message = f"【课程查询结果】{query}\n\n"
+    message += f"学期: {xnxqh} 第{week}周\n\n"
+    if stale_age is not None:
+        message += f"⚠️以下为{format_age(stale_age)}前的缓存数据，可能不是最新课表\n\n"
+
+    if not results:
+        message += "本周没有找到相关课程，可以输入课程名、教师名或班级的一部分\n"
+    else:
+        courses = {}
+        for posting in results[:limit]:
+            courses.setdefault(posting["course_name"], []).append(posting)
+        for course_name, postings in courses.items():
+            message += f"{course_name}:\n"
+            for p in postings:
+                line = f"  {WEEKDAY_NAMES[p['day']]} {format_period(p['period'])} {p['room']}"
+                if p["class_info"]:
+                    line += f" {'、'.join(p['class_info'])}"
+                message += line + "\n"
+        if len(results) > limit:
+            message += f"\n共 {len(results)} 条，只显示前 {limit} 条，请缩小查询范围\n"
+
+    message += f"\n查询时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+    return message
@@ -0,0 +1,571 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from .get_room_classtable import (
+    fetch_classtable_html,
+    invalidate_cached_results,
+    parse_header_html,
+    split_table_rows,
+    upstream_breaker,
+)
+from .row_parse import parse_rows
+from .room_catalog import configure_catalog, update_catalog_from_fetch
+from .search_index import SearchIndex
+from .occupancy_index import (
+    OccupancyIndex,
+    get_building_name,
+    get_room_occupancy,
+)
+from .html_archive import (
+    configure_archive,
+    load_latest_html,
+)
+from .index_file import (
+    load_index,
+    save_index,
+)
+from .term_calendar import (
+    configure_term_storage,
+    get_current_term,
+    get_known_terms,
+    get_next_term,
+    get_upstream_current_term,
+    is_valid_term,
+)
+from ..utils.bounded_cache import BoundedCache, estimate_size, start_sweeper
+
+# 快照最长有效时间（秒），超过后查询将回退到实时请求
+SNAPSHOT_MAX_AGE = 3 * 3600
+
+# 过期不超过该时间（秒）的快照仍先用于响应查询并标明数据时效，同时在后台刷新；
+# 重启后从索引文件恢复的快照通常已过期，这样首个查询无需等待登录和整周拉取
+STALE_SNAPSHOT_MAX_AGE = 7 * 86400
+
+# 常驻学期最多保留的快照数量，超出时淘汰最早获取的快照
+MAX_SNAPSHOTS = 4
+
+# 是否让下一学期常驻内存，选课和排课期间经常查询下学期的教室
+RESIDENT_NEXT_TERM = True
+
+# 历史学期快照只在查询时从索引文件加载，超过容量或闲置超过该秒数后释放
+HISTORICAL_CACHE_BYTES = 32 * 1024 * 1024
+HISTORICAL_IDLE_SECONDS = 600
+
+# 变动日志最多保留的条数
+CHANGE_LOG_SIZE = 500
+
+# 常驻学期的全校整周课表快照，键为 (学年学期, 周次)
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+# 每个 (学年学期, 周次) 一把刷新锁，同一周的并发刷新依次进行，避免后完成的刷新
+# 基于旧快照计算变动并覆盖先完成的结果
+_apply_locks = {}
+_apply_locks_lock = threading.Lock()
+
+# 按需加载的历史学期快照，键同上；每次查询都重新计时，闲置超时后由后台清理释放
+_historical = BoundedCache(
+    "历史学期快照",
+    max_bytes=HISTORICAL_CACHE_BYTES,
+    default_ttl=HISTORICAL_IDLE_SECONDS,
+    touch_on_get=True,
+)
+
+# 教室占用变动日志，记录每次刷新中新增或取消的课程节次
+_change_log = deque(maxlen=CHANGE_LOG_SIZE)
+
+# 快照变动监听器，回调参数为 (快照, 变动列表)
+_change_listeners = []
+
+# 占用索引文件目录，未配置时不持久化
+_index_dir = None
+
+# 索引文件名：按学期分区后为 <学年学期>/wNN.idx，旧版为 <学年学期>-wNN.idx
+_WEEK_FILE_PATTERN = re.compile(r"^w(\d+)\.idx$")
+_FLAT_INDEX_PATTERN = re.compile(r"^(\d{4}-\d{4}-[12])-w(\d+)\.idx$")
+
+
+def configure_storage(data_dir):
+    """
+    设置持久化目录：原始响应归档于 DATA_DIR/archive/<学年学期>，
+    占用索引存于 DATA_DIR/index/<学年学期>，学期列表存于 DATA_DIR/terms.json，
+    由课表推导的教室列表存于 DATA_DIR/catalog.json
+    """
+    global _index_dir
+    configure_archive(data_dir)
+    configure_term_storage(data_dir)
+    configure_catalog(data_dir)
+    _index_dir = os.path.join(data_dir, "index")
+    os.makedirs(_index_dir, exist_ok=True)
+    _migrate_flat_index_files()
+    # 定期释放闲置的历史学期快照及其内存映射
+    start_sweeper()
+
+
+def _migrate_flat_index_files():
+    """将旧版直接存放在 index 目录下的索引文件移入对应学期的子目录"""
+    for name in os.listdir(_index_dir):
+        match = _FLAT_INDEX_PATTERN.match(name)
+        if match is None:
+            continue
+        xnxqh, week = match.group(1), int(match.group(2))
+        try:
+            os.makedirs(os.path.join(_index_dir, xnxqh), exist_ok=True)
+            os.replace(os.path.join(_index_dir, name), _index_path(xnxqh, week))
+        except OSError as e:
+            logging.error(f"迁移占用索引文件 {name} 失败: {str(e)}")
+
+
+def _index_path(xnxqh, week):
+    return os.path.join(_index_dir, xnxqh, f"w{int(week):02d}.idx")
+
+
+def get_resident_terms():
+    """
+    常驻内存的学期：当前学期、教务系统默认选中的学期，以及它们的下一学期
+
+    返回:
+        set: 学年学期集合
+    """
+    terms = {get_current_term()}
+    upstream_term = get_upstream_current_term()
+    if upstream_term:
+        terms.add(upstream_term)
+    if RESIDENT_NEXT_TERM:
+        terms |= {get_next_term(term) for term in terms}
+    return terms
+
+
+def _hash_row(row_html):
+    return hashlib.sha1(row_html.encode("utf-8")).hexdigest()
+
+
+def refresh_snapshot(xnxqh, week):
+    """
+    拉取全校整周课表，增量更新快照和占用索引
+
+    参数:
+        xnxqh (str): 学年学期，格式如 "2024-2025-2"
+        week (int): 周次
+
+    返回:
+        dict: 成功时返回快照，失败时返回 {"error": ...}
+    """
+    if not upstream_breaker.allow_request():
+        # 熔断期间不请求教务系统，保留已有快照
+        return {"error": "教务系统暂时不可用，未刷新快照"}
+
+    fetched = fetch_classtable_html(xnxqh, "", week)
+    if "error" in fetched:
+        return fetched
+    return apply_snapshot_html(xnxqh, week, fetched["html"])
+
+
+def apply_snapshot_html(xnxqh, week, html, fetched_at=None):
+    """
+    用整周全校课表HTML更新快照，只重新解析哈希发生变化的教室行
+
+    参数:
+        xnxqh (str): 学年学期
+        week (int): 周次
+        html (str): kbxx_classroom_ifr 返回的HTML
+        fetched_at (float, optional): 获取时间戳，默认为当前时间
+
+    返回:
+        dict: 成功时返回快照，失败时返回 {"error": ...}
+    """
+    split = split_table_rows(html)
+    if split is None:
+        logging.error("未找到课表数据")
+        return {"error": "未找到课表数据"}
+    header_html, row_htmls = split
+
+    with _apply_locks_lock:
+        apply_lock = _apply_locks.setdefault((xnxqh, week), threading.Lock())
+    with apply_lock:
+        return _apply_rows(xnxqh, week, header_html, row_htmls, fetched_at)
+
+
+def _apply_rows(xnxqh, week, header_html, row_htmls, fetched_at):
+    """在该周的刷新锁内，基于当前快照解析变化的行并保存新快照"""
+    previous = _lookup(xnxqh, week)
+
+    # 从索引文件恢复的快照没有逐行数据，沿用其版本号，并用其占用索引计算变动
+    base_version = 0
+    restored_index = None
+    if previous is not None and previous.get("restored"):
+        base_version = previous["version"]
+        restored_index = previous["index"]
+        previous = None
+
+    # 表头（节次结构）变化时所有行都需要重新解析
+    header_hash = _hash_row(header_html)
+    if previous is not None and previous["header_hash"] == header_hash:
+        periods, periods_per_day = previous["periods"], previous["periods_per_day"]
+        previous_rows = previous["row_rooms"]
+    else:
+        header = parse_header_html(header_html)
+        if header is None:
+            return {"error": "课表表头结构异常"}
+        periods, periods_per_day = header
+        previous_rows = {}
+
+    row_hashes = [_hash_row(row_html) for row_html in row_htmls]
+
+    # 只解析哈希发生变化的行，数量较多时（如首次构建）交给进程池并行解析
+    changed_rows = [
+        (row_hash, row_html)
+        for row_hash, row_html in zip(row_hashes, row_htmls)
+        if row_hash not in previous_rows
+    ]
+    parsed_rows = parse_rows(
+        [row_html for _, row_html in changed_rows], periods, periods_per_day
+    )
+    parsed = {
+        row_hash: room_data
+        for (row_hash, _), room_data in zip(changed_rows, parsed_rows)
+    }
+
+    row_rooms = {}  # 行哈希 -> 教室数据
+    reparsed_rooms = {}  # 本次重新解析的教室
+    for row_hash in row_hashes:
+        if row_hash in previous_rows:
+            row_rooms[row_hash] = previous_rows[row_hash]
+        elif parsed.get(row_hash) is not None:
+            row_rooms[row_hash] = parsed[row_hash]
+            reparsed_rooms[parsed[row_hash]["name"]] = parsed[row_hash]
+
+    rooms = {room_data["name"]: room_data for room_data in row_rooms.values()}
+    logging.info(
+        f"课表快照 {xnxqh} 第{week}周：共 {len(rooms)} 行，重新解析 {len(reparsed_rooms)} 行"
+    )
+
+    # 全校课表每间教室一行，没有课的教室也在其中，用当前学期的教室列更新教室列表
+    if xnxqh == get_current_term():
+        update_catalog_from_fetch(list(rooms))
+
+    if previous is None:
+        index = OccupancyIndex(rooms.values())
+        # 重启后首次拉取时与恢复的索引比较，停机期间的变动也会记录并通知监听器
+        changes = _diff_indexes(restored_index, index) if restored_index else []
+    else:
+        removed = {name: None for name in previous["rooms"] if name not in rooms}
+        changed_rooms = {**reparsed_rooms, **removed}
+        changes = _diff_rooms(previous["rooms"], changed_rooms)
+        index = previous["index"].with_rooms(changed_rooms)
+
+    # 没有行被重新解析时课程内容不变，沿用上一版的倒排索引
+    if previous is not None and not reparsed_rooms and previous.get("search"):
+        search = previous["search"]
+    else:
+        search = SearchIndex(rooms)
+
+    snapshot = {
+        "xnxqh": xnxqh,
+        "week": week,
+        "version": (
+            previous["version"] + (1 if changes else 0)
+            if previous
+            else base_version + 1
+        ),
+        "fetched_at": fetched_at or time.time(),
+        "header_hash": header_hash,
+        "periods": periods,
+        "periods_per_day": periods_per_day,
+        "row_rooms": row_rooms,
+        "rooms": rooms,
+        "rooms_data": [r for r in rooms.values() if r["schedule"]],
+        "index": index,
+        "search": search,
+    }
+    _store(snapshot)
+    _persist_snapshot(snapshot)
+
+    if changes:
+        _record_changes(snapshot, changes)
+    logging.info(f"课表快照已刷新: {xnxqh} 第{week}周，变动 {len(changes)} 项")
+    return snapshot
+
+
+def _lookup(xnxqh, week):
+    """查找快照，历史学期的快照不在内存中时从索引文件加载"""
+    if xnxqh in get_resident_terms():
+        with _snapshots_lock:
+            return _snapshots.get((xnxqh, week))
+    return _load_historical(xnxqh, week)
+
+
+def _store(snapshot):
+    """保存快照：常驻学期放入 _snapshots，历史学期放入按需加载的缓存"""
+    key = (snapshot["xnxqh"], snapshot["week"])
+    resident = get_resident_terms()
+    if snapshot["xnxqh"] not in resident:
+        _historical.set(key, snapshot, size=estimate_size(snapshot["rooms"]))
+        return
+    with _snapshots_lock:
+        _snapshots[key] = snapshot
+        # 学期切换后，上学期的快照不再常驻，需要时从索引文件重新加载
+        for stale in [k for k in _snapshots if k[0] not in resident]:
+            del _snapshots[stale]
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            oldest = min(_snapshots, key=lambda k: _snapshots[k]["fetched_at"])
+            del _snapshots[oldest]
+
+
+def _persist_snapshot(snapshot):
+    """将快照的占用索引写入对应学期的目录，供重启后或查询历史学期时直接映射使用"""
+    if _index_dir is None:
+        return
+    try:
+        path = _index_path(snapshot["xnxqh"], snapshot["week"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        save_index(path, snapshot)
+    except Exception as e:
+        logging.error(f"保存占用索引失败: {str(e)}")
+
+
+def _restore_index_file(path):
+    """映射索引文件，返回没有课程详情的快照，文件无效时返回 None"""
+    loaded = load_index(path)
+    if loaded is None:
+        return None
+    meta, index = loaded
+    return {
+        "xnxqh": meta["xnxqh"],
+        "week": meta["week"],
+        "version": meta["version"],
+        "fetched_at": meta["fetched_at"],
+        "restored": True,
+        "rooms": {},
+        "rooms_data": [],
+        "index": index,
+        "search": None,
+    }
+
+
+def _load_historical(xnxqh, week):
+    """从缓存或索引文件取得历史学期的快照，都没有时返回 None"""
+    key = (xnxqh, week)
+    snapshot = _historical.get(key)
+    if snapshot is not None or _index_dir is None:
+        return snapshot
+    path = _index_path(xnxqh, week)
+    if not os.path.exists(path):
+        return None
+    snapshot = _restore_index_file(path)
+    if snapshot is not None:
+        _historical.set(key, snapshot, size=os.path.getsize(path))
+        logging.info(f"已按需加载历史学期快照: {xnxqh} 第{week}周")
+    return snapshot
+
+
+def restore_snapshots():
+    """
+    启动时映射常驻学期已保存的占用索引文件，无需解析HTML或登录即可响应查询；
+    其他学期的索引文件留在磁盘上，查询时再按需加载
+
+    返回:
+        int: 恢复的快照数量
+    """
+    if _index_dir is None or not os.path.isdir(_index_dir):
+        return 0
+    restored = 0
+    for xnxqh in sorted(get_resident_terms()):
+        term_dir = os.path.join(_index_dir, xnxqh)
+        if not os.path.isdir(term_dir):
+            continue
+        for name in sorted(os.listdir(term_dir)):
+            if not _WEEK_FILE_PATTERN.match(name):
+                continue
+            snapshot = _restore_index_file(os.path.join(term_dir, name))
+            if snapshot is None:
+                continue
+            with _snapshots_lock:
+                _snapshots.setdefault((snapshot["xnxqh"], snapshot["week"]), snapshot)
+            restored += 1
+    logging.info(f"已从索引文件恢复 {restored} 个课表快照")
+    return restored
+
+
+def replay_archive(xnxqh, week):
+    """
+    用归档中最新的整周全校响应重建快照，不请求教务系统
+
+    返回:
+        dict: 成功时返回快照，失败时返回 {"error": ...}
+    """
+    latest = load_latest_html(xnxqh, week)
+    if latest is None:
+        return {"error": "归档中没有该周的课表"}
+    meta, html = latest
+    # 沿用归档时的获取时间，以便正确标记数据时效
+    return apply_snapshot_html(xnxqh, week, html, fetched_at=meta["time"])
+
+
+def _diff_rooms(previous_rooms, changed_rooms):
+    """
+    比较教室在刷新前后的占用情况
+
+    返回:
+        list: [{"room", "day", "gained", "lost"}, ...]，gained/lost 为新增/取消的节次
+    """
+    changes = []
+    for name, room_data in changed_rooms.items():
+        old = previous_rooms.get(name)
+        old_occupancy = get_room_occupancy(old) if old else {}
+        new_occupancy = get_room_occupancy(room_data) if room_data else {}
+        changes.extend(_diff_occupancy(name, old_occupancy, new_occupancy))
+    return changes
+
+
+def _diff_indexes(previous_index, index):
+    """比较两个占用索引中所有教室的占用情况，返回值同 _diff_rooms"""
+    previous_rooms = previous_index.rooms
+    changes = []
+    for name in sorted(set(previous_rooms) | set(index.rooms)):
+        changes.extend(
+            _diff_occupancy(
+                name, previous_rooms.get(name, {}), index.rooms.get(name, {})
+            )
+        )
+    return changes
+
+
+def _diff_occupancy(name, old_occupancy, new_occupancy):
+    changes = []
+    for day in sorted(set(old_occupancy) | set(new_occupancy)):
+        old_periods = old_occupancy.get(day, set())
+        new_periods = new_occupancy.get(day, set())
+        if old_periods != new_periods:
+            changes.append(
+                {
+                    "room": name,
+                    "day": day,
+                    "gained": sorted(new_periods - old_periods),
+                    "lost": sorted(old_periods - new_periods),
+                }
+            )
+    return changes
+
+
+def _record_changes(snapshot, changes):
+    """记录变动日志，使受影响的缓存失效并通知监听器"""
+    now = time.time()
+    for change in changes:
+        _change_log.append(
+            {
+                "time": now,
+                "xnxqh": snapshot["xnxqh"],
+                "week": snapshot["week"],
+                **change,
+            }
+        )
+
+    affected = {(get_building_name(c["room"]), c["day"]) for c in changes}
+    invalidate_cached_results(snapshot["xnxqh"], snapshot["week"], affected)
+
+    for listener in list(_change_listeners):
+        try:
+            listener(snapshot, changes)
+        except Exception as e:
+            logging.error(f"快照变动监听器出错: {str(e)}")
+
+
+def add_change_listener(listener):
+    """注册快照变动监听器，回调参数为 (快照, 变动列表)"""
+    _change_listeners.append(listener)
+
+
+def get_change_log(limit=50):
+    """返回最近的教室占用变动日志，按时间倒序"""
+    return list(_change_log)[-limit:][::-1]
+
+
+def get_snapshot(xnxqh, week, max_age=SNAPSHOT_MAX_AGE):
+    """
+    获取指定学期周次的快照，不存在或已过期时返回 None
+
+    历史学期的快照在首次查询时从索引文件加载，闲置一段时间后释放；
+    历史学期的课表不再变化，不按 max_age 过期
+    """
+    if xnxqh not in get_resident_terms():
+        return _load_historical(xnxqh, week)
+    with _snapshots_lock:
+        snapshot = _snapshots.get((xnxqh, week))
+    if snapshot is None or time.time() - snapshot["fetched_at"] > max_age:
+        return None
+    return snapshot
+
+
+def get_snapshot_or_stale(xnxqh, week):
+    """
+    获取可用于响应查询的快照，过期不超过 STALE_SNAPSHOT_MAX_AGE 的快照也会返回
+
+    返回:
+        tuple: (快照, 过期快照的数据时长秒数)，快照未过期时时长为 None；
+            没有可用的快照时返回 (None, None)
+    """
+    snapshot = get_snapshot(xnxqh, week, max_age=STALE_SNAPSHOT_MAX_AGE)
+    if snapshot is None:
+        return None, None
+    age = int(time.time() - snapshot["fetched_at"])
+    if age <= SNAPSHOT_MAX_AGE or xnxqh not in get_resident_terms():
+        return snapshot, None
+    return snapshot, age
+
+
+def list_snapshots():
+    """返回所有快照的概要信息"""
+    with _snapshots_lock:
+        snapshots = list(_snapshots.values())
+    return [
+        {
+            "xnxqh": s["xnxqh"],
+            "week": s["week"],
+            "version": s["version"],
+            "age": int(time.time() - s["fetched_at"]),
+            "rooms": len(s["rooms_data"]),
+            "restored": s.get("restored", False),
+        }
+        for s in snapshots
+    ]
+
+
+def list_stored_terms():
+    """
+    返回磁盘上保存了占用索引的学期
+
+    返回:
+        list: [{"xnxqh", "weeks", "resident"}, ...]，按学期排序
+    """
+    if _index_dir is None or not os.path.isdir(_index_dir):
+        return []
+    resident = get_resident_terms()
+    terms = []
+    for xnxqh in sorted(os.listdir(_index_dir)):
+        term_dir = os.path.join(_index_dir, xnxqh)
+        if not is_valid_term(xnxqh) or not os.path.isdir(term_dir):
+            continue
+        weeks = sorted(
+            int(match.group(1))
+            for match in map(_WEEK_FILE_PATTERN.match, os.listdir(term_dir))
+            if match
+        )
+        terms.append({"xnxqh": xnxqh, "weeks": weeks, "resident": xnxqh in resident})
+    return terms
+
+
+def format_storage_status():
+    """格式化按学期分区存储的概况"""
+    lines = []
+    for term in list_stored_terms():
+        mode = "常驻内存" if term["resident"] else "按需加载"
+        lines.append(f"{term['xnxqh']}: {len(term['weeks'])} 周，{mode}")
+    lines.append(f"历史学期快照已加载: {len(_historical)} 个")
+    lines.append(f"已知学期: {'、'.join(get_known_terms()) or '暂无'}")
+    return "\n".join(lines)
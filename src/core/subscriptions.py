@@ -0,0 +1,414 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from .free_rooms import compute_free_rooms
+from .room_catalog import get_catalog
+from .snapshot_store import get_snapshot_or_stale
+from .term_calendar import get_current_term, get_week_and_day
+
+# 每人最多同时订阅的条数
+MAX_PER_USER = 5
+
+# 订阅的有效天数，到期后自动取消
+SUBSCRIPTION_DAYS = 30
+
+# 检查日期切换和待评估订阅的间隔（秒）
+REFRESH_INTERVAL = 60
+
+# 推送消息中最多列出的教室数
+MAX_LISTED_ROOMS = 20
+
+# 写入订阅文件的字段；目标日期和空闲教室集合只在内存中，重启后重新计算
+_SAVED_FIELDS = (
+    "id",
+    "group_id",
+    "user_id",
+    "prefix",
+    "day_rule",
+    "jc1",
+    "jc2",
+    "created_at",
+    "announce",
+)
+
+# 日期规则：相对今天的天数，或每周固定的星期几
+RELATIVE_DAYS = {"今天": 0, "明天": 1, "后天": 2}
+WEEKDAY_RULES = {
+    f"{prefix}{name}": day
+    for prefix in ("周", "星期")
+    for day, name in enumerate("一二三四五六日", start=1)
+}
+WEEKDAY_RULES.update({"周天": 7, "星期天": 7})
+
+
+def resolve_target(day_rule, term, semester_start_dates, today=None):
+    """
+    把日期规则换算为具体的 (学年学期, 周次, 星期)
+
+    参数:
+        day_rule (str): 今天/明天/后天，或周一~周日、星期一~星期日
+        term (str): 学年学期
+        semester_start_dates (dict): 学期开学日期配置
+        today (date, optional): 当天日期，默认为今天
+
+    返回:
+        tuple: (学年学期, 周次, 星期几)
+    """
+    today = today or datetime.now().date()
+    if day_rule in RELATIVE_DAYS:
+        date = today + timedelta(days=RELATIVE_DAYS[day_rule])
+    else:
+        # 固定星期几指本周尚未过去的那天，已过去则为下周
+        offset = (WEEKDAY_RULES[day_rule] - today.isoweekday()) % 7
+        date = today + timedelta(days=offset)
+    week, day = get_week_and_day(date, term, semester_start_dates)
+    return term, week, day
+
+
+def _period_range(sub):
+    return range(sub["jc1"] or 1, (sub["jc2"] or 13) + 1)
+
+
+class SubscriptionManager:
+    """
+    空教室订阅：用户登记 (教学楼, 日期规则, 节次范围)，结果变化时推送
+
+    订阅按 (学年学期, 周次, 星期) -> 教学楼前缀 -> 单节次 建立索引。快照变动时
+    只取出与变动教室同一天、同一教学楼且节次范围与变动节次相交的订阅，逐间
+    更新这些订阅的空闲教室集合，其余订阅不做任何计算；集合与上次通知的结果
+    不同时推送差异。订阅条件保存在数据目录中，重启后重新建立基线，继续生效。
+
+    参数:
+        semester_start_dates (dict): 学期开学日期配置
+        notify (callable): 推送回调，参数为 (订阅, 新空出的教室, 新被占用的教室)，
+            在事件循环中调用
+    """
+
+    def __init__(self, semester_start_dates, notify):
+        self.semester_start_dates = semester_start_dates
+        self.notify = notify
+        self._subs = {}  # 订阅编号 -> 订阅
+        self._index = {}  # (学年学期, 周次, 星期) -> {前缀: {单节次: {订阅编号}}}
+        self._prefix_cache = {}  # (日期, 教室名) -> 匹配的前缀，前缀集合变化时清空
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._state_file = None
+        self._today = None
+        self._loop = None
+        self._task = None
+        self.stats = {"events": 0, "changes": 0, "evaluated": 0, "pushed": 0}
+
+    def configure(self, data_dir):
+        """设置订阅文件位置并恢复已保存的订阅"""
+        self._state_file = os.path.join(data_dir, "subscriptions.json")
+        if not os.path.exists(self._state_file):
+            return
+        try:
+            with open(self._state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except Exception as e:
+            logging.error(f"读取空教室订阅失败: {str(e)}")
+            return
+        with self._lock:
+            self._next_id = state.get("next_id", 1)
+            for sub in state.get("subscriptions", []):
+                # 目标日期在首次 refresh 时换算，空闲教室随后计算
+                sub.update(target=None, free=None)
+                self._subs[sub["id"]] = sub
+        logging.info(f"已恢复 {len(self._subs)} 条空教室订阅")
+
+    def _save(self):
+        if self._state_file is None:
+            return
+        try:
+            tmp_path = f"{self._state_file}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "next_id": self._next_id,
+                        "subscriptions": [
+                            {k: sub[k] for k in _SAVED_FIELDS}
+                            for sub in self._subs.values()
+                        ],
+                    },
+                    f,
+                    ensure_ascii=False,
+                )
+            os.replace(tmp_path, self._state_file)
+        except Exception as e:
+            logging.error(f"保存空教室订阅失败: {str(e)}")
+
+    def _add_to_index(self, sub):
+        if sub["target"] is None:
+            return
+        by_prefix = self._index.setdefault(sub["target"], {})
+        if sub["prefix"] not in by_prefix:
+            self._prefix_cache = {}
+        by_period = by_prefix.setdefault(sub["prefix"], {})
+        for period in _period_range(sub):
+            by_period.setdefault(period, set()).add(sub["id"])
+
+    def _remove_from_index(self, sub):
+        by_prefix = self._index.get(sub["target"])
+        if not by_prefix or sub["prefix"] not in by_prefix:
+            return
+        by_period = by_prefix[sub["prefix"]]
+        for period in _period_range(sub):
+            ids = by_period.get(period)
+            if ids is not None:
+                ids.discard(sub["id"])
+                if not ids:
+                    del by_period[period]
+        if not by_period:
+            del by_prefix[sub["prefix"]]
+            self._prefix_cache = {}
+        if not by_prefix:
+            del self._index[sub["target"]]
+
+    def _evaluate(self, sub):
+        """
+        用快照完整计算一条订阅的空闲教室
+
+        返回:
+            list: 空闲教室，按教室列表顺序；快照尚未就绪时返回 None
+        """
+        xnxqh, week, day = sub["target"]
+        snapshot, _ = get_snapshot_or_stale(xnxqh, week)
+        if snapshot is None:
+            return None
+        self.stats["evaluated"] += 1
+        occupied = snapshot["index"].occupied_rooms(
+            sub["prefix"], day, sub["jc1"], sub["jc2"]
+        )
+        return compute_free_rooms(sub["prefix"], occupied)
+
+    def subscribe(self, group_id, user_id, prefix, day_rule, jc1=None, jc2=None):
+        """
+        添加订阅
+
+        参数:
+            group_id (str): 推送到的群
+            user_id (str): 订阅者
+            prefix (str): 教学楼或教室前缀
+            day_rule (str): 日期规则，见 RELATIVE_DAYS、WEEKDAY_RULES
+            jc1 (int, optional): 开始节次，不指定则为全天
+            jc2 (int, optional): 结束节次
+
+        返回:
+            dict: 订阅，free 为当前空闲教室，快照尚未就绪时为 None；
+                超过每人订阅上限时返回 {"error": ...}
+        """
+        if day_rule not in RELATIVE_DAYS and day_rule not in WEEKDAY_RULES:
+            return {"error": f"不支持的日期：{day_rule}"}
+        target = resolve_target(day_rule, get_current_term(), self.semester_start_dates)
+        with self._lock:
+            mine = [s for s in self._subs.values() if s["user_id"] == user_id]
+            if len(mine) >= MAX_PER_USER:
+                return {
+                    "error": f"每人最多订阅 {MAX_PER_USER} 条，请先取消不需要的订阅"
+                }
+            sub = {
+                "id": self._next_id,
+                "group_id": group_id,
+                "user_id": user_id,
+                "prefix": prefix,
+                "day_rule": day_rule,
+                "jc1": jc1,
+                "jc2": jc2,
+                "created_at": time.time(),
+                "target": target,
+                "free": None,
+                "announce": False,
+            }
+            self._next_id += 1
+            sub["free"] = self._evaluate(sub)
+            # 快照尚未就绪时，就绪后把完整结果推送给订阅者
+            sub["announce"] = sub["free"] is None
+            self._subs[sub["id"]] = sub
+            self._add_to_index(sub)
+            self._save()
+        logging.info(f"新增空教室订阅 #{sub['id']}: {user_id} {prefix} {day_rule}")
+        return sub
+
+    def unsubscribe(self, user_id, sub_id=None):
+        """
+        取消订阅
+
+        参数:
+            user_id (str): 订阅者，只能取消自己的订阅
+            sub_id (int, optional): 订阅编号，不指定则取消该用户的全部订阅
+
+        返回:
+            int: 取消的条数
+        """
+        with self._lock:
+            removed = [
+                sub
+                for sub in self._subs.values()
+                if sub["user_id"] == user_id and sub_id in (None, sub["id"])
+            ]
+            for sub in removed:
+                self._remove_from_index(sub)
+                del self._subs[sub["id"]]
+            if removed:
+                self._save()
+        return len(removed)
+
+    def list_for_user(self, user_id):
+        with self._lock:
+            return [dict(s) for s in self._subs.values() if s["user_id"] == user_id]
+
+    def on_schedule_change(self, snapshot, changes):
+        """
+        快照变动监听器，由 snapshot_store 在解析线程中调用
+
+        参数:
+            snapshot (dict): 变动后的快照
+            changes (list): [{"room", "day", "gained", "lost"}, ...]
+        """
+        index = snapshot["index"]
+        catalog = get_catalog()
+        pushes = []
+        with self._lock:
+            self.stats["events"] += 1
+            self.stats["changes"] += len(changes)
+            # 同一教室可能有多天变动，先按订阅汇总受影响的教室
+            touched = {}
+            for change in changes:
+                target = (snapshot["xnxqh"], snapshot["week"], change["day"])
+                by_prefix = self._index.get(target)
+                if not by_prefix:
+                    continue
+                room = change["room"]
+                if room not in catalog:
+                    continue
+                periods = set(change["gained"]) | set(change["lost"])
+                for prefix in self._matching_prefixes(target, room):
+                    by_period = by_prefix[prefix]
+                    for period in periods:
+                        for sub_id in by_period.get(period, ()):
+                            touched.setdefault(sub_id, set()).add(room)
+
+            for sub_id, rooms in touched.items():
+                sub = self._subs[sub_id]
+                if sub["free"] is None:
+                    continue
+                day = sub["target"][2]
+                wanted = set(_period_range(sub))
+                free = set(sub["free"])
+                for room in rooms:
+                    occupancy = index.room_occupancy(room) or {}
+                    if occupancy.get(day, set()) & wanted:
+                        free.discard(room)
+                    else:
+                        free.add(room)
+                gained = sorted(free - set(sub["free"]))
+                lost = sorted(set(sub["free"]) - free)
+                if gained or lost:
+                    sub["free"] = [
+                        r for r in catalog.with_prefix(sub["prefix"]) if r in free
+                    ]
+                    pushes.append((dict(sub), gained, lost))
+
+        for sub, gained, lost in pushes:
+            self._push(sub, gained, lost)
+
+    def _matching_prefixes(self, target, room):
+        """变动教室匹配的订阅前缀，匹配结果缓存到前缀集合变化为止"""
+        key = (target, room)
+        prefixes = self._prefix_cache.get(key)
+        if prefixes is None:
+            prefixes = [p for p in self._index[target] if room.startswith(p)]
+            self._prefix_cache[key] = prefixes
+        return prefixes
+
+    def _push(self, sub, gained, lost):
+        self.stats["pushed"] += 1
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self.notify, sub, gained, lost)
+
+    def start(self):
+        """在当前事件循环中启动定时检查，重复调用不会重复启动"""
+        self._loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done():
+            self._task = self._loop.create_task(self._run_forever())
+
+    async def _run_forever(self):
+        while True:
+            try:
+                await self._loop.run_in_executor(None, self.refresh)
+            except Exception as e:
+                logging.error(f"检查空教室订阅出错: {str(e)}")
+            await asyncio.sleep(REFRESH_INTERVAL)
+
+    def refresh(self, today=None):
+        """
+        日期切换时重新换算订阅的目标日期并重新计算，删除到期的订阅；
+        空闲教室尚未计算的订阅在快照就绪后计算，订阅时快照尚未就绪的推送完整结果
+        """
+        today = today or datetime.now().date()
+        pushes = []
+        with self._lock:
+            rollover = today != self._today
+            self._today = today
+            term = get_current_term()
+            expire_before = time.time() - SUBSCRIPTION_DAYS * 86400
+            changed = False
+            for sub in list(self._subs.values()):
+                if sub["created_at"] < expire_before:
+                    self._remove_from_index(sub)
+                    del self._subs[sub["id"]]
+                    changed = True
+                    continue
+                if rollover:
+                    target = resolve_target(
+                        sub["day_rule"], term, self.semester_start_dates, today
+                    )
+                    if target != sub["target"]:
+                        # 新的一天重新建立基线，只在之后的变动时推送
+                        self._remove_from_index(sub)
+                        sub["target"] = target
+                        sub["free"] = None
+                        self._add_to_index(sub)
+                if sub["free"] is None:
+                    sub["free"] = self._evaluate(sub)
+                    if sub["free"] is not None and sub["announce"]:
+                        sub["announce"] = False
+                        pushes.append((dict(sub), sub["free"], []))
+                        changed = True
+            if changed:
+                self._save()
+
+        for sub, gained, lost in pushes:
+            self._push(sub, gained, lost)
+
+    def format_status(self):
+        """格式化订阅数量和增量评估统计，供主人命令查看"""
+        with self._lock:
+            total = len(self._subs)
+            targets = len(self._index)
+        stats = self.stats
+        return (
+            f"{total} 条，{targets} 个日期；变动事件 {stats['events']} 次"
+            f"（{stats['changes']} 项），完整计算 {stats['evaluated']} 次，"
+            f"推送 {stats['pushed']} 次"
+        )
+
+
+def format_subscription(sub):
+    """格式化订阅条件，如 "#3 格物楼 明天 第5-6节" """
+    periods = f"第{sub['jc1']}-{sub['jc2']}节" if sub["jc1"] else "全天"
+    return f"#{sub['id']} {sub['prefix']} {sub['day_rule']} {periods}"
+
+
+def format_room_list(rooms):
+    """列出教室，超过 MAX_LISTED_ROOMS 间时只显示前面部分"""
+    if len(rooms) <= MAX_LISTED_ROOMS:
+        return "、".join(rooms)
+    return f"{'、'.join(rooms[:MAX_LISTED_ROOMS])} 等 {len(rooms)} 间"
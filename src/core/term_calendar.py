@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import re
+from datetime import datetime
+
+from .occupancy_index import split_period_code
+
+# 开学日期配置
+SEMESTER_START_DATES = {
+    "2023-2024-1": "2023-09-04",  # 2023-2024学年第一学期开学日期
+    "2023-2024-2": "2024-02-26",  # 2023-2024学年第二学期开学日期
+    "2024-2025-1": "2024-09-02",  # 2024-2025学年第一学期开学日期
+    "2024-2025-2": "2025-02-17",  # 2024-2025学年第二学期开学日期
+}
+
+# 作息时间表，(节次编码, 上课时间, 下课时间)，按学校实际作息调整
+PERIOD_SCHEDULE = [
+    ("0102", "08:00", "09:40"),
+    ("0304", "10:00", "11:40"),
+    ("0506", "14:00", "15:40"),
+    ("0708", "16:00", "17:40"),
+    ("091011", "19:00", "21:25"),
+    ("1213", "21:35", "22:20"),
+]
+
+# 学年学期编码，如 "2024-2025-2"
+TERM_PATTERN = re.compile(r"^\d{4}-\d{4}-[12]$")
+
+# 教务系统页面中学年学期下拉框的选项
+_TERM_OPTION_PATTERN = re.compile(
+    r"<option\b([^>]*?)value=[\"']?(\d{4}-\d{4}-[12])[\"']?([^>]*)>", re.I
+)
+
+# 从教务系统页面识别出的学期列表及教务系统默认选中的学期
+_detected_terms = []
+_detected_current = None
+
+# 识别结果的保存文件，未配置时不持久化
+_terms_file = None
+
+
+# 获取当前学期
+def get_current_term():
+    """获取当前学期"""
+    try:
+        now = datetime.now()
+        year = now.year
+        month = now.month
+
+        if month >= 9:
+            start_year = year
+            end_year = year + 1
+            term = 1
+        elif month <= 1:
+            start_year = year - 1
+            end_year = year
+            term = 1
+        else:
+            start_year = year - 1
+            end_year = year
+            term = 2
+
+        current_term = f"{start_year}-{end_year}-{term}"
+        return current_term
+    except Exception as e:
+        logging.error(f"获取当前学期出错: {str(e)}")
+        return "2024-2025-2"  # 默认返回当前学期
+
+
+def get_week_and_day(date, term, semester_start_dates=None):
+    """
+    计算指定日期在学期中的周次和星期
+
+    参数:
+        date (date): 日期
+        term (str): 学年学期，格式如 "2024-2025-2"
+        semester_start_dates (dict, optional): 学期开学日期配置，默认为 SEMESTER_START_DATES
+
+    返回:
+        tuple: (周次, 星期几)，周次限制在 1-20
+    """
+    if semester_start_dates is None:
+        semester_start_dates = SEMESTER_START_DATES
+    day = date.weekday() + 1
+    start_date = semester_start_dates.get(term)
+    if not start_date:
+        return 1, day
+    days_diff = (date - datetime.strptime(start_date, "%Y-%m-%d").date()).days
+    week = days_diff // 7 + 1 if days_diff >= 0 else 1
+    return min(max(week, 1), 20), day
+
+
+# 获取当前周次和星期
+def get_current_week_and_day():
+    """获取当前周次和星期"""
+    try:
+        term = get_current_term()
+
+        # 获取学期开始日期
+        start_date = SEMESTER_START_DATES.get(term)
+        if not start_date:
+            logging.warning(f"未找到学期 {term} 的开始日期，使用默认值")
+            return 1, datetime.now().weekday() + 1
+
+        # 计算当前是第几周和星期几
+        today = datetime.now().date()
+        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
+
+        # 计算相差的天数
+        days_diff = (today - start_date_obj).days
+
+        # 如果是未来学期，并且当前日期早于开学日期，则模拟为第1周
+        if days_diff < 0:
+            current_week = 1
+            # 使用当前星期几
+            current_day = today.weekday() + 1  # weekday()返回0-6，对应周一到周日
+        else:
+            # 计算当前是第几周（从1开始）
+            current_week = days_diff // 7 + 1
+
+            # 如果超过20周，则限制为20周
+            if current_week > 20:
+                current_week = 20
+            elif current_week < 1:
+                current_week = 1
+
+            # 计算当前是星期几（1-7，对应周一到周日）
+            current_day = today.weekday() + 1  # weekday()返回0-6，对应周一到周日
+
+        return current_week, current_day
+    except Exception as e:
+        logging.error(f"获取当前周次和星期出错: {str(e)}")
+        # 默认返回第1周，当前星期
+        return 1, datetime.now().weekday() + 1
+
+
+def get_current_period(now=None):
+    """
+    根据作息时间表计算当前所在或下一个大节的起始单节次
+
+    参数:
+        now (datetime, optional): 时间，默认为当前时间
+
+    返回:
+        int: 起始单节次，如 10:30 返回 3；当天课程全部结束后返回 None
+    """
+    now = now or datetime.now()
+    clock = now.strftime("%H:%M")
+    for code, _, end in PERIOD_SCHEDULE:
+        if clock < end:
+            return split_period_code(code)[0]
+    return None
+
+
+def is_valid_term(term):
+    """判断学年学期编码格式是否正确"""
+    return bool(term) and TERM_PATTERN.match(term) is not None
+
+
+def get_next_term(term):
+    """
+    计算下一个学期的编码
+
+    参数:
+        term (str): 学年学期，格式如 "2024-2025-2"
+
+    返回:
+        str: 下一个学期，如 "2025-2026-1"
+    """
+    start_year, end_year, index = (int(part) for part in term.split("-"))
+    if index == 1:
+        return f"{start_year}-{end_year}-2"
+    return f"{start_year + 1}-{end_year + 1}-1"
+
+
+def parse_term_options(html):
+    """
+    从教务系统页面中提取学年学期下拉框的选项
+
+    返回:
+        tuple: (学期列表, 默认选中的学期)，未找到时返回 ([], None)
+    """
+    terms = []
+    selected = None
+    for match in _TERM_OPTION_PATTERN.finditer(html or ""):
+        term = match.group(2)
+        if term not in terms:
+            terms.append(term)
+        if "selected" in (match.group(1) + match.group(3)).lower():
+            selected = term
+    return terms, selected
+
+
+def configure_term_storage(data_dir):
+    """设置学期列表的保存位置并加载上次识别的结果"""
+    global _terms_file, _detected_terms, _detected_current
+    _terms_file = os.path.join(data_dir, "terms.json")
+    if not os.path.exists(_terms_file):
+        return
+    try:
+        with open(_terms_file, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        _detected_terms = [t for t in saved.get("terms", []) if is_valid_term(t)]
+        _detected_current = saved.get("current")
+    except Exception as e:
+        logging.error(f"加载学期列表失败: {str(e)}")
+
+
+def update_detected_terms(html):
+    """
+    用教务系统页面中的学期选项更新学期列表，列表有变化时写入文件
+
+    参数:
+        html (str): 包含学年学期下拉框的页面，如 initJc 或课表查询页面的响应
+
+    返回:
+        bool: 是否识别到学期选项
+    """
+    global _detected_terms, _detected_current
+    terms, selected = parse_term_options(html)
+    if not terms:
+        return False
+    terms = sorted(terms)
+    if terms == _detected_terms and selected == _detected_current:
+        return True
+    _detected_terms, _detected_current = terms, selected
+    logging.info(f"识别到教务系统学期列表: {terms}，当前学期: {selected}")
+    if _terms_file:
+        try:
+            tmp_path = f"{_terms_file}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"terms": terms, "current": selected}, f)
+            os.replace(tmp_path, _terms_file)
+        except Exception as e:
+            logging.error(f"保存学期列表失败: {str(e)}")
+    return True
+
+
+def get_known_terms():
+    """返回已知的学期列表：教务系统识别出的学期和配置了开学日期的学期，按时间排序"""
+    return sorted(set(_detected_terms) | set(SEMESTER_START_DATES))
+
+
+def get_upstream_current_term():
+    """返回教务系统页面中默认选中的学期，尚未识别时返回 None"""
+    return _detected_current
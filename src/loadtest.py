@@ -0,0 +1,262 @@
+"""
+消息处理链路压测工具，用伪造的 websocket 和打桩的教务系统回放群聊流量
+
+默认 95% 为普通聊天、5% 为"查空教室"命令（教学楼、日期、节次随机组合），
+按设定速率调用 handle_events，统计吞吐量、回复延迟分位数和事件循环延迟。
+
+需要在机器人框架的根目录下执行（main.py 依赖 app.config、app.api）:
+    python -m app.scripts.QFNUGetFreeClassrooms.src.loadtest --rate 50 --duration 30
+    python -m app.scripts.QFNUGetFreeClassrooms.src.loadtest --html week3.html
+
+指定 --html 时用保存的整周课表建立快照，查询走快照索引；否则查询走
+get_room_classtable，由桩函数按 --upstream-latency 模拟教务系统耗时。
+"""
+
+import argparse
+import asyncio
+import atexit
+import importlib
+import json
+import logging
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+from .core.free_rooms import get_all_classrooms
+from .core.occupancy_index import get_building_name
+
+MAIN_MODULE = "app.scripts.QFNUGetFreeClassrooms.main"
+
+CHATTER = [
+    "有人知道明天几点开会吗",
+    "收到",
+    "哈哈哈哈",
+    "图书馆几点关门",
+    "[CQ:image,file=abc.jpg]",
+    "谢谢",
+    "这周作业交了吗",
+    "查成绩在哪里",
+]
+DAYS = ["", "今天", "明天", "后天"]
+RANGES = ["", "1-2", "3-4", "5-6", "7-8", "9-11", "1-4", "3-8"]
+
+_REPLY_PATTERN = re.compile(r"\[CQ:reply,id=(\d+)\]")
+
+
+class FakeWebSocket:
+    """
+    记录机器人发出的所有动作，按被回复的消息ID记录发送时间
+
+    机器人框架通过 websocket.send(JSON) 调用 send_group_msg、delete_msg 等接口。
+    """
+
+    def __init__(self):
+        self.actions = {}
+        self.replies = {}  # 消息ID -> [发送时间, ...]
+
+    async def send(self, data):
+        now = time.perf_counter()
+        try:
+            payload = json.loads(data)
+        except (TypeError, ValueError):
+            payload = {}
+        action = payload.get("action", "unknown")
+        self.actions[action] = self.actions.get(action, 0) + 1
+
+        message = str(payload.get("params", {}).get("message", ""))
+        match = _REPLY_PATTERN.search(message)
+        if match:
+            self.replies.setdefault(match.group(1), []).append(now)
+
+
+def build_command_pool():
+    """由教室列表生成查询命令可用的教学楼"""
+    buildings = sorted({get_building_name(room) for room in get_all_classrooms()})
+    return buildings or ["格物楼"]
+
+
+def make_event(rng, message_id, groups, buildings, command_ratio):
+    """生成一条群消息事件，返回 (事件, 是否为查询命令)"""
+    is_command = rng.random() < command_ratio
+    if is_command:
+        parts = ["查空教室", rng.choice(buildings)]
+        day = rng.choice(DAYS)
+        jc = rng.choice(RANGES)
+        if jc:
+            parts += [day or "今天", jc]
+        elif day:
+            parts.append(day)
+        raw_message = " ".join(parts)
+    else:
+        raw_message = rng.choice(CHATTER)
+
+    event = {
+        "post_type": "message",
+        "message_type": "group",
+        "group_id": rng.choice(groups),
+        "user_id": rng.randint(10000, 99999),
+        "raw_message": raw_message,
+        "message_id": message_id,
+    }
+    return event, is_command
+
+
+def install_stubs(main, args):
+    """为教务系统相关调用打桩，压测过程中不访问外网"""
+
+    async def ensure_login():
+        return True
+
+    def get_room_classtable(
+        xnxqh, room_name, week, day=None, jc1=None, jc2=None, deadline=None
+    ):
+        time.sleep(args.upstream_latency)
+        return {"status": "success", "data": []}
+
+    main.ensure_login = ensure_login
+    main.get_room_classtable = get_room_classtable
+    main.load_function_status = lambda group_id: True
+    main.HTTP_API_ENABLED = False
+    # 预取调度器会访问教务系统，压测时不启动；订阅检查也不启动
+    main.prefetch_scheduler.start = lambda: None
+    main.prefetch_pipeline.start = lambda: None
+    main.subscriptions.start = lambda: None
+
+    if not args.html:
+        # 不使用启动时从索引文件恢复的快照，所有查询都经过上游桩函数
+        main.get_snapshot_or_stale = lambda xnxqh, week: (None, None)
+        return
+
+    from .core.snapshot_store import apply_snapshot_html, configure_storage
+
+    # 归档、索引文件和教室列表写入临时目录，不覆盖机器人数据目录中的文件
+    data_dir = tempfile.mkdtemp(prefix="qfnu-loadtest-")
+    atexit.register(shutil.rmtree, data_dir, True)
+    configure_storage(data_dir)
+
+    with open(args.html, "r", encoding="utf-8") as f:
+        html = f.read()
+    week = main.get_current_week_and_day()[0]
+    snapshot = apply_snapshot_html(main.get_current_term(), week, html)
+    if "error" in snapshot:
+        raise SystemExit(f"加载快照失败: {snapshot['error']}")
+
+
+async def monitor_loop_lag(interval, samples, stop):
+    """周期性休眠，记录实际唤醒时间比预期晚了多少"""
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - expected))
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+async def run(args):
+    main = importlib.import_module(MAIN_MODULE)
+    install_stubs(main, args)
+
+    rng = random.Random(args.seed)
+    websocket = FakeWebSocket()
+    buildings = build_command_pool()
+    groups = [str(100000 + i) for i in range(args.groups)]
+
+    lag_samples = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(0.01, lag_samples, stop))
+
+    sent_at = {}
+    commands = set()
+    tasks = []
+    total = int(args.rate * args.duration)
+    started = time.perf_counter()
+    for i in range(total):
+        # 按固定速率发送事件，落后时不补发间隔
+        delay = started + i / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        message_id = str(1000000 + i)
+        event, is_command = make_event(
+            rng, message_id, groups, buildings, args.command_ratio
+        )
+        if is_command:
+            commands.add(message_id)
+        sent_at[message_id] = time.perf_counter()
+        tasks.append(asyncio.create_task(main.handle_events(websocket, event)))
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # 回复经由出站队列按速率发出，等队列清空后再统计
+    await main.outbox.drain()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+
+    first_reply, final_reply = [], []
+    unanswered = 0
+    for message_id in commands:
+        times = websocket.replies.get(message_id)
+        if not times:
+            unanswered += 1
+            continue
+        first_reply.append(times[0] - sent_at[message_id])
+        final_reply.append(times[-1] - sent_at[message_id])
+
+    print(f"事件数: {total}（查询命令 {len(commands)}），耗时 {elapsed:.2f}s")
+    print(f"吞吐量: {total / elapsed:.1f} 事件/秒")
+    print(f"发出动作: {websocket.actions}")
+    print(f"出站队列: {main.outbox.format_stats()}")
+    # 合并到同群相同查询的回复只 @ 提问者，不带回复该消息的标记
+    unanswered = max(0, unanswered - main.outbox.stats["merged"])
+    if unanswered:
+        print(f"未收到回复的命令: {unanswered}")
+    for label, values in (("首次回复", first_reply), ("查询结果", final_reply)):
+        print(
+            f"{label}延迟(ms): "
+            f"p50={percentile(values, 50) * 1000:.1f} "
+            f"p95={percentile(values, 95) * 1000:.1f} "
+            f"p99={percentile(values, 99) * 1000:.1f} "
+            f"max={max(values, default=0) * 1000:.1f}"
+        )
+    print(
+        f"事件循环延迟(ms): "
+        f"p50={percentile(lag_samples, 50) * 1000:.1f} "
+        f"p99={percentile(lag_samples, 99) * 1000:.1f} "
+        f"max={max(lag_samples, default=0) * 1000:.1f}"
+    )
+    return 1 if unanswered else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="空闲教室机器人消息处理压测")
+    parser.add_argument("--rate", type=float, default=50, help="每秒事件数")
+    parser.add_argument("--duration", type=float, default=20, help="持续秒数")
+    parser.add_argument(
+        "--command-ratio", type=float, default=0.05, help="查询命令占比"
+    )
+    parser.add_argument("--groups", type=int, default=20, help="群数量")
+    parser.add_argument(
+        "--upstream-latency", type=float, default=0.3, help="模拟教务系统耗时（秒）"
+    )
+    parser.add_argument("--html", help="用保存的整周课表建立快照")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出详细日志")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# 所有缓存实例，用于统一查看统计信息和定期清理
+_registry = []
+
+# 后台清理过期条目的间隔（秒）
+SWEEP_INTERVAL = 60
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def estimate_size(obj, _seen=None):
+    """
+    粗略估算对象占用的字节数，递归统计容器中的元素，同一对象只计算一次
+
+    参数:
+        obj: 任意对象
+
+    返回:
+        int: 估算的字节数
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += estimate_size(key, _seen) + estimate_size(value, _seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += estimate_size(item, _seen)
+    return size
+
+
+class BoundedCache:
+    """
+    按估算字节数限制容量的 LRU 缓存，支持按条目设置过期时间
+
+    超出容量时从最久未使用的条目开始淘汰，过期条目在访问时或由 start_sweeper
+    启动的后台线程删除。线程安全，可在线程池和事件循环中共用。
+
+    参数:
+        name (str): 缓存名称，用于日志和统计
+        max_bytes (int): 最大容量（估算字节数）
+        default_ttl (float, optional): 默认过期秒数，None 表示不过期
+        touch_on_get (bool): 命中时是否重新计算过期时间，为 True 时过期时间
+            表示闲置多久后释放
+    """
+
+    def __init__(self, name, max_bytes, default_ttl=None, touch_on_get=False):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.touch_on_get = touch_on_get
+
+        self._entries = OrderedDict()  # 键 -> (值, 字节数, 过期时间, 过期秒数)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        _registry.append(self)
+
+    def get(self, key, default=None):
+        """读取缓存，命中时将条目移到最近使用的位置"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, size, expires_at, ttl = entry
+            now = time.monotonic()
+            if expires_at is not None and now >= expires_at:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            if self.touch_on_get and ttl is not None:
+                self._entries[key] = (value, size, now + ttl, ttl)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, size=None):
+        """
+        写入缓存
+
+        参数:
+            key: 键，需可哈希
+            value: 值
+            ttl (float, optional): 过期秒数，默认使用 default_ttl
+            size (int, optional): 条目字节数，默认自动估算
+        """
+        if size is None:
+            size = estimate_size(value) + estimate_size(key)
+        if size > self.max_bytes:
+            logging.warning(f"缓存 {self.name} 条目过大，不缓存: {size} 字节")
+            return
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at, ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """删除并返回条目"""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._entries[key][0]
+            self._remove(key)
+            return value
+
+    def discard_where(self, predicate):
+        """
+        删除键满足条件的所有条目
+
+        参数:
+            predicate (callable): 接收键，返回是否删除
+
+        返回:
+            int: 删除的条目数
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def purge_expired(self):
+        """
+        删除所有已过期的条目
+
+        返回:
+            int: 删除的条目数
+        """
+        now = time.monotonic()
+        with self._lock:
+            keys = [
+                key
+                for key, (_, _, expires_at, _) in self._entries.items()
+                if expires_at is not None and now >= expires_at
+            ]
+            for key in keys:
+                self._remove(key)
+            self.expirations += len(keys)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, size, _, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """返回命中、未命中、淘汰次数和当前占用"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+def start_sweeper(interval=SWEEP_INTERVAL):
+    """启动后台线程，定期删除所有缓存中的过期条目，重复调用不会重复启动"""
+    global _sweeper
+
+    def sweep():
+        while True:
+            time.sleep(interval)
+            for cache in list(_registry):
+                try:
+                    cache.purge_expired()
+                except Exception as e:
+                    logging.error(f"清理缓存 {cache.name} 出错: {str(e)}")
+
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=sweep, name="cache-sweeper", daemon=True)
+            _sweeper.start()
+
+
+def format_cache_stats():
+    """格式化所有缓存的统计信息"""
+    lines = []
+    for cache in _registry:
+        s = cache.stats()
+        lines.append(
+            f"{s['name']}: {s['entries']}条 "
+            f"{s['bytes'] / 1024:.0f}/{s['max_bytes'] / 1024:.0f}KB "
+            f"命中率{s['hit_rate']:.0%} "
+            f"(命中{s['hits']} 未命中{s['misses']} "
+            f"淘汰{s['evictions']} 过期{s['expirations']})"
+        )
+    return "\n".join(lines)
@@ -1,12 +1,323 @@
-import ddddocr
+import logging
+import os
+import threading
+import time
+from io import BytesIO
 
-ocr = ddddocr.DdddOcr(show_ad=False)
+# 使用的验证码识别后端，可选值见 BACKENDS，可以先用 captcha-bench 命令比较再选择
+OCR_BACKEND = "ddddocr"
+
+# ddddocr-tuned 后端的 ONNX 推理线程数；验证码图片很小，多线程的调度开销往往大于收益
+OCR_TUNED_THREADS = 1
+
+# 二值化阈值，灰度高于该值的像素视为背景
+BINARIZE_THRESHOLD = 150
+
+# 是否在登录时保存验证码样本：识别正确的按识别结果命名存入 labelled，
+# 识别错误的存入 unlabelled 等待人工标注，作为 captcha-bench 的评测集
+COLLECT_CAPTCHA_SAMPLES = True
+
+# 评测集中准确率相差不超过该值的后端视为同样准确，再比较速度
+ACCURACY_TOLERANCE = 0.01
+
+# 加载后的 ddddocr 模型，键为 ONNX 线程数，None 表示默认设置
+_models = {}
+_models_lock = threading.Lock()
+
+# 样本保存目录，未配置时不保存
+_corpus_dir = None
+
+# 登录时的验证码识别统计
+_stats = {"correct": 0, "wrong": 0}
+_stats_lock = threading.Lock()
+
+
+def _tune_session_threads(model, threads):
+    """
+    用指定线程数重建 ddddocr 内部的 ONNX 推理会话
+
+    ddddocr 没有提供线程设置，这里找到它持有的 InferenceSession，按原模型文件
+    重新创建；找不到时保留默认设置
+    """
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+
+    pending = [model]
+    seen = set()
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or not hasattr(obj, "__dict__"):
+            continue
+        seen.add(id(obj))
+        for name, value in vars(obj).items():
+            if isinstance(value, onnxruntime.InferenceSession):
+                model_path = getattr(value, "_model_path", None)
+                if not model_path:
+                    continue
+                tuned = onnxruntime.InferenceSession(
+                    model_path, sess_options=options, providers=value.get_providers()
+                )
+                setattr(obj, name, tuned)
+                return True
+            if type(value).__module__.startswith("ddddocr"):
+                pending.append(value)
+    logging.warning("未找到 ddddocr 的推理会话，使用默认线程设置")
+    return False
+
+
+def _load_ddddocr(threads=None):
+    """加载 ddddocr 模型，相同线程设置的后端共用一个模型"""
+    model = _models.get(threads)
+    if model is None:
+        with _models_lock:
+            model = _models.get(threads)
+            if model is None:
+                # 导入 ddddocr 和加载模型要花费数百毫秒，只在第一次识别时进行
+                import ddddocr
+
+                model = ddddocr.DdddOcr(show_ad=False)
+                if threads:
+                    _tune_session_threads(model, threads)
+                _models[threads] = model
+    return model
+
+
+def to_grayscale(image):
+    """转为灰度图"""
+    return image.convert("L")
+
+
+def remove_noise(image):
+    """中值滤波去除噪点"""
+    from PIL import ImageFilter
+
+    return image.filter(ImageFilter.MedianFilter(3))
+
+
+def binarize(image):
+    """按 BINARIZE_THRESHOLD 二值化，去掉浅色干扰线"""
+    return image.point(lambda p: 255 if p > BINARIZE_THRESHOLD else 0)
+
+
+class OcrBackend:
+    """
+    验证码识别后端，由图片预处理流程和识别模型组成
+
+    参数:
+        name (str): 后端名称
+        description (str): 说明
+        load_model (callable): 无参数，返回带 classification 方法的模型
+        preprocess (list, optional): 预处理步骤，每步接收并返回 PIL 图片；
+            为空时直接把图片字节交给模型
+    """
+
+    def __init__(self, name, description, load_model, preprocess=None):
+        self.name = name
+        self.description = description
+        self.load_model = load_model
+        self.preprocess = list(preprocess or [])
+
+    def prepare(self, image_bytes):
+        """对验证码图片执行预处理流程"""
+        if not self.preprocess:
+            return image_bytes
+        from PIL import Image
+
+        image = Image.open(BytesIO(image_bytes))
+        for step in self.preprocess:
+            image = step(image)
+        return image
+
+    def classify(self, image_bytes):
+        """识别验证码，返回识别出的字符串"""
+        return self.load_model().classification(self.prepare(image_bytes))
+
+
+# 可选的识别后端，新增后端用 register_backend 注册
+BACKENDS = {}
+
+
+def register_backend(backend):
+    """注册识别后端，同名后端会被替换"""
+    BACKENDS[backend.name] = backend
+
+
+register_backend(OcrBackend("ddddocr", "ddddocr 默认设置", _load_ddddocr))
+register_backend(
+    OcrBackend(
+        "ddddocr-tuned",
+        f"ddddocr，ONNX 推理使用 {OCR_TUNED_THREADS} 个线程",
+        lambda: _load_ddddocr(OCR_TUNED_THREADS),
+    )
+)
+register_backend(
+    OcrBackend(
+        "ddddocr-preprocessed",
+        "灰度、去噪、二值化后再交给 ddddocr",
+        _load_ddddocr,
+        preprocess=[to_grayscale, remove_noise, binarize],
+    )
+)
+
+
+def get_backend(name=None):
+    """返回指定名称的后端，默认为 OCR_BACKEND，名称无效时使用 ddddocr"""
+    name = name or OCR_BACKEND
+    backend = BACKENDS.get(name)
+    if backend is None:
+        logging.warning(f"未知的验证码识别后端 {name}，使用 ddddocr")
+        backend = BACKENDS["ddddocr"]
+    return backend
 
 
 def get_ocr_res(cap_pic_bytes):  # 识别验证码
-    res = ocr.classification(cap_pic_bytes)
+    res = get_backend().classify(cap_pic_bytes)
     return res
 
 
-if __name__ == "__main__":
-    get_ocr_res("123")
+def configure_corpus(directory):
+    """设置登录时保存验证码样本的目录"""
+    global _corpus_dir
+    _corpus_dir = directory
+
+
+def record_captcha_result(image_bytes, guess, correct):
+    """
+    记录一次登录中的验证码识别结果，并按 COLLECT_CAPTCHA_SAMPLES 保存样本
+
+    参数:
+        image_bytes (bytes): 验证码图片
+        guess (str): 识别结果
+        correct (bool): 教务系统是否接受了该验证码
+    """
+    with _stats_lock:
+        _stats["correct" if correct else "wrong"] += 1
+    if not COLLECT_CAPTCHA_SAMPLES or _corpus_dir is None or not image_bytes:
+        return
+    try:
+        stamp = time.strftime("%Y%m%d%H%M%S") + f"{int(time.time() * 1000) % 1000:03d}"
+        if correct and guess:
+            path = os.path.join(_corpus_dir, "labelled", f"{guess}_{stamp}.jpg")
+        else:
+            path = os.path.join(_corpus_dir, "unlabelled", f"{stamp}.jpg")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(image_bytes)
+    except Exception as e:
+        logging.error(f"保存验证码样本失败: {str(e)}")
+
+
+def format_ocr_stats():
+    """格式化登录时的验证码识别准确率"""
+    with _stats_lock:
+        correct, wrong = _stats["correct"], _stats["wrong"]
+    total = correct + wrong
+    if not total:
+        return f"{get_backend().name}: 暂无识别记录"
+    return f"{get_backend().name}: 识别 {total} 次，正确率 {correct / total:.0%}"
+
+
+def load_corpus(corpus_dir):
+    """
+    读取标注好的验证码图片，文件名中第一个 "_" 之前的部分为正确答案，
+    如 "a3xk_20250301.jpg"、"a3xk.png"
+
+    返回:
+        list: [(答案, 图片字节), ...]
+    """
+    corpus = []
+    for name in sorted(os.listdir(corpus_dir)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in (".jpg", ".jpeg", ".png", ".gif", ".bmp"):
+            continue
+        with open(os.path.join(corpus_dir, name), "rb") as f:
+            corpus.append((stem.split("_", 1)[0], f.read()))
+    return corpus
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def benchmark(corpus, backend_names=None):
+    """
+    在评测集上比较各后端的准确率、单张耗时和吞吐量
+
+    参数:
+        corpus (list): load_corpus 的返回值
+        backend_names (list, optional): 参与比较的后端，默认为全部
+
+    返回:
+        list: 每个后端一项 {"backend", "accuracy", "p50_ms", "p95_ms",
+            "throughput", "load_ms", "errors"}，按准确率从高到低、耗时从低到高排序
+    """
+    results = []
+    for name in backend_names or list(BACKENDS):
+        backend = BACKENDS[name]
+        start = time.perf_counter()
+        backend.load_model()
+        load_ms = (time.perf_counter() - start) * 1000
+        # 第一次推理包含 ONNX 的初始化，不计入耗时
+        backend.classify(corpus[0][1])
+
+        correct = errors = 0
+        latencies = []
+        started = time.perf_counter()
+        for label, image_bytes in corpus:
+            start = time.perf_counter()
+            try:
+                guess = backend.classify(image_bytes)
+            except Exception as e:
+                logging.error(f"{name} 识别出错: {str(e)}")
+                guess = None
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+            if guess and guess.lower() == label.lower():
+                correct += 1
+        elapsed = time.perf_counter() - started
+
+        results.append(
+            {
+                "backend": name,
+                "accuracy": correct / len(corpus),
+                "p50_ms": _percentile(latencies, 0.5) * 1000,
+                "p95_ms": _percentile(latencies, 0.95) * 1000,
+                "throughput": len(corpus) / elapsed if elapsed else 0.0,
+                "load_ms": load_ms,
+                "errors": errors,
+            }
+        )
+    results.sort(key=lambda r: (-r["accuracy"], r["p50_ms"]))
+    return results
+
+
+def pick_backend(results):
+    """在准确率与最高者相差不超过 ACCURACY_TOLERANCE 的后端中选出最快的一个"""
+    if not results:
+        return None
+    best_accuracy = max(r["accuracy"] for r in results)
+    candidates = [
+        r for r in results if best_accuracy - r["accuracy"] <= ACCURACY_TOLERANCE
+    ]
+    return min(candidates, key=lambda r: r["p50_ms"])["backend"]
+
+
+def format_benchmark(results, corpus_size):
+    """格式化评测结果"""
+    lines = [f"评测集: {corpus_size} 张验证码"]
+    for r in results:
+        lines.append(
+            f"{r['backend']:<22} 准确率{r['accuracy']:>7.1%}  "
+            f"p50 {r['p50_ms']:>6.1f}ms  p95 {r['p95_ms']:>6.1f}ms  "
+            f"{r['throughput']:>6.1f}张/秒  加载{r['load_ms']:>6.0f}ms"
+            + (f"  出错{r['errors']}" if r["errors"] else "")
+        )
+    best = pick_backend(results)
+    if best:
+        lines.append(f'建议设置 OCR_BACKEND = "{best}"')
+    return "\n".join(lines)
@@ -0,0 +1,140 @@
+import threading
+import time
+import logging
+from collections import deque
+
+# 熔断器状态
+STATE_CLOSED = "closed"  # 正常放行
+STATE_OPEN = "open"  # 熔断中，直接拒绝
+STATE_HALF_OPEN = "half_open"  # 试探中，只放行一个探测请求
+
+
+class CircuitBreaker:
+    """
+    上游熔断器，按滑动窗口统计失败率和慢请求率
+
+    参数:
+        name (str): 熔断器名称，用于日志
+        window_size (int): 滑动窗口内保留的最近调用次数
+        min_calls (int): 窗口内调用次数达到该值后才开始判断是否熔断
+        failure_rate_threshold (float): 失败率阈值，0-1
+        slow_call_seconds (float): 耗时超过该秒数的调用视为慢请求
+        slow_rate_threshold (float): 慢请求率阈值，0-1
+        open_seconds (float): 熔断后多久进入半开状态
+    """
+
+    def __init__(
+        self,
+        name,
+        window_size=20,
+        min_calls=5,
+        failure_rate_threshold=0.5,
+        slow_call_seconds=8.0,
+        slow_rate_threshold=0.6,
+        open_seconds=60.0,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate_threshold = slow_rate_threshold
+        self.open_seconds = open_seconds
+
+        self._calls = deque(maxlen=window_size)  # 元素为 (是否成功, 耗时)
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """当前状态，熔断超时后自动转为半开"""
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if (
+            self._state == STATE_OPEN
+            and time.monotonic() - self._opened_at >= self.open_seconds
+        ):
+            self._state = STATE_HALF_OPEN
+            self._probe_in_flight = False
+            logging.info(f"熔断器[{self.name}]进入半开状态")
+
+    def allow_request(self):
+        """判断是否允许向上游发起请求"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == STATE_CLOSED:
+                return True
+            if self._state == STATE_HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self, elapsed):
+        """记录一次成功调用"""
+        with self._lock:
+            self._calls.append((True, elapsed))
+            if self._state == STATE_HALF_OPEN:
+                if elapsed < self.slow_call_seconds:
+                    self._close()
+                else:
+                    self._open("半开探测请求过慢")
+                return
+            self._evaluate()
+
+    def record_failure(self, elapsed):
+        """记录一次失败调用"""
+        with self._lock:
+            self._calls.append((False, elapsed))
+            if self._state == STATE_HALF_OPEN:
+                self._open("半开探测请求失败")
+                return
+            self._evaluate()
+
+    def record_aborted(self):
+        """调用方因自身时限放弃了调用，不计入统计；半开状态下允许下一个探测请求"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _evaluate(self):
+        if self._state != STATE_CLOSED or len(self._calls) < self.min_calls:
+            return
+        total = len(self._calls)
+        failures = sum(1 for ok, _ in self._calls if not ok)
+        slow = sum(1 for _, elapsed in self._calls if elapsed >= self.slow_call_seconds)
+        if failures / total >= self.failure_rate_threshold:
+            self._open(f"失败率 {failures}/{total}")
+        elif slow / total >= self.slow_rate_threshold:
+            self._open(f"慢请求率 {slow}/{total}")
+
+    def _open(self, reason):
+        self._state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        logging.warning(f"熔断器[{self.name}]已熔断: {reason}")
+
+    def _close(self):
+        self._state = STATE_CLOSED
+        self._calls.clear()
+        self._probe_in_flight = False
+        logging.info(f"熔断器[{self.name}]已恢复")
+
+    def stats(self):
+        """返回熔断器统计信息"""
+        with self._lock:
+            self._maybe_half_open()
+            total = len(self._calls)
+            failures = sum(1 for ok, _ in self._calls if not ok)
+            slow = sum(
+                1 for _, elapsed in self._calls if elapsed >= self.slow_call_seconds
+            )
+            return {
+                "name": self.name,
+                "state": self._state,
+                "calls": total,
+                "failures": failures,
+                "slow_calls": slow,
+            }
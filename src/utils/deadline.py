@@ -0,0 +1,90 @@
+import threading
+import time
+
+# 一次查空教室从收到消息到回复的总时限（秒）
+QUERY_BUDGET = 10.0
+
+# 为整理和发送回复预留的时间，登录和请求只能使用剩余部分
+REPLY_RESERVE = 0.5
+
+# 查询经过的阶段
+STAGE_LOGIN = "login"  # 等待登录
+STAGE_FETCH = "fetch"  # 请求教务系统
+STAGE_PARSE = "parse"  # 解析课表
+STAGE_NAMES = {
+    STAGE_LOGIN: "登录",
+    STAGE_FETCH: "请求",
+    STAGE_PARSE: "解析",
+}
+
+# 各阶段用尽时限的次数
+_stats = {"queries": 0, "exhausted": {stage: 0 for stage in STAGE_NAMES}}
+_stats_lock = threading.Lock()
+
+
+class DeadlineExceeded(Exception):
+    """查询时限已用尽，stage 为用尽时所处的阶段"""
+
+    def __init__(self, stage):
+        super().__init__(f"查询时限已用尽（{STAGE_NAMES.get(stage, stage)}）")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    一次查询的截止时间，随查询传给登录、请求和解析，各阶段只使用剩余的时间
+
+    参数:
+        budget (float): 总时限（秒），默认为 QUERY_BUDGET
+        reserve (float): 为回复预留的秒数，默认为 REPLY_RESERVE
+    """
+
+    def __init__(self, budget=None, reserve=None):
+        self.budget = QUERY_BUDGET if budget is None else budget
+        self.reserve = REPLY_RESERVE if reserve is None else reserve
+        self.expires_at = time.monotonic() + self.budget
+        with _stats_lock:
+            _stats["queries"] += 1
+
+    def remaining(self):
+        """登录、请求等阶段还能使用的秒数，已扣除回复预留时间"""
+        return max(0.0, self.expires_at - self.reserve - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, stage):
+        """时限已用尽时记录并抛出 DeadlineExceeded"""
+        if self.expired():
+            self.exhaust(stage)
+            raise DeadlineExceeded(stage)
+
+    def exhaust(self, stage):
+        """记录某阶段用尽了时限"""
+        with _stats_lock:
+            exhausted = _stats["exhausted"]
+            exhausted[stage] = exhausted.get(stage, 0) + 1
+
+    def clamp_timeout(self, timeout):
+        """
+        把请求超时限制在剩余时间内
+
+        参数:
+            timeout (float | tuple): requests 的超时设置，(连接超时, 读取超时) 或单个值
+
+        返回:
+            float | tuple: 不超过剩余时间的超时设置
+        """
+        remaining = self.remaining()
+        if isinstance(timeout, tuple):
+            return tuple(min(t, remaining) for t in timeout)
+        return min(timeout, remaining)
+
+
+def format_deadline_stats():
+    """格式化各阶段用尽时限的次数"""
+    with _stats_lock:
+        queries = _stats["queries"]
+        exhausted = dict(_stats["exhausted"])
+    parts = [f"{STAGE_NAMES.get(stage, stage)}{n}" for stage, n in exhausted.items()]
+    return f"时限 {QUERY_BUDGET:g} 秒，共 {queries} 次查询，超时: {' '.join(parts)}"
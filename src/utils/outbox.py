@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+# 全局发送速率（条/秒）和突发上限，超出后排队，避免 OneBot 端限流或丢弃消息
+GLOBAL_RATE = 10
+GLOBAL_BURST = 20
+
+# 同一个群或私聊中相邻两条消息的最小间隔（秒）
+TARGET_INTERVAL = 0.3
+
+# 同一群中相同查询的回复在该秒数内合并：尚未发出的回复直接合并，
+# 已发出的只回一句提示，不再重复发送完整结果
+MERGE_WINDOW = 10
+
+# 撤回操作不属于任何群，共用一个队列
+_DELETE_TARGET = ("delete", None)
+
+
+class _Outgoing:
+    """一条待发送的消息或撤回操作"""
+
+    def __init__(self, kind, websocket, target_id, message=None, reply_to=None):
+        self.kind = kind
+        self.websocket = websocket
+        self.target_id = target_id
+        self.message = message
+        self.reply_to = reply_to
+        self.user_id = None
+        self.mentions = []
+        self.merge_key = None
+        self.callbacks = []
+        self.queued_at = time.monotonic()
+        self.sent = False
+
+    def render(self):
+        """生成最终的消息文本，合并的回复用 @ 通知其余提问者"""
+        prefix = f"[CQ:reply,id={self.reply_to}]" if self.reply_to else ""
+        if self.mentions:
+            prefix += "".join(f"[CQ:at,qq={uid}]" for uid in self.mentions) + "\n"
+        return prefix + self.message
+
+
+class OutboundQueue:
+    """
+    出站消息调度器
+
+    每个群、私聊各有一个按顺序发送的队列，所有队列共用一个令牌桶限制总速率，
+    同一目标相邻消息之间至少间隔 TARGET_INTERVAL。发送是非阻塞的：调用方入队
+    后立即返回，由后台任务按速率发出，处理协程不必等待发送和撤回完成。
+
+    参数:
+        send_group (coroutine function): (websocket, 群号, 消息) 的发送函数
+        send_private (coroutine function): (websocket, QQ号, 消息) 的发送函数
+        delete (coroutine function): (websocket, 消息ID) 的撤回函数
+    """
+
+    def __init__(self, send_group, send_private, delete):
+        self._senders = {
+            "group": send_group,
+            "private": send_private,
+            "delete": delete,
+        }
+        self._queues = {}  # 目标 -> deque[_Outgoing]
+        self._workers = {}  # 目标 -> 发送任务
+        self._last_sent = {}  # 目标 -> 上次发送时间
+        self._recent = {}  # (目标, 合并键) -> 上次发出的时间
+        self._tokens = GLOBAL_BURST
+        self._updated = time.monotonic()
+        self._scheduled = 0  # 尚未到期的延迟撤回数
+        self.stats = {
+            "sent": 0,
+            "failed": 0,
+            "merged": 0,
+            "deduplicated": 0,
+            "cancelled": 0,
+            "max_queue": 0,
+            "wait_total": 0.0,
+        }
+
+    def send_group(
+        self,
+        websocket,
+        group_id,
+        message,
+        reply_to=None,
+        user_id=None,
+        merge_key=None,
+        on_sent=None,
+    ):
+        """
+        将群消息加入发送队列
+
+        参数:
+            websocket: 连接
+            group_id (str): 群号
+            message (str): 消息正文，指定 reply_to 时不含回复前缀
+            reply_to (str, optional): 回复的消息ID
+            user_id (str, optional): 提问者，回复被合并时用于 @ 通知
+            merge_key (tuple, optional): 相同合并键的回复视为同一查询的结果
+            on_sent (callable, optional): 消息发出后调用
+
+        返回:
+            _Outgoing: 入队的消息，可用于 cancel；与已有回复合并时返回那条回复
+        """
+        target = ("group", group_id)
+        if merge_key is not None:
+            merged = self._merge(target, merge_key, reply_to, user_id, on_sent)
+            if merged is not None:
+                return merged
+            recent = self._recent.get((target, merge_key))
+            if recent is not None and time.monotonic() - recent < MERGE_WINDOW:
+                # 刚发过相同的结果，只回一句提示
+                self.stats["deduplicated"] += 1
+                message = "查询结果与上方刚发出的回复相同，请向上查看"
+                merge_key = None
+
+        item = _Outgoing("group", websocket, group_id, message, reply_to)
+        item.merge_key = merge_key
+        item.user_id = user_id
+        if on_sent is not None:
+            item.callbacks.append(on_sent)
+        self._enqueue(target, item)
+        return item
+
+    def send_private(self, websocket, user_id, message):
+        """将私聊消息加入发送队列"""
+        item = _Outgoing("private", websocket, user_id, message)
+        self._enqueue(("private", user_id), item)
+        return item
+
+    def delete_later(self, websocket, message_id, delay=0.0):
+        """在 delay 秒后撤回消息，不占用调用方协程"""
+        item = _Outgoing("delete", websocket, message_id)
+        if delay <= 0:
+            self._enqueue(_DELETE_TARGET, item)
+            return
+
+        def enqueue():
+            self._scheduled -= 1
+            self._enqueue(_DELETE_TARGET, item)
+
+        self._scheduled += 1
+        asyncio.get_running_loop().call_later(delay, enqueue)
+
+    def cancel(self, item):
+        """
+        取消尚未发出的消息，如查询结果已就绪时的"正在查询"提示
+
+        返回:
+            bool: 是否取消成功，已发出的消息返回 False
+        """
+        target = (
+            _DELETE_TARGET if item.kind == "delete" else (item.kind, item.target_id)
+        )
+        queue = self._queues.get(target)
+        if item.sent or queue is None or item not in queue:
+            return False
+        queue.remove(item)
+        self.stats["cancelled"] += 1
+        return True
+
+    def _merge(self, target, merge_key, reply_to, user_id, on_sent):
+        """把相同查询的回复合并到队列中尚未发出的那条回复上"""
+        for item in self._queues.get(target, ()):
+            if item.merge_key != merge_key:
+                continue
+            if user_id not in (None, item.user_id) and user_id not in item.mentions:
+                item.mentions.append(user_id)
+            if on_sent is not None:
+                item.callbacks.append(on_sent)
+            self.stats["merged"] += 1
+            return item
+        return None
+
+    def _enqueue(self, target, item):
+        queue = self._queues.setdefault(target, deque())
+        queue.append(item)
+        self.stats["max_queue"] = max(self.stats["max_queue"], len(queue))
+        if target not in self._workers:
+            self._workers[target] = asyncio.get_running_loop().create_task(
+                self._run(target, queue)
+            )
+
+    async def _acquire(self):
+        """从全局令牌桶取一个令牌，不足时等待"""
+        while True:
+            now = time.monotonic()
+            self._tokens = min(
+                GLOBAL_BURST, self._tokens + (now - self._updated) * GLOBAL_RATE
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / GLOBAL_RATE)
+
+    async def _run(self, target, queue):
+        interval = 0 if target == _DELETE_TARGET else TARGET_INTERVAL
+        try:
+            while queue:
+                item = queue[0]
+                wait = self._last_sent.get(target, 0) + interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                await self._acquire()
+                if not queue or queue[0] is not item:
+                    # 等待期间被取消
+                    continue
+                queue.popleft()
+                item.sent = True
+                delivered = await self._send(item)
+                self._last_sent[target] = time.monotonic()
+                if delivered and item.merge_key is not None:
+                    self._recent[(target, item.merge_key)] = time.monotonic()
+                for callback in item.callbacks:
+                    try:
+                        callback()
+                    except Exception as e:
+                        logging.error(f"消息发送回调出错: {str(e)}")
+        finally:
+            del self._workers[target]
+            if not queue:
+                self._queues.pop(target, None)
+            self._prune_recent()
+
+    async def _send(self, item):
+        self.stats["wait_total"] += time.monotonic() - item.queued_at
+        try:
+            if item.kind == "delete":
+                await self._senders["delete"](item.websocket, item.target_id)
+            else:
+                await self._senders[item.kind](
+                    item.websocket, item.target_id, item.render()
+                )
+            self.stats["sent"] += 1
+            return True
+        except Exception as e:
+            self.stats["failed"] += 1
+            logging.error(f"发送消息失败: {str(e)}")
+            return False
+
+    def _prune_recent(self):
+        now = time.monotonic()
+        for key in [k for k, t in self._recent.items() if now - t >= MERGE_WINDOW]:
+            del self._recent[key]
+
+    def pending(self):
+        """排队中的消息数"""
+        return sum(len(queue) for queue in self._queues.values()) + self._scheduled
+
+    async def drain(self):
+        """等待所有排队的消息和延迟撤回发送完毕，用于压测和退出前清空队列"""
+        while self._workers or self._scheduled:
+            if self._workers:
+                await asyncio.gather(
+                    *list(self._workers.values()), return_exceptions=True
+                )
+            else:
+                await asyncio.sleep(0.05)
+
+    def format_stats(self):
+        """格式化发送统计"""
+        s = self.stats
+        handled = s["sent"] + s["failed"]
+        avg_wait = s["wait_total"] / handled * 1000 if handled else 0.0
+        return (
+            f"已发送{s['sent']} 失败{s['failed']} 合并{s['merged']} "
+            f"去重{s['deduplicated']} 取消{s['cancelled']} 排队中{self.pending()} "
+            f"最长队列{s['max_queue']} 平均排队{avg_wait:.0f}ms"
+        )
@@ -1,40 +1,157 @@
 from requests import Session
+import asyncio
+import json
+import logging
+import os
 import threading
+from contextlib import contextmanager
 
-# 全局session变量
-_session = None
-_session_lock = threading.Lock()
-
-
-def init_session():
-    """初始化全局会话"""
-    global _session
-    with _session_lock:
-        if _session is None:
-            _session = Session()
-            _session.headers.update(
-                {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36 Edg/132.0.0.0",
-                    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-                    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
-                    "Connection": "keep-alive",
-                }
-            )
-        return _session
-
-
-def get_session():
-    """获取当前会话，如果不存在则初始化"""
-    global _session
-    if _session is None:
-        return init_session()
-    return _session
-
-
-def reset_session():
-    """重置会话"""
-    global _session
-    with _session_lock:
-        if _session is not None:
-            _session.close()
-        _session = None
+from .upstream_client import mount_pool
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36 Edg/132.0.0.0",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+    "Connection": "keep-alive",
+}
+
+
+def new_session(cookies=None):
+    """创建带默认请求头和连接池配置的新会话，不影响当前正在使用的会话"""
+    session = Session()
+    session.headers.update(DEFAULT_HEADERS)
+    mount_pool(session)
+    for name, value in (cookies or {}).items():
+        session.cookies.set(name, value)
+    return session
+
+
+class _Entry:
+    """一代会话及其租约计数"""
+
+    def __init__(self, session, generation):
+        self.session = session
+        self.generation = generation
+        self.leases = 0
+        self.retired = False
+
+
+class SessionManager:
+    """
+    教务系统会话管理器
+
+    查询通过 lease() 租用当前会话，重新登录时在新会话上完成登录后用 swap()
+    原子替换。被替换的旧会话要等所有租约归还后才关闭，正在进行的查询不会
+    用到被重置了一半的会话。租约计数用线程锁保护，可在线程池中使用；
+    重新登录用 asyncio 锁串行化，同一时间只有一个协程在登录。
+    Cookie 的保存和加载也统一在这里完成。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current = None
+        self._generation = 0
+        self._login_locks = {}
+
+    @property
+    def generation(self):
+        """当前会话的代数，每次 swap 加一"""
+        return self._generation
+
+    @contextmanager
+    def lease(self):
+        """租用当前会话，退出时归还；租用期间会话不会被关闭"""
+        with self._lock:
+            if self._current is None:
+                self._current = _Entry(new_session(), self._generation)
+            entry = self._current
+            entry.leases += 1
+        try:
+            yield entry.session
+        finally:
+            with self._lock:
+                entry.leases -= 1
+                close = entry.retired and entry.leases == 0
+            if close:
+                entry.session.close()
+
+    def swap(self, session, cookie_file=None):
+        """
+        原子替换当前会话，旧会话在最后一个租约归还后关闭
+
+        参数:
+            session (Session): 已登录的新会话
+            cookie_file (str, optional): 指定时将新会话的 Cookie 保存到该文件
+        """
+        with self._lock:
+            old = self._current
+            self._generation += 1
+            self._current = _Entry(session, self._generation)
+            close = False
+            if old is not None:
+                old.retired = True
+                close = old.leases == 0
+        if close:
+            old.session.close()
+        logging.info(f"教务系统会话已替换为第 {self._generation} 代")
+        if cookie_file:
+            self.save_cookies(session, cookie_file)
+
+    def login_lock(self):
+        """返回当前事件循环的登录锁，保证同一时间只有一个协程在登录"""
+        loop = asyncio.get_running_loop()
+        lock = self._login_locks.get(loop)
+        if lock is None:
+            # 事件循环结束后旧锁不再使用，只保留当前循环的锁
+            self._login_locks = {loop: asyncio.Lock()}
+            lock = self._login_locks[loop]
+        return lock
+
+    @staticmethod
+    def save_cookies(session, cookie_file):
+        """将会话的 Cookie 写入文件，写入临时文件后原子替换"""
+        try:
+            cookies_dict = {name: value for name, value in session.cookies.items()}
+            tmp_path = f"{cookie_file}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(cookies_dict, f)
+            os.replace(tmp_path, cookie_file)
+            logging.info("会话已保存到文件")
+            return True
+        except Exception as e:
+            logging.error(f"保存会话失败: {str(e)}")
+            return False
+
+    @staticmethod
+    def load_cookies(cookie_file):
+        """
+        从文件加载 Cookie 到一个新会话，不替换当前会话
+
+        返回:
+            Session: 新会话，文件不存在或无法读取时返回 None
+        """
+        if not os.path.exists(cookie_file):
+            logging.info("会话文件不存在，需要重新登录")
+            return None
+        try:
+            with open(cookie_file, "r") as f:
+                return new_session(json.load(f))
+        except Exception as e:
+            logging.error(f"加载会话失败: {str(e)}")
+            return None
+
+    def close(self):
+        """关闭当前会话，用于进程退出"""
+        with self._lock:
+            entry, self._current = self._current, None
+        if entry is not None:
+            entry.session.close()
+
+
+# 全局会话管理器
+session_manager = SessionManager()
+
+
+def lease_session():
+    """租用当前教务系统会话，用法: with lease_session() as session: ..."""
+    return session_manager.lease()
@@ -0,0 +1,156 @@
+import itertools
+import logging
+import reprlib
+import threading
+import time
+
+# 摘要最多显示的字符数
+SUMMARY_MAX_CHARS = 200
+
+# 平时每多少次记录一次完整内容，0 表示不抽样
+SAMPLE_EVERY = 100
+
+# 抽样记录的完整内容最多显示的字符数
+SAMPLE_MAX_CHARS = 2000
+
+# 调试模式默认持续的秒数，到期自动关闭，避免忘记关闭后日志暴涨
+TRACE_SECONDS = 600
+
+# 抽样记录时，嵌套结构中每层最多展开的元素数；按这些上限生成文本，
+# 不会先把整份课表格式化成字符串再截断
+_sample_repr = reprlib.Repr()
+_sample_repr.maxlevel = 4
+_sample_repr.maxlist = _sample_repr.maxtuple = _sample_repr.maxset = 10
+_sample_repr.maxdict = 12
+_sample_repr.maxstring = 80
+_sample_repr.maxother = 80
+
+_trace_until = 0.0
+_counters = {}
+_stats = {"summaries": 0, "sampled": 0, "traced": 0, "skipped": 0}
+_lock = threading.Lock()
+
+
+def set_trace(enabled, seconds=None):
+    """
+    开启或关闭调试模式，调试模式下大对象记录完整内容，抽样的日志全部记录
+
+    参数:
+        enabled (bool): 是否开启
+        seconds (float, optional): 持续秒数，默认为 TRACE_SECONDS，0 表示不自动关闭
+    """
+    global _trace_until
+    if not enabled:
+        _trace_until = 0.0
+    elif seconds == 0:
+        _trace_until = float("inf")
+    else:
+        _trace_until = time.monotonic() + (seconds or TRACE_SECONDS)
+    logging.warning(f"调试日志已{'开启' if enabled else '关闭'}")
+
+
+def trace_enabled():
+    return time.monotonic() < _trace_until
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+
+def should_sample(name, every=None):
+    """
+    按名称计数抽样，调试模式下总是返回 True
+
+    参数:
+        name (str): 抽样点名称，各抽样点分别计数
+        every (int, optional): 每多少次返回一次 True，默认为 SAMPLE_EVERY
+
+    返回:
+        bool: 本次是否记录
+    """
+    if trace_enabled():
+        return True
+    every = SAMPLE_EVERY if every is None else every
+    if not every:
+        return False
+    with _lock:
+        counter = _counters.setdefault(name, itertools.count(1))
+        return next(counter) % every == 0
+
+
+def summarize(value, max_chars=SUMMARY_MAX_CHARS):
+    """
+    生成大对象的简短摘要，只看顶层，列表、字典等只显示元素个数
+
+    参数:
+        value: 要摘要的对象
+        max_chars (int): 摘要最多的字符数
+
+    返回:
+        str: 如 "status='success', data=<128项>, stale=False"
+    """
+    if isinstance(value, dict):
+        parts = []
+        for key, item in value.items():
+            if isinstance(item, (list, tuple, set, dict)):
+                parts.append(f"{key}=<{len(item)}项>")
+            elif isinstance(item, str) and len(item) > 40:
+                parts.append(f"{key}=<{len(item)}字符>")
+            else:
+                parts.append(f"{key}={item!r}")
+        text = ", ".join(parts)
+    elif isinstance(value, (list, tuple, set)):
+        text = f"<{len(value)}项>"
+    elif isinstance(value, str) and len(value) > max_chars:
+        text = f"<{len(value)}字符> {value[:max_chars]}"
+    else:
+        text = repr(value)
+    if len(text) > max_chars:
+        text = text[:max_chars] + "..."
+    return text
+
+
+def log_payload(label, payload, level=logging.INFO):
+    """
+    记录查询结果等大对象
+
+    平时只记录摘要，每 SAMPLE_EVERY 次抽样记录一次截断的完整内容；
+    调试模式下每次都记录完整内容。日志级别未启用时不做任何格式化。
+
+    参数:
+        label (str): 日志前缀，如 "查询结果"
+        payload: 要记录的对象
+        level (int): 日志级别
+    """
+    if not logging.getLogger().isEnabledFor(level):
+        _count("skipped")
+        return
+    if trace_enabled():
+        _count("traced")
+        logging.log(level, f"{label}: {payload!r}")
+    elif should_sample(label):
+        _count("sampled")
+        text = _sample_repr.repr(payload)
+        if len(text) > SAMPLE_MAX_CHARS:
+            text = text[:SAMPLE_MAX_CHARS] + "..."
+        logging.log(level, f"{label}（抽样）: {text}")
+    else:
+        _count("summaries")
+        logging.log(level, f"{label}: {summarize(payload)}")
+
+
+def format_log_stats():
+    """格式化调试模式状态和大对象日志的记录次数"""
+    if not trace_enabled():
+        mode = "关闭"
+    elif _trace_until == float("inf"):
+        mode = "开启（不自动关闭）"
+    else:
+        mode = f"开启（{(_trace_until - time.monotonic()) / 60:.0f} 分钟后关闭）"
+    with _lock:
+        stats = dict(_stats)
+    return (
+        f"调试模式{mode}，摘要 {stats['summaries']} 条，抽样 {stats['sampled']} 条，"
+        f"完整 {stats['traced']} 条，未启用级别跳过 {stats['skipped']} 条"
+    )
@@ -0,0 +1,217 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .deadline import STAGE_FETCH, DeadlineExceeded
+
+# 每个主机保持的连接数，应不小于同时访问教务系统的线程数
+POOL_SIZE = 8
+
+# 各接口的超时时间（连接超时, 读取超时），单位秒
+DEFAULT_TIMEOUT = (5, 15)
+ENDPOINT_TIMEOUTS = {
+    "home": (5, 10),
+    "captcha": (5, 10),
+    "login": (5, 15),
+    "main_page": (5, 10),
+    "session_check": (3, 5),
+    "classroom_page": (5, 10),
+    "init_jc": (5, 10),
+    # 全校整周课表较大，读取超时放宽
+    "classtable": (5, 30),
+}
+
+# 重试次数和退避时间，退避时间在 [0, min(上限, 基数 * 2^n)] 内随机取值
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF_BASE = 0.3
+RETRY_BACKOFF_MAX = 3.0
+
+# 遇到这些状态码时重试
+RETRY_STATUS_CODES = {502, 503, 504}
+
+
+def backoff_delay(attempt):
+    """第 attempt 次重试前的等待秒数，指数退避加完全随机抖动"""
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2**attempt))
+
+
+def mount_pool(session):
+    """为会话挂载按 POOL_SIZE 配置的连接池，重试由 UpstreamClient 负责"""
+    adapter = HTTPAdapter(
+        pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=0
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class _EndpointMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.wire_bytes = 0
+        self.body_bytes = 0
+        self.elapsed = 0.0
+
+
+class UpstreamClient:
+    """
+    访问教务系统的统一入口
+
+    按接口名称选择超时时间，幂等请求在连接错误、超时和 5xx 网关错误时按带抖动
+    的指数退避重试，并按接口统计请求数、重试数、连接复用率和压缩效果。
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def get(self, session, endpoint, url, **kwargs):
+        return self.request(session, "GET", endpoint, url, **kwargs)
+
+    def post(self, session, endpoint, url, **kwargs):
+        return self.request(session, "POST", endpoint, url, **kwargs)
+
+    def request(
+        self, session, method, endpoint, url, retry=None, deadline=None, **kwargs
+    ):
+        """
+        发送请求
+
+        参数:
+            session (Session): 使用的会话
+            method (str): 请求方法
+            endpoint (str): 接口名称，用于选择超时时间和统计
+            url (str): 请求地址
+            retry (bool, optional): 是否允许重试，默认只重试 GET
+            deadline (Deadline, optional): 查询时限，超时和重试等待不超过剩余时间
+            **kwargs: 传给 session.request 的其他参数
+
+        返回:
+            Response: 响应，重试用尽后抛出最后一次的异常；
+                时限用尽时抛出 DeadlineExceeded
+        """
+        timeout = kwargs.pop(
+            "timeout", ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+        )
+        if retry is None:
+            retry = method == "GET"
+        attempts = RETRY_ATTEMPTS if retry else 1
+
+        for attempt in range(attempts):
+            if attempt:
+                delay = backoff_delay(attempt)
+                if deadline is not None and delay >= deadline.remaining():
+                    deadline.exhaust(STAGE_FETCH)
+                    raise DeadlineExceeded(STAGE_FETCH)
+                self._record(endpoint, retries=1)
+                time.sleep(delay)
+
+            if deadline is not None:
+                deadline.check(STAGE_FETCH)
+                kwargs["timeout"] = deadline.clamp_timeout(timeout)
+            else:
+                kwargs["timeout"] = timeout
+
+            created_before = self._connections_created(session, url)
+            start = time.monotonic()
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(endpoint, failures=1, elapsed=time.monotonic() - start)
+                if deadline is not None and deadline.expired():
+                    # 超时是因为时限被截短，不代表教务系统出错
+                    deadline.exhaust(STAGE_FETCH)
+                    raise DeadlineExceeded(STAGE_FETCH) from e
+                if attempt + 1 >= attempts:
+                    raise
+                logging.warning(f"请求 {endpoint} 失败，准备重试: {str(e)}")
+                continue
+
+            created_after = self._connections_created(session, url)
+            tracked = created_before is not None and created_after is not None
+            new_connection = tracked and created_after > created_before
+            self._record(
+                endpoint,
+                requests=1,
+                new_connections=int(new_connection),
+                reused_connections=int(tracked and not new_connection),
+                wire_bytes=self._wire_bytes(response),
+                body_bytes=len(response.content),
+                elapsed=time.monotonic() - start,
+            )
+            if response.status_code in RETRY_STATUS_CODES and attempt + 1 < attempts:
+                logging.warning(
+                    f"请求 {endpoint} 返回 {response.status_code}，准备重试"
+                )
+                continue
+            return response
+
+    @staticmethod
+    def _wire_bytes(response):
+        """实际传输的字节数，压缩响应为解压前的大小"""
+        body = response.content
+        try:
+            return response.raw.tell() or len(body)
+        except Exception:
+            return len(body)
+
+    @staticmethod
+    def _connections_created(session, url):
+        """
+        该地址所用连接池累计新建的连接数，用于判断请求是否复用了连接；
+        并发请求时可能把别的请求新建的连接计到本次，只作为近似统计
+        """
+        try:
+            pools = session.get_adapter(url).poolmanager.pools
+            return sum(pools[key].num_connections for key in pools.keys())
+        except Exception:
+            return None
+
+    def _record(self, endpoint, **counters):
+        with self._lock:
+            metrics = self._metrics.setdefault(endpoint, _EndpointMetrics())
+            for name, value in counters.items():
+                setattr(metrics, name, getattr(metrics, name) + value)
+
+    def stats(self):
+        """返回各接口的统计数据"""
+        with self._lock:
+            stats = {}
+            for endpoint, m in self._metrics.items():
+                connections = m.new_connections + m.reused_connections
+                stats[endpoint] = {
+                    "requests": m.requests,
+                    "failures": m.failures,
+                    "retries": m.retries,
+                    "reuse_rate": (
+                        m.reused_connections / connections if connections else 0.0
+                    ),
+                    "compression_ratio": (
+                        m.wire_bytes / m.body_bytes if m.body_bytes else 1.0
+                    ),
+                    "avg_ms": m.elapsed / m.requests * 1000 if m.requests else 0.0,
+                }
+            return stats
+
+    def format_stats(self):
+        """格式化各接口的统计数据"""
+        lines = []
+        for endpoint, s in sorted(self.stats().items()):
+            lines.append(
+                f"{endpoint}: 请求{s['requests']} 失败{s['failures']} "
+                f"重试{s['retries']} 连接复用{s['reuse_rate']:.0%} "
+                f"传输/原始{s['compression_ratio']:.1%} 平均{s['avg_ms']:.0f}ms"
+            )
+        return "\n".join(lines) or "暂无请求"
+
+
+# 全局上游客户端
+upstream_client = UpstreamClient()